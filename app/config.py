@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
-from typing import Optional
+from typing import Dict, List, Optional
 from pathlib import Path
 import logging
 
@@ -19,7 +19,113 @@ class Settings(BaseSettings):
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
     GEMINI_API_KEY: str
-    
+
+    # Resolved user + patient profile per token subject (see core/dependencies.py)
+    IDENTITY_CACHE_TTL_SECONDS: int = 60
+    IDENTITY_CACHE_MAX_ENTRIES: int = 10000
+
+    # Password hashing (see core/security.py and scripts/calibrate_password_hashing.py).
+    # Unset Argon2 parameters fall back to the passlib defaults.
+    ARGON2_TIME_COST: Optional[int] = None
+    ARGON2_MEMORY_COST: Optional[int] = None # KiB
+    ARGON2_PARALLELISM: Optional[int] = None
+    PASSWORD_HASH_TARGET_MS: int = 250
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_CONCURRENCY: int = 32
+
+    # Raw sensor uploads (see services/sensor_ingest.py)
+    SENSOR_UPLOAD_MAX_BYTES: int = 200 * 1024 * 1024
+    SENSOR_UPLOAD_READ_BYTES: int = 1024 * 1024
+    SENSOR_UPLOAD_MAX_COLUMNS: int = 64
+    SENSOR_UPLOAD_STALE_SECONDS: int = 900 # An upload still "processing" after this was orphaned by a crash
+    SENSOR_DEFAULT_SAMPLE_RATE_HZ: float = 100.0 # Used when a recording has no timestamp column
+    SENSOR_BUCKET_SECONDS: int = 3600
+    SENSOR_BUCKET_MAX_SAMPLES: int = 20000 # 64 float32 channels -> ~5 MB per bucket, below the 16 MB BSON limit
+
+    # Gait anomaly models (see services/anomaly_models.py and scripts/train_gait_anomaly_models.py)
+    GAIT_MODEL_DIR: str = str(BASE_DIR / "model_registry" / "gait_anomaly")
+    GAIT_MODEL_MAX_LOADED_VERSIONS: int = 2
+    GAIT_MODEL_MIN_COHORT_SAMPLES: int = 200
+
+    # Per-patient running baselines (see services/patient_baseline.py)
+    BASELINE_EWMA_ALPHA: float = 0.1
+    BASELINE_MIN_SAMPLES: int = 7 # Records needed before deviations are reported
+
+    # Bulk re-scoring of daily_metrics (see services/rescoring.py)
+    RESCORE_BATCH_SIZE: int = 5000
+    RESCORE_MAX_DUTY: float = 0.5 # Fraction of wall time the job may spend working
+    RESCORE_TARGET_WRITE_MS: float = 500 # Slower bulk writes halve the batch size
+
+    # Per-cohort clinical thresholds, e.g. {"transfemoral": {"walking_speed_min": 0.6}}
+    # (see services/clinical_rules.py; JSON in the environment)
+    CLINICAL_COHORT_OVERRIDES: Dict[str, Dict[str, float]] = {}
+
+    # Import and warm the ML / PDF / Gemini modules at startup instead of on first
+    # use; under gunicorn (gunicorn.conf.py) this happens once in the master
+    PRELOAD_HEAVY_MODULES: bool = False
+
+    # PDF rendering (see services/pdf_pool.py)
+    PDF_RENDER_WORKERS: int = 2 # Processes per web worker
+    PDF_RENDER_MAX_QUEUE: int = 16 # Renders running or waiting per web worker; more get a 503
+    PDF_STREAM_CHUNK_BYTES: int = 64 * 1024
+
+    # Gemini report summaries (see services/summary_cache.py)
+    SUMMARY_CACHE_TTL_SECONDS: int = 86400 # Fresh for a day, then refreshed in the background
+    SUMMARY_CACHE_STALE_SECONDS: int = 30 * 86400 # Kept (and served while refreshing) this long
+    SUMMARY_CACHE_LOCAL_SIZE: int = 1024
+    SUMMARY_CACHE_MATERIAL_CHANGE: float = 0.05 # Relative change in any average that needs a new summary
+
+    # Report averages (see services/analysis_engine.py)
+    HEALTH_SUMMARY_WINDOW_DAYS: int = 7
+    HEALTH_SUMMARY_WINDOWS: List[int] = [7, 30, 90] # Windows a report may ask for
+
+    # Nightly batched summary generation (see services/narrative_precompute.py)
+    NARRATIVE_PRECOMPUTE_HOUR: int = 2 # UTC
+    NARRATIVE_BATCH_SIZE: int = 8 # Patients per Gemini call
+    NARRATIVE_LOOKBACK_HOURS: float = 48 # New records looked for this far back; covers a missed night
+    NARRATIVE_TIMEOUT_SECONDS: float = 60 # Per batched attempt
+    NARRATIVE_DEADLINE_SECONDS: float = 150 # Per batch, including retries
+
+    # Gemini client (see services/gemini_service.py). Rate limits are per worker.
+    GEMINI_REQUESTS_PER_MINUTE: float = 15
+    GEMINI_BURST: int = 3
+    GEMINI_MAX_CONCURRENCY: int = 4
+    GEMINI_TIMEOUT_SECONDS: float = 12 # Per attempt
+    GEMINI_DEADLINE_SECONDS: float = 15 # Per call, including queueing and retries
+    GEMINI_MAX_RETRIES: int = 2
+    GEMINI_BASE_BACKOFF_SECONDS: float = 0.5
+    GEMINI_MAX_BACKOFF_SECONDS: float = 8
+    GEMINI_BREAKER_FAILURES: int = 5 # Consecutive transient failures that open the breaker
+    GEMINI_BREAKER_COOLDOWN_SECONDS: float = 30
+
+    # Model backend behind the Gemini client: "gemini", or "standin" for a local
+    # stand-in with canned answers (see services/ai_backends.py)
+    AI_BACKEND: str = "gemini"
+    AI_STANDIN_LATENCY: str = "lognormal:800:0.4" # Time to the first token, ms
+    AI_STANDIN_CHUNK_LATENCY: str = "uniform:20:60" # Between streamed chunks, ms
+    AI_STANDIN_CHUNK_CHARS: int = 40
+    AI_STANDIN_429_RATE: float = 0.0
+    AI_STANDIN_500_RATE: float = 0.0
+    AI_STANDIN_SEED: Optional[int] = 0 # None: different latencies and failures on every run
+    AI_STANDIN_RESPONSES_FILE: Optional[str] = None # JSON [{"match": "...", "response": "..."}]
+
+    # Shared in-flight computations across workers (see services/single_flight.py)
+    SINGLE_FLIGHT_LEASE_SECONDS: float = 30 # Renewed while the holder works
+    SINGLE_FLIGHT_POLL_SECONDS: float = 0.25
+    SINGLE_FLIGHT_RESULT_SECONDS: float = 10 # How long waiting workers can still read a finished result
+
+    # Per-patient clinical context for chat grounding (see services/clinical_context.py)
+    CLINICAL_CONTEXT_WINDOW_DAYS: int = 7 # Averages over this many days, compared with the same span before
+    CLINICAL_CONTEXT_TREND_THRESHOLD: float = 0.05 # Relative change reported as a trend rather than "stable"
+
+    # Chat history (see services/chat_store.py)
+    CHAT_BUCKET_SIZE: int = 50 # Messages per chat_buckets document
+    CHAT_CONTEXT_MESSAGES: int = 10 # Most recent messages sent to Gemini verbatim
+    CHAT_SUMMARY_BATCH: int = 20 # Older messages that trigger folding them into the rolling summary
+    CHAT_SUMMARY_MAX_CHARS: int = 2000
+    CHAT_HISTORY_PAGE_SIZE: int = 50
+    CHAT_HISTORY_MAX_PAGE_SIZE: int = 200
+
     PROJECT_NAME: str = "Prosthetic Gait Analysis API"
     VERSION: str = "1.0.0"
 
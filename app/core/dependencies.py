@@ -4,12 +4,55 @@ from jose import JWTError, jwt
 from app.config import settings
 from app.database import get_db
 from app.schemas.api_schemas import TokenData
-from app.models.database_models import User
+from app.core.cache import TTLCache
 from bson import ObjectId
 
 security_scheme = HTTPBearer()
 
-async def get_current_user(auth: HTTPAuthorizationCredentials = Depends(security_scheme)):
+# Resolved {"user", "profile"} pairs keyed by the token's user id (or email for
+# tokens issued before the `id` claim existed). Entries are per worker, so a
+# change made through another worker is visible after at most the TTL.
+_identity_cache = TTLCache(
+    maxsize=settings.IDENTITY_CACHE_MAX_ENTRIES,
+    ttl=settings.IDENTITY_CACHE_TTL_SECONDS
+)
+
+def invalidate_identity(user: dict) -> None:
+    """Drop the cached identity for a user after their user/profile document changes."""
+    _identity_cache.pop(str(user["_id"]), None)
+    _identity_cache.pop(user.get("email"), None)
+
+async def _load_identity(token_data: TokenData):
+    db = get_db()
+
+    if token_data.id and ObjectId.is_valid(token_data.id):
+        user = await db["users"].find_one({"_id": ObjectId(token_data.id)})
+    else:
+        user = await db["users"].find_one({"email": token_data.email})
+    if user is None or user.get("email") != token_data.email:
+        return None
+
+    profile = None
+    if user["role"] == "patient":
+        # Trust the patient_id claim written by /auth/login; fall back to the
+        # legacy ObjectId/str user_id lookup for tokens issued before the profile existed.
+        if token_data.patient_id and ObjectId.is_valid(token_data.patient_id):
+            profile = await db["patient_profiles"].find_one({"_id": ObjectId(token_data.patient_id)})
+        if profile is None:
+            profile = await db["patient_profiles"].find_one({
+                "$or": [
+                    {"user_id": user["_id"]},
+                    {"user_id": str(user["_id"])}
+                ]
+            })
+
+    return {"user": user, "profile": profile}
+
+async def get_current_identity(auth: HTTPAuthorizationCredentials = Depends(security_scheme)):
+    """
+    Resolve the authenticated user and (for patients) their profile in one step.
+    Served from the identity cache on hot paths, so most requests cost no DB round trip.
+    """
     token = auth.credentials
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -19,18 +62,34 @@ async def get_current_user(auth: HTTPAuthorizationCredentials = Depends(security
     try:
         payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
         email: str = payload.get("sub")
-        role: str = payload.get("role")
         if email is None:
             raise credentials_exception
-        token_data = TokenData(email=email, role=role)
+        token_data = TokenData(
+            email=email,
+            role=payload.get("role"),
+            id=payload.get("id"),
+            patient_id=payload.get("patient_id")
+        )
     except JWTError:
         raise credentials_exception
-    
-    db = get_db()
-    user_dict = await db["users"].find_one({"email": token_data.email})
-    if user_dict is None:
-        raise credentials_exception
-    return user_dict
+
+    cache_key = token_data.id or token_data.email
+    identity = _identity_cache.get(cache_key)
+    if identity is None or identity["user"].get("email") != token_data.email:
+        identity = await _load_identity(token_data)
+        if identity is None:
+            raise credentials_exception
+        _identity_cache.set(cache_key, identity)
+
+    # Routes decorate these dicts for their responses; hand out copies so the cached entry stays clean
+    profile = identity["profile"]
+    return {
+        "user": dict(identity["user"]),
+        "profile": dict(profile) if profile is not None else None
+    }
+
+async def get_current_user(identity: dict = Depends(get_current_identity)):
+    return identity["user"]
 
 def check_role(required_role: str):
     async def role_checker(current_user: dict = Depends(get_current_user)):
@@ -41,3 +100,12 @@ def check_role(required_role: str):
             )
         return current_user
     return role_checker
+
+async def get_patient_identity(identity: dict = Depends(get_current_identity)):
+    """Same as check_role("patient") but also hands back the resolved profile (may be None)."""
+    if identity["user"]["role"] != "patient":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="The user doesn't have enough privileges"
+        )
+    return identity
@@ -0,0 +1,147 @@
+"""
+Preload mode: import and warm the heavy modules once, before workers fork.
+
+Normally the ML, PDF and Gemini SDK modules are imported on first use inside
+request handlers, so the first such request on every worker pays the import,
+and every worker ends up holding its own copy. With PRELOAD_HEAVY_MODULES on
+and gunicorn's preload (see gunicorn.conf.py), the master process runs warm()
+and then gc.freeze(), and forks the workers. The workers start with everything
+imported and share those pages copy-on-write. Freezing keeps the garbage
+collector from writing to the shared objects, which would un-share their pages.
+
+Only code and read-only state is warmed here: network clients (Motor, the
+Gemini model, gRPC channels) and thread pools are still created after the fork.
+
+Each worker logs a startup report with its memory (RSS, and PSS, which splits
+shared pages between the processes mapping them) and, once it has served one,
+its first-request latency.
+"""
+from typing import Any, Dict, Optional
+import gc
+import importlib
+import logging
+import os
+import time
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+HEAVY_MODULES = (
+    "numpy",
+    "pandas",
+    "sklearn.ensemble",
+    "google.generativeai",
+    "reportlab.platypus",
+    "reportlab.lib.styles",
+    "reportlab.lib.colors",
+)
+
+_warmed_by: Optional[int] = None # pid of the process that ran warm()
+
+def warm() -> Dict[str, float]:
+    """
+    Import HEAVY_MODULES and warm the models and compiled rules. Returns the
+    seconds spent per step. Modules that are not installed are skipped.
+    """
+    global _warmed_by
+    timings: Dict[str, float] = {}
+
+    def step(name: str, fn):
+        start = time.perf_counter()
+        try:
+            fn()
+        except ImportError as e:
+            logger.warning(f"Preload skipped {name}: {e}")
+            return
+        timings[name] = time.perf_counter() - start
+
+    for module in HEAVY_MODULES:
+        step(module, lambda module=module: importlib.import_module(module))
+
+    def models():
+        from app.services import clinical_rules
+        from app.services.ai_engine import ai_engine
+        from app.services.anomaly_models import registry
+
+        ai_engine._ensure_initialized()
+        for cohort in (None, *clinical_rules.COHORT_OVERRIDES, *settings.CLINICAL_COHORT_OVERRIDES):
+            clinical_rules.rule_set(cohort)
+        loaded = registry.get()
+        if loaded is not None:
+            for cohort in loaded.manifest["cohorts"]:
+                loaded.model_for(cohort)
+
+    def pdf():
+        from app.services import pdf_templates
+        pdf_templates.warm()
+
+    step("models", models)
+    step("pdf templates", pdf)
+    _warmed_by = os.getpid()
+    logger.info(
+        f"Preloaded {len(timings)} steps in {sum(timings.values()):.2f}s: "
+        + ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items())
+    )
+    return timings
+
+def freeze():
+    """Move everything allocated so far out of the collector's reach before forking."""
+    gc.collect()
+    gc.freeze()
+
+def preload_state() -> str:
+    """"inherited" when warmed in a parent process, "local" when warmed here, else "off"."""
+    if _warmed_by is None:
+        return "off"
+    return "local" if _warmed_by == os.getpid() else "inherited"
+
+def memory_usage(pid: Optional[int] = None) -> Dict[str, float]:
+    """RSS / PSS / shared / private MB of a process, from /proc/<pid>/smaps_rollup (Linux)."""
+    path = f"/proc/{pid or 'self'}/smaps_rollup"
+    fields = {"Rss": 0, "Pss": 0, "Shared_Clean": 0, "Shared_Dirty": 0, "Private_Clean": 0, "Private_Dirty": 0}
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in fields:
+                    fields[key] = int(rest.split()[0])
+    except OSError:
+        import resource
+        return {"rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    return {
+        "rss_mb": fields["Rss"] / 1024,
+        "pss_mb": fields["Pss"] / 1024,
+        "shared_mb": (fields["Shared_Clean"] + fields["Shared_Dirty"]) / 1024,
+        "private_mb": (fields["Private_Clean"] + fields["Private_Dirty"]) / 1024,
+    }
+
+def _format_memory(memory: Dict[str, float]) -> str:
+    return ", ".join(f"{key[:-3]} {value:.1f} MB" for key, value in memory.items())
+
+def log_startup_report():
+    logger.info(f"Worker {os.getpid()} ready (preload: {preload_state()}): {_format_memory(memory_usage())}")
+
+class FirstRequestReport:
+    """
+    ASGI middleware that logs the latency of the first HTTP request each worker
+    serves, together with the worker's memory after it.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.first_request: Optional[Dict[str, Any]] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.first_request is not None:
+            return await self.app(scope, receive, send)
+        self.first_request = {}
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            latency_ms = (time.perf_counter() - start) * 1000
+            self.first_request.update(path=scope["path"], latency_ms=latency_ms, **memory_usage())
+            logger.info(
+                f"Worker {os.getpid()} first request {scope['method']} {scope['path']} took {latency_ms:.0f} ms "
+                f"(preload: {preload_state()}); {_format_memory(memory_usage())}"
+            )
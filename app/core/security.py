@@ -1,10 +1,50 @@
 from datetime import datetime, timedelta
-from typing import Any, Union
+from typing import Any, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import statistics
+import time
 from jose import jwt
 from passlib.context import CryptContext
 from app.config import settings
 
-pwd_context = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
+def build_crypt_context(
+    time_cost: Optional[int] = None,
+    memory_cost: Optional[int] = None,
+    parallelism: Optional[int] = None
+) -> CryptContext:
+    """
+    Argon2 for new hashes, Bcrypt accepted for legacy users. Hashes whose scheme
+    or Argon2 parameters differ from these are reported as needing an update.
+    """
+    argon2_options = {}
+    if time_cost:
+        argon2_options["argon2__time_cost"] = time_cost
+    if memory_cost:
+        argon2_options["argon2__memory_cost"] = memory_cost
+    if parallelism:
+        argon2_options["argon2__parallelism"] = parallelism
+    return CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto", **argon2_options)
+
+pwd_context = build_crypt_context(
+    settings.ARGON2_TIME_COST,
+    settings.ARGON2_MEMORY_COST,
+    settings.ARGON2_PARALLELISM
+)
+
+# Hashing is CPU and memory heavy (Argon2 allocates memory_cost KiB per call), so it
+# runs on a small dedicated pool. The semaphore caps how much work may queue up
+# behind it; argon2-cffi and bcrypt release the GIL while hashing.
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+_hash_slots = asyncio.Semaphore(settings.PASSWORD_HASH_MAX_CONCURRENCY)
+
+async def _run_in_hash_pool(fn, *args) -> Any:
+    async with _hash_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, fn, *args)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
@@ -18,6 +58,65 @@ def get_password_hash(password: str) -> str:
     """
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_in_hash_pool(pwd_context.verify, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_in_hash_pool(pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify off the event loop. When the stored hash is Bcrypt or uses outdated Argon2
+    parameters, also return a fresh hash to store (otherwise None).
+    """
+    return await _run_in_hash_pool(pwd_context.verify_and_update, plain_password, hashed_password)
+
+def calibrate_argon2(
+    target_ms: float = settings.PASSWORD_HASH_TARGET_MS,
+    max_memory_kib: int = 262144,
+    parallelism: Optional[int] = None,
+    samples: int = 3
+) -> dict:
+    """
+    Pick Argon2 parameters that take roughly `target_ms` per hash on this host.
+    Memory is raised first (it is what makes GPU attacks expensive), then time_cost.
+    Starts from the OWASP minimum of 19 MiB / t=2.
+    """
+    from passlib.hash import argon2
+
+    parallelism = parallelism or argon2.parallelism
+
+    def measure(time_cost: int, memory_cost: int) -> float:
+        handler = argon2.using(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            handler.hash("calibration-password")
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    time_cost, memory_cost = 2, 19456
+    elapsed = measure(time_cost, memory_cost)
+
+    while elapsed < target_ms and memory_cost * 2 <= max_memory_kib:
+        candidate = measure(time_cost, memory_cost * 2)
+        if candidate > target_ms * 1.25:
+            break
+        memory_cost, elapsed = memory_cost * 2, candidate
+
+    while elapsed < target_ms:
+        candidate = measure(time_cost + 1, memory_cost)
+        if candidate > target_ms * 1.25:
+            break
+        time_cost, elapsed = time_cost + 1, candidate
+
+    return {
+        "time_cost": time_cost,
+        "memory_cost": memory_cost,
+        "parallelism": parallelism,
+        "measured_ms": round(elapsed, 1)
+    }
+
 def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
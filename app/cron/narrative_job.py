@@ -0,0 +1,20 @@
+from app.database import db_instance
+from app.services.narrative_precompute import run_nightly
+import logging
+
+logger = logging.getLogger(__name__)
+
+async def precompute_daily_narratives():
+    """
+    Nightly cron job to generate report summaries ahead of the day's downloads.
+    """
+    db = db_instance.db
+    if db is None:
+        logger.error("Database connection not established for cron job.")
+        return
+
+    try:
+        stats = await run_nightly(db)
+        logger.info(f"Precomputed {stats['stored']} report summaries in {stats['calls']} AI call(s)")
+    except Exception as e:
+        logger.error(f"Narrative precompute failed: {e}")
@@ -1,6 +1,8 @@
 from app.database import db_instance
+from app.services.pdf_pool import PdfRenderBusy, pdf_pool
 from app.services.report_service import report_service
 from datetime import datetime, timedelta, timezone
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -60,8 +62,15 @@ async def generate_weekly_reports():
                 "high_skin_risk_count": stats.get("high_skin_risk_count", 0)
             }
             
-            # Generate PDF
-            pdf_path = report_service.generate_weekly_report(str(patient_id), patient.get("name", "Unknown"), report_data)
+            # Generate PDF in the render pool, off the event loop; downloads go first
+            while True:
+                try:
+                    pdf_path = await pdf_pool.render(
+                        report_service.generate_weekly_report, str(patient_id), patient.get("name", "Unknown"), report_data
+                    )
+                    break
+                except PdfRenderBusy as e:
+                    await asyncio.sleep(e.retry_after)
             
             # Store report metadata
             report_doc = {
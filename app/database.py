@@ -26,7 +26,38 @@ async def connect_to_mongo():
     # Create indexes for the new identity system
     await db_instance.db.patient_profiles.create_index("user_id", unique=True)
     await db_instance.db.daily_metrics.create_index("patient_id")
+    # Report windows: per-patient averages and latest record by date (see services/analysis_engine.py)
+    await db_instance.db.daily_metrics.create_index([("patient_id", 1), ("created_at", 1)])
     
+    # Content fingerprints: a resubmitted upload or daily input hits these instead of being stored twice
+    has_hash = {"content_hash": {"$exists": True}}
+    await db_instance.db.daily_metrics.create_index(
+        [("patient_id", 1), ("content_hash", 1)], unique=True, partialFilterExpression=has_hash
+    )
+    
+    await db_instance.db.patient_baselines.create_index("patient_id", unique=True)
+    
+    # Cached Gemini report summaries, dropped by Mongo once past expires_at
+    await db_instance.db.ai_summaries.create_index("expires_at", expireAfterSeconds=0)
+    await db_instance.db.ai_summaries.create_index([("patient_id", 1), ("created_at", -1)])
+    await db_instance.db.flight_leases.create_index("expires_at", expireAfterSeconds=0)
+    
+    # Raw sensor recordings: metadata + time-bucketed sample arrays
+    await db_instance.db.sensor_uploads.create_index("patient_id")
+    await db_instance.db.sensor_uploads.create_index(
+        [("patient_id", 1), ("content_hash", 1)], unique=True, partialFilterExpression=has_hash
+    )
+    await db_instance.db.sensor_buckets.create_index([("patient_id", 1), ("bucket_start", 1), ("t_min", 1)])
+    await db_instance.db.sensor_buckets.create_index([("upload_id", 1), ("seq", 1)], unique=True)
+    
+    # Chat grounding snapshot, one per patient (see services/clinical_context.py)
+    await db_instance.db.patient_clinical_context.create_index("patient_id", unique=True)
+    
+    # Chat sessions + fixed-size message buckets (see services/chat_store.py)
+    await db_instance.db.patient_chat_sessions.create_index([("patient_id", 1), ("session_status", 1)])
+    await db_instance.db.patient_chat_sessions.create_index([("patient_id", 1), ("updated_at", -1)])
+    await db_instance.db.chat_buckets.create_index([("session_id", 1), ("seq", 1)], unique=True)
+
     # Feedback Indexes
     await db_instance.db.patient_feedback.create_index("patient_id")
     await db_instance.db.patient_feedback.create_index("status")
@@ -23,21 +23,26 @@ async def lifespan(app: FastAPI):
     await connect_to_mongo()
     
     # 2. ML Engine Warmup (Optional/Lazy)
-    from app.services.ai_engine import ai_engine
-    # Deferring actual model loading to first use to save memory/time, 
-    # but we could call ai_engine._ensure_initialized() here if preferred.
+    # Deferred to first use unless preload mode is on. Under gunicorn's preload
+    # the master has already warmed everything and this worker inherited it.
+    from app.core.preload import log_startup_report, preload_state, warm
+    if settings.PRELOAD_HEAVY_MODULES and preload_state() == "off":
+        warm()
     
     # 3. Initialize Scheduler
     from apscheduler.schedulers.asyncio import AsyncIOScheduler
     from app.cron.weekly_job import generate_weekly_reports
+    from app.cron.narrative_job import precompute_daily_narratives
     
     scheduler = AsyncIOScheduler()
     scheduler.add_job(generate_weekly_reports, 'cron', day_of_week='mon', hour=0, minute=0)
+    scheduler.add_job(precompute_daily_narratives, 'cron', hour=settings.NARRATIVE_PRECOMPUTE_HOUR, minute=0, timezone='UTC')
     scheduler.start()
     app.state.scheduler = scheduler
     
     startup_duration = time.time() - startup_begin
     logger.info(f"✅ Application startup complete in {startup_duration:.2f}s")
+    log_startup_report()
     
     yield
     
@@ -46,6 +51,8 @@ async def lifespan(app: FastAPI):
     await close_mongo_connection()
     if hasattr(app.state, "scheduler"):
         app.state.scheduler.shutdown()
+    from app.services.pdf_pool import pdf_pool
+    pdf_pool.shutdown()
 
 app = FastAPI(
     title=settings.PROJECT_NAME, 
@@ -67,6 +74,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Logs each worker's first-request latency and memory (see app/core/preload.py)
+from app.core.preload import FirstRequestReport
+app.add_middleware(FirstRequestReport)
+
 # Routes - Imported inside to avoid slowing down the initial python process start
 from app.routes import auth, patient, admin, analysis, report, chat
 
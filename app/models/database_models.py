@@ -104,13 +104,20 @@ class DailyRecord(BaseModel):
     cadence_spm: float
     walking_speed_mps: float
     gait_symmetry_index: float
-    skin_temperature_c: float
-    skin_moisture: float
+    skin_temperature_c: Optional[float] = None # None = not measured (a recording without that channel)
+    skin_moisture: Optional[float] = None
     pressure_distribution_index: float
     daily_wear_hours: float
     gait_abnormality: str # "Normal/Abnormal"
     skin_risk: str # "Low/Medium/High"
     prosthetic_health_score: float
+    scoring_version: Optional[int] = None # ai_engine.SCORING_VERSION that produced the labels above
+    gait_anomaly_score: Optional[float] = None # IsolationForest decision score, negative = anomalous
+    gait_anomaly_model: Optional[str] = None # "<version>/<cohort>" of the model that produced it
+    baseline_deviation: Optional[Dict[str, Any]] = None # z-scores against the patient's own baseline at the time
+    source: Optional[str] = None # None = manual daily input, "sensor_upload" = extracted from a recording
+    upload_id: Optional[PyObjectId] = None # Link to sensor_uploads._id for extracted records
+    content_hash: Optional[str] = None # Fingerprint of a manual submission, unique per patient (retries)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class SensorUpload(BaseModel):
@@ -120,8 +127,39 @@ class SensorUpload(BaseModel):
     )
     id: Optional[PyObjectId] = Field(default=None, alias="_id")
     patient_id: PyObjectId
-    sensor_data: List[Dict[str, Any]] # Time-series data
+    filename: Optional[str] = None
+    format: str = "csv" # csv, pxg (packed binary)
+    columns: List[str] = [] # Channel names, in file order (excluding timestamp)
+    row_count: int = 0
+    bucket_count: int = 0 # Samples live in sensor_buckets
+    size_bytes: int = 0
+    content_hash: Optional[str] = None # SHA-256 of the uploaded file, unique per patient (retries)
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    sample_rate_hz: Optional[float] = None # Only for recordings without a timestamp column
+    status: str = "processing" # processing, complete
+    analysis_status: str = "pending" # pending, complete, skipped, failed (gait feature extraction)
+    daily_record_id: Optional[PyObjectId] = None # daily_metrics record produced by the extraction
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    completed_at: Optional[datetime] = None
+
+class SensorBucket(BaseModel):
+    model_config = ConfigDict(
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+    )
+    id: Optional[PyObjectId] = Field(default=None, alias="_id")
+    patient_id: PyObjectId
+    upload_id: PyObjectId # Link to sensor_uploads._id
+    bucket_start: datetime # Start of the fixed time window
+    seq: int # Order within the recording
+    count: int
+    t_min: float # Epoch seconds
+    t_max: float
+    channel_names: List[str]
+    summary: Dict[str, Dict[str, Any]] # channel -> {min, max, count}
+    # Packed arrays are attached as BSON binary by services/sensor_store.py:
+    # timestamps (float64 LE) and channels.<name> (float32 LE)
 
 class AnalysisResult(BaseModel):
     model_config = ConfigDict(
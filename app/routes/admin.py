@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from app.core.dependencies import check_role
 from app.database import get_db
 from app.schemas.api_schemas import AdminDashboardSummary, FeedbackOut, FeedbackUpdate
@@ -165,3 +165,43 @@ async def update_feedback(feedback_id: str, update: FeedbackUpdate, current_user
         raise HTTPException(status_code=404, detail="Feedback not found")
         
     return {"message": "Feedback updated successfully"}
+
+@router.get("/rescoring")
+async def rescoring_status(current_user: dict = Depends(check_role("admin"))):
+    from app.services.ai_engine import SCORING_VERSION
+    from app.services.rescoring import get_rescoring_status
+    db = get_db()
+    
+    checkpoint = await get_rescoring_status(db)
+    stale = await db["daily_metrics"].count_documents({"scoring_version": {"$ne": SCORING_VERSION}})
+    return {
+        "scoring_version": SCORING_VERSION,
+        "stale_records": stale,
+        "status": checkpoint.get("status") if checkpoint else "not_started",
+        "processed": checkpoint.get("processed", 0) if checkpoint else 0,
+        "updated_at": checkpoint.get("updated_at") if checkpoint else None
+    }
+
+@router.post("/rescoring", status_code=202)
+async def start_rescoring(background_tasks: BackgroundTasks, current_user: dict = Depends(check_role("admin"))):
+    from app.services.rescoring import rescoring_active, run_rescoring, RescoringBusy
+    db = get_db()
+    
+    if await rescoring_active(db):
+        raise HTTPException(status_code=409, detail="Re-scoring is already running")
+    
+    async def run():
+        try:
+            await run_rescoring(db)
+        except RescoringBusy:
+            pass # Another worker started it in the meantime
+    
+    background_tasks.add_task(run)
+    return {"message": "Re-scoring started"}
+
+@router.get("/ai-metrics")
+async def ai_metrics(current_user: dict = Depends(check_role("admin"))):
+    """Gemini client counters, latency and breaker state for this worker."""
+    from app.services.gemini_service import gemini
+    import os
+    return {"worker_pid": os.getpid(), **gemini.metrics()}
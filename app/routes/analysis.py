@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
-from app.core.dependencies import get_current_user
+from app.core.dependencies import get_current_identity
 from app.database import get_db
 from app.services.ai_engine import ai_engine
 from app.models.database_models import AnalysisResult
@@ -9,17 +9,11 @@ from datetime import datetime
 router = APIRouter(prefix="/analysis", tags=["analysis"])
 
 @router.post("/run/{record_id}")
-async def run_analysis(record_id: str, current_user: dict = Depends(get_current_user)):
+async def run_analysis(record_id: str, identity: dict = Depends(get_current_identity)):
     db = get_db()
     
     # 1. Find the patient profile
-    user_id = current_user["_id"]
-    profile = await db["patient_profiles"].find_one({
-        "$or": [
-            {"user_id": user_id},
-            {"user_id": str(user_id)}
-        ]
-    })
+    profile = identity["profile"]
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
     
@@ -35,30 +29,13 @@ async def run_analysis(record_id: str, current_user: dict = Depends(get_current_
     # Prepare metrics with profile for the engine
     record_with_profile = {**record, "profile": profile}
     
-    gait_abnormality = ai_engine.analyze_gait(record)
-    skin_risk = ai_engine.analyze_skin_risk(record)
-    health_score = ai_engine.calculate_prosthetic_health_score(record_with_profile)
-    clinical_risk = ai_engine.determine_overall_risk(record_with_profile)
-    
-    # Recommendations logic
-    recommendations = []
-    if gait_abnormality == "Abnormal":
-        recommendations.append("Significant gait asymmetry detected. Clinical gait analysis recommended.")
-    if skin_risk == "High":
-        recommendations.append("Critical skin irritation risk. Inspect residual limb and socket immediately.")
-    if record.get("walking_speed_mps", 0) < 0.6:
-        recommendations.append("Low walking speed detected. Consider prosthetic alignment check.")
-    if record.get("pressure_distribution_index", 1.0) < 0.6:
-        recommendations.append("Load imbalance detected. Check socket padding and alignment.")
-    
-    # Systemic recommendations
-    if profile.get("bmi", 0) > 30:
-        recommendations.append("High BMI detected. Weight management may improve prosthetic comfort.")
-    if profile.get("blood_pressure_systolic", 0) > 140:
-        recommendations.append("Hypertension detected. Consult clinical team regarding cardiovascular stress.")
-    
-    if health_score < 60:
-        recommendations.append("Overall prosthetic health score is moderate. Consultation with a prosthetist advised.")
+    # Labels, scores and recommendations in one pass over the clinical rules
+    evaluated = ai_engine.evaluate(record_with_profile)
+    gait_abnormality = evaluated["gait_abnormality"]
+    skin_risk = evaluated["skin_risk"]
+    health_score = evaluated["prosthetic_health_score"]
+    clinical_risk = evaluated["overall_risk"]
+    recommendations = evaluated["recommendations"]
 
     analysis_res = AnalysisResult(
         record_id=ObjectId(record_id),
@@ -2,8 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException, status
 
 from app.database import get_db
 from app.schemas.api_schemas import UserRegister, Token, UserOut, LoginRequest
-from app.core.security import get_password_hash, verify_password, create_access_token
-from app.core.dependencies import get_current_user
+from app.core.security import get_password_hash_async, verify_and_update_password, create_access_token
+from app.core.dependencies import get_current_user, invalidate_identity
 from app.models.database_models import User
 from datetime import timedelta
 from app.config import settings
@@ -17,7 +17,7 @@ async def register(user_in: UserRegister):
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = get_password_hash(user_in.password)
+    hashed_password = await get_password_hash_async(user_in.password)
     user_dict = User(
         email=user_in.email,
         full_name=user_in.full_name,
@@ -45,13 +45,24 @@ async def register(user_in: UserRegister):
 async def login(data: LoginRequest):
     db = get_db()
     user = await db["users"].find_one({"email": data.email})
-    if not user or not verify_password(data.password, user["hashed_password"]):
+    verified, new_hash = False, None
+    if user:
+        verified, new_hash = await verify_and_update_password(data.password, user["hashed_password"])
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Transparent rehash: legacy Bcrypt or outdated Argon2 parameters
+    if new_hash:
+        await db["users"].update_one(
+            {"_id": user["_id"], "hashed_password": user["hashed_password"]},
+            {"$set": {"hashed_password": new_hash}}
+        )
+        invalidate_identity(user)
+    
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
     # Try to find patient_id if user is a patient
@@ -1,16 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from app.core.dependencies import get_current_user, check_role
-from app.database import get_db
 from app.config import settings
+from app.core.dependencies import get_patient_identity
+from app.database import get_db
+from app.services import chat_store, clinical_context
+from app.services.gemini_service import GeminiEmptyResponse, GeminiUnavailable, gemini
 from bson import ObjectId
+from contextlib import aclosing
 from datetime import datetime, timezone
+from typing import Optional, Set
+import asyncio
+import json
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+# Saves of streamed exchanges whose client went away mid-answer
+_pending_saves: Set[asyncio.Task] = set()
+
 # ─── Schemas ───────────────────────────────────────────────
 class ChatMessageRequest(BaseModel):
     message: str = Field(..., min_length=1, max_length=500)
@@ -38,113 +49,78 @@ Keep responses concise, medically accurate, and professional.
 Do not provide general knowledge or unrelated advice."""
 
 # ─── Gemini Chat Engine ────────────────────────────────────
-_chat_model = None
-
-def _get_chat_model():
-    global _chat_model
-    if _chat_model is None:
-        import google.generativeai as genai
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        _chat_model = genai.GenerativeModel(
-            "gemini-2.0-flash",
-            system_instruction=CLINICAL_SYSTEM_PROMPT
-        )
-    return _chat_model
+def _unavailable_text(e: Exception) -> str:
+    if isinstance(e, GeminiUnavailable) and e.reason == "error" and isinstance(e.__cause__, GeminiEmptyResponse):
+        return "I'm currently unable to process your request. Please try again."
+    return "Clinical AI is temporarily unavailable. Please try again later."
+
+async def _system_instruction(db, profile: dict) -> str:
+    """The clinical system prompt followed by the patient's precomputed clinical context."""
+    context = await clinical_context.get_context(db, profile)
+    return f"{CLINICAL_SYSTEM_PROMPT}\n\n{context['prompt']}"
 
-async def _generate_chat_response(user_message: str, history: list) -> str:
-    """Generate a response from Gemini given the user message and conversation history."""
+async def _generate_chat_response(user_message: str, history: list, system_instruction: str) -> str:
+    """Generate a response from Gemini given the user message and conversation context (chat_store.gemini_context)."""
     try:
-        model = _get_chat_model()
-        
-        # Build conversation context from history (last 10 messages for performance)
-        recent_history = history[-10:] if len(history) > 10 else history
-        
-        # Format history for Gemini
-        gemini_history = []
-        for msg in recent_history:
-            role = "user" if msg["sender"] == "user" else "model"
-            gemini_history.append({"role": role, "parts": [msg["message"]]})
-        
-        # Start chat with history
-        chat = model.start_chat(history=gemini_history)
-        response = await chat.send_message_async(user_message)
-        
-        if not response or not response.text:
-            return "I'm currently unable to process your request. Please try again."
-        
-        return response.text
+        # Shared client: rate limiting, retries and circuit breaking (services/gemini_service.py)
+        return await gemini.generate(
+            user_message, system_instruction=system_instruction, history=history
+        )
     except Exception as e:
         logger.error(f"Gemini Chat Error: {str(e)}")
-        return "Clinical AI is temporarily unavailable. Please try again later."
+        return _unavailable_text(e)
 
 # ─── Helper: Resolve patient_id ────────────────────────────
-async def _resolve_patient_id(current_user: dict):
-    db = get_db()
-    user_id = current_user["_id"]
-    profile = await db["patient_profiles"].find_one({
-        "$or": [
-            {"user_id": user_id},
-            {"user_id": str(user_id)}
-        ]
-    })
+def _resolve_patient_id(identity: dict):
+    profile = identity["profile"]
     if not profile:
         raise HTTPException(status_code=404, detail="Patient profile not found.")
     return profile["_id"]
 
 # ─── GET /chat/history ─────────────────────────────────────
 @router.get("/history")
-async def get_chat_history(current_user: dict = Depends(check_role("patient"))):
+async def get_chat_history(
+    before: Optional[int] = Query(None, ge=0, description="Return messages before this index (default: the newest)"),
+    limit: int = Query(settings.CHAT_HISTORY_PAGE_SIZE, ge=1, le=settings.CHAT_HISTORY_MAX_PAGE_SIZE),
+    identity: dict = Depends(get_patient_identity)
+):
+    """
+    One page of the latest session, oldest message first. Pass `next_before`
+    back as `before` for the page before it (null once the start is reached).
+    """
     db = get_db()
-    patient_id = await _resolve_patient_id(current_user)
+    patient_id = _resolve_patient_id(identity)
     
-    session = await db["patient_chat_sessions"].find_one(
-        {"patient_id": patient_id},
-        sort=[("updated_at", -1)]
-    )
+    session = await chat_store.find_session(db, {"patient_id": patient_id}, sort=[("updated_at", -1)])
     
     if not session:
-        return {"messages": []}
+        return {"messages": [], "total": 0, "next_before": None}
     
-    messages = session.get("messages", [])
+    page = await chat_store.history_page(db, session, before, limit)
     
     # Serialize timestamps
-    for msg in messages:
+    for msg in page["messages"]:
         if isinstance(msg.get("timestamp"), datetime):
             msg["timestamp"] = msg["timestamp"].isoformat()
     
-    return {"messages": messages}
+    return page
 
 # ─── POST /chat/message ───────────────────────────────────
 @router.post("/message", response_model=ChatMessageResponse)
 async def send_chat_message(
     payload: ChatMessageRequest,
-    current_user: dict = Depends(check_role("patient"))
+    identity: dict = Depends(get_patient_identity)
 ):
     db = get_db()
-    patient_id = await _resolve_patient_id(current_user)
-    user_id = str(current_user["_id"])
+    patient_id = _resolve_patient_id(identity)
+    user_id = str(identity["user"]["_id"])
     now = datetime.now(timezone.utc)
     
-    # Find or create session
-    session = await db["patient_chat_sessions"].find_one(
-        {"patient_id": patient_id, "session_status": "active"}
+    session = await chat_store.active_session(db, patient_id, user_id)
+    history, system_instruction = await asyncio.gather(
+        chat_store.gemini_context(db, session), _system_instruction(db, identity["profile"])
     )
     
-    if not session:
-        # Create new session
-        session = {
-            "patient_id": patient_id,
-            "user_id": user_id,
-            "session_status": "active",
-            "messages": [],
-            "created_at": now,
-            "updated_at": now
-        }
-        result = await db["patient_chat_sessions"].insert_one(session)
-        session["_id"] = result.inserted_id
-    
-    existing_messages = session.get("messages", [])
-    
     # 1. Append user message
     user_msg = {
         "sender": "user",
@@ -153,7 +129,7 @@ async def send_chat_message(
     }
     
     # 2. Generate AI response using Gemini
-    ai_response_text = await _generate_chat_response(payload.message, existing_messages)
+    ai_response_text = await _generate_chat_response(payload.message, history, system_instruction)
     
     assistant_msg = {
         "sender": "assistant",
@@ -162,20 +138,116 @@ async def send_chat_message(
     }
     
     # 3. Update session in MongoDB
-    await db["patient_chat_sessions"].update_one(
-        {"_id": session["_id"]},
-        {
-            "$push": {
-                "messages": {
-                    "$each": [user_msg, assistant_msg]
-                }
-            },
-            "$set": {"updated_at": datetime.now(timezone.utc)}
-        }
-    )
+    await chat_store.append(db, session, [user_msg, assistant_msg])
     
     return {
         "sender": "assistant",
         "message": ai_response_text,
         "timestamp": assistant_msg["timestamp"].isoformat()
     }
+
+# ─── POST /chat/message/stream ────────────────────────────
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _response(msg: dict) -> dict:
+    return {
+        "sender": msg["sender"],
+        "message": msg["message"],
+        "timestamp": msg["timestamp"].isoformat()
+    }
+
+@router.post("/message/stream")
+async def stream_chat_message(
+    payload: ChatMessageRequest,
+    identity: dict = Depends(get_patient_identity)
+):
+    """
+    POST /chat/message answered as Server-Sent Events, so the answer shows up
+    as Gemini writes it:
+
+        event: chunk      data: {"text": "..."}            (repeated)
+        event: error      data: {"message": "..."}         (only if Gemini fails mid-answer)
+        event: done       data: {"sender", "message", "timestamp"}  (same as POST /chat/message)
+
+    The exchange is saved when the stream ends. If the client disconnects
+    first, the Gemini call is cancelled and the partial answer is saved
+    marked `interrupted`.
+    """
+    db = get_db()
+    patient_id = _resolve_patient_id(identity)
+    user_id = str(identity["user"]["_id"])
+    now = datetime.now(timezone.utc)
+    
+    session = await chat_store.active_session(db, patient_id, user_id)
+    history, system_instruction = await asyncio.gather(
+        chat_store.gemini_context(db, session), _system_instruction(db, identity["profile"])
+    )
+    user_msg = {
+        "sender": "user",
+        "message": payload.message,
+        "timestamp": now
+    }
+    
+    def exchange(parts: list, interrupted: bool) -> list:
+        assistant_msg = {
+            "sender": "assistant",
+            "message": "".join(parts),
+            "timestamp": datetime.now(timezone.utc)
+        }
+        if interrupted:
+            assistant_msg["interrupted"] = True
+        return [user_msg, assistant_msg] if parts else [user_msg]
+    
+    def save(messages: list) -> asyncio.Task:
+        # Its own task, so a disconnect cannot cancel a save half-way
+        task = asyncio.create_task(chat_store.append(db, session, messages))
+        _pending_saves.add(task)
+        task.add_done_callback(_pending_saves.discard)
+        return task
+
+    async def events():
+        parts = []
+        saved = False
+        started = time.monotonic()
+        try:
+            try:
+                # Closed on the way out, whatever the exit; closing cancels the upstream call
+                async with aclosing(gemini.stream(
+                    payload.message, system_instruction=system_instruction,
+                    history=history
+                )) as chunks:
+                    async for text in chunks:
+                        if not parts:
+                            logger.info(f"Chat stream first chunk after {(time.monotonic() - started) * 1000:.0f} ms")
+                        parts.append(text)
+                        yield _sse("chunk", {"text": text})
+            except Exception as e:
+                logger.error(f"Gemini Chat Error: {str(e)}")
+                if parts:
+                    messages = exchange(parts, interrupted=True)
+                    saved = True
+                    await asyncio.shield(save(messages))
+                    yield _sse("error", {"message": _unavailable_text(e)})
+                    yield _sse("done", _response(messages[-1]))
+                    return
+                # Nothing written yet: answer with the fallback, as POST /chat/message does
+                parts.append(_unavailable_text(e))
+                yield _sse("chunk", {"text": parts[0]})
+            
+            messages = exchange(parts, interrupted=False)
+            saved = True
+            await asyncio.shield(save(messages))
+            yield _sse("done", _response(messages[-1]))
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client went away and the Gemini stream is closed; save what there is,
+            # unless the exchange was already saved and only the last frames were lost
+            if not saved:
+                save(exchange(parts, interrupted=True))
+            raise
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
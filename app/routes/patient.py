@@ -1,59 +1,62 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
-from app.core.dependencies import get_current_user, check_role
-from app.schemas.api_schemas import DailyInput, GaitUploadResponse, DashboardSummary, PatientProfileCreate, PatientProfileOut, FeedbackCreate
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, Form, HTTPException
+from app.core.dependencies import get_current_user, check_role, get_patient_identity, invalidate_identity
+from app.schemas.api_schemas import DailyInput, DatedDailyInput, DailyInputBatch, GaitUploadResponse, DashboardSummary, PatientProfileCreate, PatientProfileOut, FeedbackCreate
 from app.database import get_db
-from app.models.database_models import DailyRecord, SensorUpload, PatientFeedback
+from app.models.database_models import DailyRecord, PatientFeedback
+from app.config import settings
 from bson import ObjectId
-import csv
-import io
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from typing import Optional
 from datetime import datetime, timezone
 
 router = APIRouter(prefix="/patient", tags=["patient"])
 
 @router.post("/upload-gait", response_model=GaitUploadResponse)
 async def upload_gait(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    current_user: dict = Depends(check_role("patient"))
+    recorded_at: Optional[datetime] = Form(None),
+    sample_rate_hz: float = Form(settings.SENSOR_DEFAULT_SAMPLE_RATE_HZ, gt=0),
+    identity: dict = Depends(get_patient_identity)
 ):
-    if not file.filename.endswith(('.csv', '.txt')):
+    if not file.filename.lower().endswith(('.csv', '.txt', '.pxg')):
         raise HTTPException(status_code=400, detail="Invalid file type")
     
     db = get_db()
     
     # 1. Resolve identity internally
-    profile = await db["patient_profiles"].find_one({"user_id": current_user["_id"]})
+    profile = identity["profile"]
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found. Please create your profile first.")
     
     patient_id = profile["_id"]
     
-    contents = await file.read()
-    decoded = contents.decode('utf-8')
-    reader = csv.DictReader(io.StringIO(decoded))
-    
-    sensor_data = []
-    for row in reader:
-        sensor_data.append(row)
-    
-    record = SensorUpload(
-        patient_id=patient_id,
-        sensor_data=sensor_data
-    ).model_dump(by_alias=True, exclude_none=True)
+    # 2. Stream the file into time-bucketed, typed storage (constant memory)
+    from app.services.sensor_ingest import ingest_upload, UploadRejected
+    try:
+        upload = await ingest_upload(db, file, patient_id, recorded_at, sample_rate_hz)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    if upload["duplicate"]:
+        # Client retry of a file we already hold: nothing new to store or analyse
+        return {
+            "message": "Upload already received",
+            "record_id": str(upload["_id"]),
+            "row_count": upload["row_count"],
+            "duplicate": True
+        }
     
-    result = await db["sensor_uploads"].insert_one(record)
+    # 3. Extract gait metrics into daily_metrics after the response is sent
+    from app.services.gait_features import process_sensor_upload
+    background_tasks.add_task(process_sensor_upload, upload["_id"])
     
-    return {"message": "Upload successful", "record_id": str(result.inserted_id)}
+    return {"message": "Upload successful", "record_id": str(upload["_id"]), "row_count": upload["row_count"]}
 
 @router.get("/profile", response_model=PatientProfileOut)
-async def get_profile(current_user: dict = Depends(check_role("patient"))):
-    db = get_db()
-    user_id = current_user["_id"]
-    profile = await db["patient_profiles"].find_one({
-        "$or": [
-            {"user_id": user_id},
-            {"user_id": str(user_id)}
-        ]
-    })
+async def get_profile(identity: dict = Depends(get_patient_identity)):
+    profile = identity["profile"]
     
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
@@ -68,20 +71,16 @@ async def get_profile(current_user: dict = Depends(check_role("patient"))):
 @router.post("/profile")
 async def create_or_update_profile(
     data: PatientProfileCreate,
-    current_user: dict = Depends(check_role("patient"))
+    identity: dict = Depends(get_patient_identity)
 ):
     from app.models.database_models import PatientProfile
     db = get_db()
     
+    current_user = identity["user"]
     user_id = current_user["_id"]
     
     # Check if profile already exists
-    existing = await db["patient_profiles"].find_one({
-        "$or": [
-            {"user_id": user_id},
-            {"user_id": str(user_id)}
-        ]
-    })
+    existing = identity["profile"]
     
     # Prepare update data
     update_data = data.model_dump(exclude_unset=True)
@@ -105,6 +104,7 @@ async def create_or_update_profile(
             {"_id": existing["_id"]},
             {"$set": update_data}
         )
+        invalidate_identity(current_user)
         return {"message": "Profile updated successfully"}
     else:
         # CREATE
@@ -131,23 +131,18 @@ async def create_or_update_profile(
         start_doc["user_id"] = ObjectId(start_doc["user_id"])
         
         await db["patient_profiles"].insert_one(start_doc)
+        invalidate_identity(current_user)
         return {"message": "Profile created successfully"}
 
 @router.post("/feedback")
 async def submit_feedback(
     feedback: FeedbackCreate,
-    current_user: dict = Depends(check_role("patient"))
+    identity: dict = Depends(get_patient_identity)
 ):
     db = get_db()
     
     # 1. Resolve Patient Profile
-    user_id = current_user["_id"]
-    profile = await db["patient_profiles"].find_one({
-        "$or": [
-            {"user_id": user_id},
-            {"user_id": str(user_id)}
-        ]
-    })
+    profile = identity["profile"]
     
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found. Please create your profile first.")
@@ -171,20 +166,14 @@ async def submit_feedback(
 @router.post("/daily-input")
 async def daily_input(
     data: DailyInput,
-    current_user: dict = Depends(check_role("patient"))
+    identity: dict = Depends(get_patient_identity)
 ):
-    from app.services.ai_engine import ai_engine
+    from app.services.ai_engine import ai_engine, SCORING_VERSION
     from app.models.database_models import DailyRecord
     db = get_db()
     
     # 1. Resolve identity internally from JWT
-    user_id = current_user["_id"]
-    profile = await db["patient_profiles"].find_one({
-        "$or": [
-            {"user_id": user_id},
-            {"user_id": str(user_id)}
-        ]
-    })
+    profile = identity["profile"]
     
     if not profile:
         raise HTTPException(
@@ -196,48 +185,259 @@ async def daily_input(
     
     # Calculate biomechanical metrics
     metrics_dict = data.model_dump()
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    
+    # A resubmission of the same values for the same day returns the stored record
+    from app.services.fingerprint import hash_daily_input
+    content_hash = hash_daily_input(today, metrics_dict)
+    existing = await db["daily_metrics"].find_one({"patient_id": patient_id, "content_hash": content_hash})
+    if existing:
+        return _duplicate_daily_input(existing)
     
     # Add profile data for health score calculation
     metrics_plus_profile = {**metrics_dict, "profile": profile}
     
-    gait_abnormality = ai_engine.analyze_gait(metrics_dict)
-    skin_risk = ai_engine.analyze_skin_risk(metrics_dict)
-    health_score = ai_engine.calculate_prosthetic_health_score(metrics_plus_profile)
+    evaluated = ai_engine.evaluate(metrics_plus_profile)
+    gait_abnormality = evaluated["gait_abnormality"]
+    skin_risk = evaluated["skin_risk"]
+    health_score = evaluated["prosthetic_health_score"]
+    anomaly = ai_engine.gait_anomaly_fields([metrics_dict], profile)[0]
+    
+    # Compare against the patient's own running baseline (before this record)
+    from app.services.patient_baseline import get_baseline, baseline_deviation, update_baseline
+    deviation = baseline_deviation(
+        await get_baseline(db, patient_id),
+        {**metrics_dict, "prosthetic_health_score": health_score}
+    )
     
     # Insert daily record
     record = DailyRecord(
         patient_id=patient_id,
-        date=datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+        date=today,
         **metrics_dict,
         gait_abnormality=gait_abnormality,
         skin_risk=skin_risk,
-        prosthetic_health_score=health_score
+        prosthetic_health_score=health_score,
+        scoring_version=SCORING_VERSION,
+        **anomaly,
+        baseline_deviation=deviation,
+        content_hash=content_hash
     ).model_dump(by_alias=True, exclude_none=True)
     
     # Store patient_id as ObjectId explicitly and ensure created_at is UTC datetime
     record["patient_id"] = ObjectId(record["patient_id"])
     record["created_at"] = datetime.now(timezone.utc)
     
-    await db["daily_metrics"].insert_one(record)
+    try:
+        result = await db["daily_metrics"].insert_one(record)
+    except DuplicateKeyError:
+        # A concurrent retry was stored between the lookup and the insert
+        existing = await db["daily_metrics"].find_one({"patient_id": patient_id, "content_hash": content_hash})
+        if not existing:
+            raise
+        return _duplicate_daily_input(existing)
+    await update_baseline(db, patient_id, [record])
+    from app.services.clinical_context import update_context
+    await update_context(db, patient_id, [record], profile)
     return {
         "message": "Metrics submitted successfully", 
+        "record_id": str(result.inserted_id),
         "gait_abnormality": gait_abnormality,
+        "gait_anomaly_score": anomaly.get("gait_anomaly_score"),
         "skin_risk": skin_risk,
-        "health_score": health_score
+        "health_score": health_score,
+        "baseline_deviation": deviation
+    }
+
+def _duplicate_daily_input(record: dict) -> dict:
+    return {
+        "message": "Metrics already submitted",
+        "record_id": str(record["_id"]),
+        "duplicate": True,
+        "gait_abnormality": record["gait_abnormality"],
+        "gait_anomaly_score": record.get("gait_anomaly_score"),
+        "skin_risk": record["skin_risk"],
+        "health_score": record["prosthetic_health_score"],
+        "baseline_deviation": record.get("baseline_deviation")
+    }
+
+@router.post("/daily-input/batch")
+async def daily_input_batch(
+    data: DailyInputBatch,
+    identity: dict = Depends(get_patient_identity)
+):
+    """
+    Backfill several dated daily inputs in one request (e.g. a device syncing
+    after days offline). Returns one result per submitted item, in order.
+    """
+    from app.services.ai_engine import ai_engine, SCORING_VERSION
+    db = get_db()
+    
+    profile = identity["profile"]
+    if not profile:
+        raise HTTPException(
+            status_code=404, 
+            detail="Patient profile not found."
+        )
+    
+    patient_id = profile["_id"]
+    now = datetime.now(timezone.utc)
+    today = now.strftime("%Y-%m-%d")
+    
+    # 1. Validate every item, keeping per-item errors instead of failing the batch
+    results = [None] * len(data.items)
+    valid = []
+    for index, raw in enumerate(data.items):
+        try:
+            item = DatedDailyInput.model_validate(raw)
+            day = datetime.strptime(item.date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        except (ValidationError, ValueError) as e:
+            if isinstance(e, ValidationError):
+                errors = [f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()]
+            else:
+                errors = [f"date: {e}"]
+            results[index] = {"index": index, "status": "invalid", "errors": errors}
+            continue
+        if item.date > today:
+            results[index] = {"index": index, "status": "invalid", "errors": ["date cannot be in the future"]}
+            continue
+        valid.append((index, item, day))
+    
+    # 2. Drop resubmissions: items already stored, or repeated within this batch
+    from app.services.fingerprint import hash_daily_input
+    hashes = {index: hash_daily_input(item.date, item.model_dump(exclude={"date"})) for index, item, _ in valid}
+    stored = await db["daily_metrics"].find(
+        {"patient_id": patient_id, "content_hash": {"$in": list(set(hashes.values()))}}
+    ).to_list(None)
+    by_hash = {r["content_hash"]: r for r in stored}
+    fresh, seen = [], {}
+    for index, item, day in valid:
+        content_hash = hashes[index]
+        if content_hash in by_hash:
+            results[index] = _duplicate_batch_item(index, item.date, by_hash[content_hash])
+        elif content_hash in seen:
+            results[index] = {"index": index, "date": item.date, "status": "duplicate", "duplicate_of": seen[content_hash]}
+        else:
+            seen[content_hash] = index
+            fresh.append((index, item, day))
+    valid = fresh
+    
+    if valid:
+        # 3. Score all new items in one vectorized pass
+        metrics = [item.model_dump(exclude={"date"}) for _, item, _ in valid]
+        scores = ai_engine.score_batch(metrics, profile)
+        anomalies = ai_engine.gait_anomaly_fields(metrics, profile)
+        
+        # Every item is compared with the baseline as it stood before this batch
+        from app.services.patient_baseline import get_baseline, baseline_deviation, update_baseline
+        baseline = await get_baseline(db, patient_id)
+        deviations = [
+            baseline_deviation(baseline, {**metrics[i], "prosthetic_health_score": scores["prosthetic_health_score"][i]})
+            for i in range(len(valid))
+        ]
+        
+        # 4. Build the records; backfilled days are stamped with their own date so
+        #    created_at-based windows (dashboard, weekly reports) place them correctly
+        records = []
+        for i, (index, item, day) in enumerate(valid):
+            record = DailyRecord(
+                patient_id=patient_id,
+                date=item.date,
+                **metrics[i],
+                gait_abnormality=scores["gait_abnormality"][i],
+                skin_risk=scores["skin_risk"][i],
+                prosthetic_health_score=scores["prosthetic_health_score"][i],
+                scoring_version=SCORING_VERSION,
+                **anomalies[i],
+                baseline_deviation=deviations[i],
+                content_hash=hashes[index]
+            ).model_dump(by_alias=True, exclude_none=True)
+            record["patient_id"] = ObjectId(record["patient_id"])
+            record["created_at"] = now if item.date == today else day
+            records.append(record)
+        
+        # 5. Single unordered bulk insert; one failing document doesn't stop the rest
+        failed, raced = {}, {}
+        try:
+            await db["daily_metrics"].insert_many(records, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                if err.get("code") == 11000:
+                    raced[err["index"]] = records[err["index"]]["content_hash"]
+                else:
+                    failed[err["index"]] = err.get("errmsg", "write failed")
+        if raced:
+            # Concurrent retries stored these between the lookup and the insert
+            stored = await db["daily_metrics"].find(
+                {"patient_id": patient_id, "content_hash": {"$in": list(raced.values())}}
+            ).to_list(None)
+            by_hash = {r["content_hash"]: r for r in stored}
+        
+        for i, (index, item, _) in enumerate(valid):
+            if i in raced and raced[i] in by_hash:
+                results[index] = _duplicate_batch_item(index, item.date, by_hash[raced[i]])
+                continue
+            if i in failed or i in raced:
+                error = failed.get(i, "duplicate key")
+                results[index] = {"index": index, "date": item.date, "status": "failed", "errors": [error]}
+                continue
+            results[index] = {
+                "index": index,
+                "date": item.date,
+                "status": "created",
+                "record_id": str(records[i]["_id"]),
+                "gait_abnormality": scores["gait_abnormality"][i],
+                "gait_anomaly_score": anomalies[i].get("gait_anomaly_score"),
+                "skin_risk": scores["skin_risk"][i],
+                "health_score": scores["prosthetic_health_score"][i],
+                "baseline_deviation": deviations[i]
+            }
+        
+        stored_records = [records[i] for i, (index, _, _) in enumerate(valid) if results[index]["status"] == "created"]
+        await update_baseline(db, patient_id, stored_records)
+        from app.services.clinical_context import update_context
+        await update_context(db, patient_id, stored_records, profile)
+    
+    # Repeats within the batch point at whatever their first occurrence became
+    for result in results:
+        if "duplicate_of" in result:
+            first = results[result["duplicate_of"]]
+            if "record_id" in first:
+                result.update(_duplicate_batch_item(result["index"], result["date"], {
+                    "_id": first["record_id"],
+                    "gait_abnormality": first["gait_abnormality"],
+                    "gait_anomaly_score": first["gait_anomaly_score"],
+                    "skin_risk": first["skin_risk"],
+                    "prosthetic_health_score": first["health_score"],
+                    "baseline_deviation": first["baseline_deviation"]
+                }))
+    
+    created = sum(1 for r in results if r["status"] == "created")
+    return {
+        "message": f"{created} of {len(results)} daily inputs stored",
+        "created": created,
+        "results": results
+    }
+
+def _duplicate_batch_item(index: int, date: str, record: dict) -> dict:
+    return {
+        "index": index,
+        "date": date,
+        "status": "duplicate",
+        "record_id": str(record["_id"]),
+        "gait_abnormality": record["gait_abnormality"],
+        "gait_anomaly_score": record.get("gait_anomaly_score"),
+        "skin_risk": record["skin_risk"],
+        "health_score": record["prosthetic_health_score"],
+        "baseline_deviation": record.get("baseline_deviation")
     }
 
 @router.get("/dashboard", response_model=DashboardSummary)
-async def get_dashboard(current_user: dict = Depends(check_role("patient"))):
+async def get_dashboard(identity: dict = Depends(get_patient_identity)):
     db = get_db()
     
     # Resolve identity internally
-    user_id = current_user["_id"]
-    profile = await db["patient_profiles"].find_one({
-        "$or": [
-            {"user_id": user_id},
-            {"user_id": str(user_id)}
-        ]
-    })
+    profile = identity["profile"]
     
     if not profile:
         raise HTTPException(
@@ -272,44 +472,37 @@ async def get_dashboard(current_user: dict = Depends(check_role("patient"))):
         health_score=[r["prosthetic_health_score"] for r in history],
         symmetry=[r["gait_symmetry_index"] for r in history],
         walking_speed=[r["walking_speed_mps"] for r in history],
-        skin_temp=[r["skin_temperature_c"] for r in history],
-        moisture=[r["skin_moisture"] for r in history],
+        skin_temp=[r.get("skin_temperature_c") for r in history],
+        moisture=[r.get("skin_moisture") for r in history],
         pressure_distribution=[r.get("pressure_distribution_index", 0) for r in history]
     )
 
-    alerts = []
+    # Labels and alerts from one evaluation under the current rules, so they agree
+    # even when the stored labels were scored under another version or cohort
+    evaluated = {"gait_abnormality": "No Data Available", "skin_risk": "No Data Available", "alerts": []}
     if latest_record:
-        if latest_record["gait_abnormality"] == "Abnormal":
-            alerts.append("Significant gait abnormality detected.")
-        if latest_record["skin_risk"] == "High":
-            alerts.append("High risk of skin irritation. Check socket fit.")
-        if latest_record.get("pressure_distribution_index", 1.0) < 0.6:
-            alerts.append("Load Imbalance Detected.")
+        from app.services.ai_engine import ai_engine
+        evaluated = ai_engine.evaluate({**latest_record, "profile": profile})
 
     return {
         "patient_name": profile.get("name", profile["email"]),
         "latest_health_score": latest_record["prosthetic_health_score"] if latest_record else None,
-        "gait_abnormality": latest_record["gait_abnormality"] if latest_record else "No Data Available",
-        "skin_risk": latest_record["skin_risk"] if latest_record else "No Data Available",
+        "gait_abnormality": evaluated["gait_abnormality"],
+        "skin_risk": evaluated["skin_risk"],
         "trends": trends,
-        "recent_alerts": alerts
+        "recent_alerts": evaluated["alerts"]
     }
 
 @router.get("/history")
 async def get_history(
     days: int = 7,
-    current_user: dict = Depends(check_role("patient"))
+    identity: dict = Depends(get_patient_identity)
 ):
     db = get_db()
     
     # Resolve identity internally (handle both ObjectId and legacy string)
-    user_id = current_user["_id"]
-    profile = await db["patient_profiles"].find_one({
-        "$or": [
-            {"user_id": user_id},
-            {"user_id": str(user_id)}
-        ]
-    })
+    user_id = identity["user"]["_id"]
+    profile = identity["profile"]
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
         
@@ -384,15 +577,9 @@ async def get_latest_metrics(
     return record
 
 @router.get("/weekly-report/{id}")
-async def get_report_metadata(id: str, current_user: dict = Depends(check_role("patient"))):
+async def get_report_metadata(id: str, identity: dict = Depends(get_patient_identity)):
     db = get_db()
-    user_id = current_user["_id"]
-    profile = await db["patient_profiles"].find_one({
-        "$or": [
-            {"user_id": user_id},
-            {"user_id": str(user_id)}
-        ]
-    })
+    profile = identity["profile"]
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
     
@@ -403,15 +590,9 @@ async def get_report_metadata(id: str, current_user: dict = Depends(check_role("
     return report
 
 @router.get("/download-report/{id}")
-async def download_report(id: str, current_user: dict = Depends(check_role("patient"))):
+async def download_report(id: str, identity: dict = Depends(get_patient_identity)):
     db = get_db()
-    user_id = current_user["_id"]
-    profile = await db["patient_profiles"].find_one({
-        "$or": [
-            {"user_id": user_id},
-            {"user_id": str(user_id)}
-        ]
-    })
+    profile = identity["profile"]
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
 
@@ -449,12 +630,11 @@ async def get_feedback_stats(current_user: dict = Depends(get_current_user)):
     return result
 
 @router.get("/notifications")
-async def get_notifications(current_user: dict = Depends(check_role("patient"))):
+async def get_notifications(identity: dict = Depends(get_patient_identity)):
     db = get_db()
-    user_id = current_user["_id"]
     
     # Resolve patient_id
-    profile = await db["patient_profiles"].find_one({"user_id": user_id})
+    profile = identity["profile"]
     if not profile:
         return []
     
@@ -1,88 +1,79 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import StreamingResponse
-from app.core.dependencies import get_current_user, check_role
-from app.database import get_db
+from app.config import settings
+from app.core.dependencies import get_patient_identity
 from app.services.analysis_engine import get_patient_health_summary
-from app.services.pdf_service import generate_medical_pdf
-from datetime import datetime, timezone, timedelta
+from app.services.pdf_pool import PdfRenderBusy, pdf_pool
+from app.services.pdf_service import render_medical_pdf
+from starlette.background import BackgroundTask
+from datetime import datetime, timezone
 from bson import ObjectId
+import logging
+import os
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/report", tags=["report"])
 
+REPORTS_DIR = "reports"
+
+async def _chunks(pdf: bytes):
+    view = memoryview(pdf)
+    for start in range(0, len(view), settings.PDF_STREAM_CHUNK_BYTES):
+        yield view[start:start + settings.PDF_STREAM_CHUNK_BYTES]
+
+def _archive(path: str, pdf: bytes):
+    # Runs in the threadpool after the response has been sent
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(pdf)
+    except OSError as e:
+        logger.warning(f"Could not archive report {path}: {e}")
+
 @router.get("/patient/download-report")
-async def download_report(current_user: dict = Depends(check_role("patient"))):
-    db = get_db()
+async def download_report(
+    window_days: int = Query(settings.HEALTH_SUMMARY_WINDOW_DAYS, description="Average the metrics over this many days"),
+    identity: dict = Depends(get_patient_identity)
+):
+    if window_days not in settings.HEALTH_SUMMARY_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"window_days must be one of {settings.HEALTH_SUMMARY_WINDOWS}")
     
     # 1. Resolve patient profile internally (handle both ObjectId and legacy string)
-    user_id = current_user["_id"]
-    profile = await db["patient_profiles"].find_one({
-        "$or": [
-            {"user_id": user_id},
-            {"user_id": str(user_id)}
-        ]
-    })
+    profile = identity["profile"]
     if not profile:
         raise HTTPException(status_code=404, detail="Patient profile not found. Please register first.")
     
     patient_id = profile["_id"]
     today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     
-    # 2. Performance Rule: Check if analysis already exists and is fresh
-    cached_analysis = await db["analysis_results"].find_one({
-        "patient_id": patient_id,
-        "date": today,
-        "type": "ai_medical_report",
-        "created_at": {"$gte": datetime.now(timezone.utc) - timedelta(hours=24)}
-    })
-    
-    summary_data = None
-    if cached_analysis:
-        cached_data = cached_analysis.get("data", {})
-        # Validate that cached data contains real metrics and valid AI analysis
-        metrics = cached_data.get("metrics", {})
-        analysis = cached_data.get("analysis", "")
-        
-        has_real_metrics = metrics.get("avg_step_length_cm") not in (None, "N/A")
-        has_valid_ai = analysis and "temporarily unavailable" not in analysis and "failed to generate" not in analysis
-        
-        if has_real_metrics and has_valid_ai:
-            summary_data = cached_data
-    
+    # 2. Summary from current data, kept as today's report record. The AI text is
+    # cached by its inputs (see services/summary_cache.py), and concurrent
+    # requests share one computation and one write.
+    summary_data = await get_patient_health_summary(patient_id, record_as="ai_medical_report", window_days=window_days)
     if not summary_data:
-        # 3. Generate new analysis via engine
-        summary_data = await get_patient_health_summary(patient_id)
-        if not summary_data:
-            raise HTTPException(status_code=500, detail="Failed to generate biomechanical analysis summary.")
-            
-        # 4. Cache the result for today
-        await db["analysis_results"].insert_one({
-            "patient_id": patient_id,
-            "date": today,
-            "type": "ai_medical_report",
-            "data": summary_data,
-            "created_at": datetime.now(timezone.utc)
-        })
+        raise HTTPException(status_code=500, detail="Failed to generate biomechanical analysis summary.")
     
-    # 5. Debug output for data contract verification
+    # 3. Debug output for data contract verification
     print("--- GENERATING REPORT WITH DATA ---")
     print(summary_data)
     print("-----------------------------------")
 
-    # 6. Generate PDF
-    pdf_buffer = generate_medical_pdf(summary_data)
-    
-    # NEW: Save a copy to the reports folder for testing/history
-    reports_dir = "reports"
-    import os
-    if not os.path.exists(reports_dir):
-        os.makedirs(reports_dir)
+    # 4. Render in the PDF process pool, off the event loop
+    try:
+        pdf = await pdf_pool.render(render_medical_pdf, summary_data)
+    except PdfRenderBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
     
-    saved_filename = f"on_demand_{today}_{patient_id}.pdf"
-    with open(os.path.join(reports_dir, saved_filename), "wb") as f:
-        f.write(pdf_buffer.getbuffer())
+    # Save a copy to the reports folder for testing/history, once the response is out
+    saved_path = os.path.join(REPORTS_DIR, f"on_demand_{today}_{patient_id}.pdf")
     
     return StreamingResponse(
-        pdf_buffer,
+        _chunks(pdf),
         media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=Health_Report_{today}.pdf"}
+        headers={
+            "Content-Disposition": f"attachment; filename=Health_Report_{today}.pdf",
+            "Content-Length": str(len(pdf))
+        },
+        background=BackgroundTask(_archive, saved_path, pdf)
     )
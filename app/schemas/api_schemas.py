@@ -24,6 +24,8 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     email: Optional[str] = None
     role: Optional[str] = None
+    id: Optional[str] = None
+    patient_id: Optional[str] = None
 
 class UserOut(BaseModel):
     id: str
@@ -76,9 +78,18 @@ class DailyInput(BaseModel):
     pressure_distribution_index: float = Field(..., ge=0.0, le=1.0)
     daily_wear_hours: float = 8.0
 
+class DatedDailyInput(DailyInput):
+    date: str = Field(..., pattern=r"^\d{4}-\d{2}-\d{2}$") # YYYY-MM-DD the metrics belong to
+
+class DailyInputBatch(BaseModel):
+    # Items are validated one by one in the route so a bad entry doesn't reject the whole sync
+    items: List[Dict[str, Any]] = Field(..., min_length=1, max_length=366)
+
 class GaitUploadResponse(BaseModel):
     message: str
     record_id: str
+    row_count: int = 0
+    duplicate: bool = False
 
 # Analysis Schemas
 class AnalysisOut(BaseModel):
@@ -93,8 +104,8 @@ class TrendData(BaseModel):
     health_score: List[float] = []
     symmetry: List[float] = []
     walking_speed: List[float] = []
-    skin_temp: List[float] = []
-    moisture: List[float] = []
+    skin_temp: List[Optional[float]] = [] # None where a record has no skin reading
+    moisture: List[Optional[float]] = []
     pressure_distribution: List[float] = []
 
 class DashboardSummary(BaseModel):
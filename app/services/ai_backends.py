@@ -0,0 +1,333 @@
+"""
+Model backends behind the shared AI client (services/gemini_service.py).
+
+A backend makes one attempt at a call. The client wraps every attempt with
+rate limiting, the deadline, retries and the circuit breaker. Backends report
+failures as google.api_core exceptions (ResourceExhausted for 429,
+InternalServerError for 500, ...), so that wrapping behaves the same whichever
+backend is in use.
+
+- GeminiBackend: the Gemini API (google.generativeai).
+- StandInBackend: a local stand-in for load tests, benchmarks, CI and
+  air-gapped machines. It needs no network and no API key, and it offers:
+  - latency distributions for the first token and for each further chunk;
+  - streaming in chunks of AI_STANDIN_CHUNK_CHARS;
+  - injected 429s (with a retry hint) and 500s at configurable rates;
+  - canned responses, chosen deterministically from the request (or matched
+    from AI_STANDIN_RESPONSES_FILE). A structured (JSON) request gets a
+    narrative for each "Patient ID:" line of the prompt, as the nightly
+    batch in services/narrative_precompute.py asks for.
+
+AI_BACKEND selects one ("gemini" or "standin").
+
+Latency specs are in milliseconds:
+- "fixed:200";
+- "uniform:100:400";
+- "normal:300:50" (mean, sd);
+- "lognormal:800:0.5" (median, sigma);
+- "exponential:300" (mean).
+"""
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+
+from app.config import settings
+from app.core.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "gemini-2.0-flash"
+MODEL_CACHE_SIZE = 256
+
+class AIStream:
+    """A streamed response whose first piece of text has already arrived."""
+    first: str = ""
+
+    def chunks(self) -> AsyncIterator[str]:
+        """The text after `first`, piece by piece."""
+        raise NotImplementedError
+
+    def cancel(self):
+        """Stop generating: nobody will read the rest."""
+
+class AIBackend:
+    name = "base"
+
+    async def generate(self, prompt: str, system_instruction: Optional[str],
+                       history: Optional[List[Dict[str, Any]]],
+                       response_schema: Optional[Dict[str, Any]] = None) -> str:
+        """The whole response text; JSON matching `response_schema` if one is given."""
+        raise NotImplementedError
+
+    async def stream(self, prompt: str, system_instruction: Optional[str],
+                     history: Optional[List[Dict[str, Any]]]) -> AIStream:
+        """Returns once the first chunk has arrived."""
+        raise NotImplementedError
+
+# ─── Gemini ───────────────────────────────────────────────────
+
+def _chunk_text(chunk) -> str:
+    """Text of a raw GenerateContentResponse proto (a finish reason or safety block has none)."""
+    if not chunk.candidates:
+        return ""
+    return "".join(part.text for part in chunk.candidates[0].content.parts)
+
+class _GeminiStream(AIStream):
+    """
+    A streamGenerateContent call made on the generated async client, not
+    through GenerativeModel: the SDK's stream object neither exposes the call
+    (so it could not be cancelled) nor hands over a chunk before the next one
+    has arrived (it looks ahead to spot the end).
+    """
+    def __init__(self, call):
+        # grpc.aio.Call.cancel is what stops a disconnected chat from spending quota
+        if not callable(getattr(call, "cancel", None)):
+            raise TypeError(f"{type(call).__name__} has no cancel(); check the google-api-core version")
+        self._call = call
+        self._chunks = call.__aiter__()
+
+    async def start(self) -> "_GeminiStream":
+        try:
+            self.first = _chunk_text(await self._chunks.__anext__())
+        except StopAsyncIteration:
+            self.first = ""
+        return self
+
+    async def chunks(self) -> AsyncIterator[str]:
+        async for chunk in self._chunks:
+            yield _chunk_text(chunk)
+
+    def cancel(self):
+        self._call.cancel()
+
+class GeminiBackend(AIBackend):
+    name = "gemini"
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        self.model_name = model_name
+        # Chat system instructions carry each patient's clinical context, so keep only the recent ones
+        self._models = TTLCache(maxsize=MODEL_CACHE_SIZE, ttl=3600)
+        self._configured = False
+
+    def _configure(self):
+        if not self._configured:
+            import google.generativeai as genai
+            logger.info("Initializing Gemini AI model...")
+            genai.configure(api_key=settings.GEMINI_API_KEY)
+            self._configured = True
+
+    def _model(self, system_instruction: Optional[str] = None):
+        model = self._models.get(system_instruction)
+        if model is None:
+            import google.generativeai as genai
+            self._configure()
+            model = genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+            self._models.set(system_instruction, model)
+        return model
+
+    async def generate(self, prompt, system_instruction, history, response_schema=None) -> str:
+        model = self._model(system_instruction)
+        config = {"response_mime_type": "application/json", "response_schema": response_schema} if response_schema else None
+        if history:
+            response = await model.start_chat(history=history).send_message_async(prompt, generation_config=config)
+        else:
+            response = await model.generate_content_async(prompt, generation_config=config)
+        return response.text if response else ""
+
+    async def stream(self, prompt, system_instruction, history) -> AIStream:
+        from google.generativeai import client, protos
+        from google.generativeai.types.content_types import to_content, to_contents
+        self._configure()
+        request = protos.GenerateContentRequest(
+            model=f"models/{self.model_name}",
+            contents=to_contents([*(history or []), {"role": "user", "parts": [prompt]}]),
+            system_instruction=to_content(system_instruction) if system_instruction else None
+        )
+        call = await client.get_default_generative_async_client().stream_generate_content(request)
+        return await _GeminiStream(call).start()
+
+# ─── Local stand-in ───────────────────────────────────────────
+
+# kind -> (number of arguments, how many of them are durations, sampler)
+_LATENCY_KINDS = {
+    "fixed": (1, 1, lambda rng, v: v[0]),
+    "uniform": (2, 2, lambda rng, v: rng.uniform(v[0], v[1])),
+    "normal": (2, 2, lambda rng, v: rng.gauss(v[0], v[1])),
+    "lognormal": (2, 1, lambda rng, v: v[0] * math.exp(rng.gauss(0, v[1]))),
+    "exponential": (1, 1, lambda rng, v: rng.expovariate(1 / v[0]) if v[0] > 0 else 0.0),
+}
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """A sampler of latencies in seconds, from a spec in milliseconds (see the module docstring)."""
+    kind, *args = spec.strip().split(":")
+    if kind not in _LATENCY_KINDS or len(args) != _LATENCY_KINDS[kind][0]:
+        raise ValueError(f"Invalid latency spec {spec!r}")
+    _, durations, sample = _LATENCY_KINDS[kind]
+    try:
+        values = [float(a) / 1000 if i < durations else float(a) for i, a in enumerate(args)]
+    except ValueError:
+        raise ValueError(f"Invalid latency spec {spec!r}")
+    return lambda rng: max(0.0, sample(rng, values))
+
+# Picked by a hash of the request, so the same request always gets the same answer
+CANNED_RESPONSES = {
+    "report": (
+        "Gait remains broadly stable with cadence and step length in the expected range, though the "
+        "symmetry index suggests mild favouring of the sound limb. Pressure distribution is acceptable; "
+        "skin temperature and moisture show no immediate irritation risk, but socket fit should be "
+        "reviewed at the next visit.",
+        "Walking speed and step length are below target and gait symmetry is reduced, pointing to "
+        "reduced confidence in the prosthetic limb. Uneven pressure distribution raises the risk of "
+        "residual limb irritation; an alignment check and socket review are advised.",
+        "Biomechanical metrics are within normal limits with good symmetry and balanced loading. Skin "
+        "indicators are stable, and the current prosthetic setup appears well tolerated.",
+    ),
+    "summary": (
+        "The patient has asked about their gait symmetry and walking speed, and reported occasional "
+        "discomfort at the socket after long wear. The assistant explained the metrics, suggested "
+        "limiting continuous wear and recommended raising socket fit with their prosthetist.",
+    ),
+    "chat": (
+        "Your recent gait symmetry is slightly below the ideal range, which usually means you are "
+        "favouring your sound limb. Short, regular walks focusing on even step length can help, and it "
+        "is worth mentioning at your next prosthetist visit.",
+        "Skin temperature and moisture readings are within normal limits. Keep checking your residual "
+        "limb daily for redness or irritation, especially after long wear.",
+        "A lower walking speed can come from socket discomfort or alignment. If it persists for more "
+        "than a week, please ask your clinical team for an alignment check.",
+        "I can only assist with prosthetic and clinical monitoring topics.",
+    ),
+}
+
+_PATIENT_ID = re.compile(r"^Patient ID: (\S+)$", re.MULTILINE)
+
+class _StandInStream(AIStream):
+    def __init__(self, backend: "StandInBackend", pieces: List[str]):
+        self._backend = backend
+        self._rest = pieces[1:]
+        self.first = pieces[0] if pieces else ""
+        self.cancelled = False
+
+    async def chunks(self) -> AsyncIterator[str]:
+        for piece in self._rest:
+            await asyncio.sleep(self._backend.chunk_latency())
+            if self.cancelled:
+                return
+            yield piece
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self._backend.counts["cancelled"] += 1
+
+class StandInBackend(AIBackend):
+    name = "standin"
+
+    def __init__(self, latency: str = settings.AI_STANDIN_LATENCY,
+                 chunk_latency: str = settings.AI_STANDIN_CHUNK_LATENCY,
+                 chunk_chars: int = settings.AI_STANDIN_CHUNK_CHARS,
+                 rate_429: float = settings.AI_STANDIN_429_RATE,
+                 rate_500: float = settings.AI_STANDIN_500_RATE,
+                 seed: Optional[int] = settings.AI_STANDIN_SEED,
+                 responses_file: Optional[str] = settings.AI_STANDIN_RESPONSES_FILE):
+        self._first_latency = parse_latency(latency)
+        self._chunk_latency = parse_latency(chunk_latency)
+        self.chunk_chars = chunk_chars
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self._rng = random.Random(seed)
+        self._rules: List[Dict[str, str]] = []
+        if responses_file:
+            with open(responses_file, encoding="utf-8") as f:
+                self._rules = json.load(f) # [{"match": "<substring of the prompt>", "response": "..."}]
+        self.counts = {"calls": 0, "streams": 0, "injected_429": 0, "injected_500": 0, "cancelled": 0}
+
+    def first_latency(self) -> float:
+        return self._first_latency(self._rng)
+
+    def chunk_latency(self) -> float:
+        return self._chunk_latency(self._rng)
+
+    def respond(self, prompt: str, system_instruction: Optional[str],
+                history: Optional[List[Dict[str, Any]]]) -> str:
+        """The canned answer for this request; the same request always gets the same one."""
+        for rule in self._rules:
+            if rule["match"] in prompt:
+                return rule["response"]
+        if "running clinical summary" in prompt:
+            kind = "summary"
+        elif system_instruction is None and "biomechanics specialist" in prompt:
+            kind = "report"
+        else:
+            kind = "chat"
+        return self._pick(kind, [prompt, system_instruction, history])
+
+    def respond_structured(self, prompt: str) -> str:
+        """A JSON array with a canned narrative for every "Patient ID:" in the prompt."""
+        sections = _PATIENT_ID.split(prompt)[1:] # [id, text, id, text, ...]
+        return json.dumps([
+            {"id": patient, "summary": self._pick("report", text)}
+            for patient, text in zip(sections[::2], sections[1::2])
+        ])
+
+    def _pick(self, kind: str, request: Any) -> str:
+        canonical = json.dumps(request, sort_keys=True, default=str)
+        digest = int(hashlib.sha256(canonical.encode()).hexdigest(), 16)
+        options = CANNED_RESPONSES[kind]
+        return options[digest % len(options)]
+
+    def _split(self, text: str) -> List[str]:
+        """Chunks of about chunk_chars characters, cut after a space where possible."""
+        pieces, start = [], 0
+        while start < len(text):
+            end = min(len(text), start + self.chunk_chars)
+            if end < len(text):
+                space = text.rfind(" ", start, end)
+                end = space + 1 if space > start else end
+            pieces.append(text[start:end])
+            start = end
+        return pieces
+
+    async def _maybe_fail(self):
+        from google.api_core import exceptions as api
+
+        roll = self._rng.random()
+        if roll < self.rate_429:
+            self.counts["injected_429"] += 1
+            raise api.ResourceExhausted("Stand-in: quota exceeded, please retry in 1s")
+        if roll < self.rate_429 + self.rate_500:
+            # A server error costs some of the usual latency before it arrives
+            await asyncio.sleep(self.first_latency() / 2)
+            self.counts["injected_500"] += 1
+            raise api.InternalServerError("Stand-in: internal error")
+
+    async def generate(self, prompt, system_instruction, history, response_schema=None) -> str:
+        self.counts["calls"] += 1
+        await self._maybe_fail()
+        if response_schema:
+            text = self.respond_structured(prompt)
+        else:
+            text = self.respond(prompt, system_instruction, history)
+        # As long as streaming the same answer would take
+        delay = self.first_latency() + sum(self.chunk_latency() for _ in self._split(text)[1:])
+        await asyncio.sleep(delay)
+        return text
+
+    async def stream(self, prompt, system_instruction, history) -> AIStream:
+        self.counts["streams"] += 1
+        await self._maybe_fail()
+        await asyncio.sleep(self.first_latency())
+        return _StandInStream(self, self._split(self.respond(prompt, system_instruction, history)))
+
+def make_backend(name: str = settings.AI_BACKEND) -> AIBackend:
+    if name == "gemini":
+        return GeminiBackend()
+    if name == "standin":
+        logger.warning("AI backend: local stand-in (canned responses, no Gemini calls)")
+        return StandInBackend()
+    raise ValueError(f"Unknown AI_BACKEND {name!r} (expected 'gemini' or 'standin')")
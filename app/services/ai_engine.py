@@ -1,11 +1,20 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Mapping, Optional, Sequence
 import logging
+import math
+
+from app.services import clinical_rules
+from app.services.clinical_rules import METRIC_FIELDS, PROFILE_FIELDS
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever the rules (services/clinical_rules.py) change: stored records are stamped with the version
+# that scored them, and services/rescoring.py brings older ones up to date.
+SCORING_VERSION = 1
+
+SCORE_KEYS = ("gait_abnormality", "skin_risk", "prosthetic_health_score", "overall_risk")
+
 class AIEngine:
     def __init__(self):
-        self._abnormality_detector = None
         self._skin_risk_model = None
         self._initialized = False
 
@@ -14,91 +23,92 @@ class AIEngine:
             # Heavy imports inside to avoid slowing down app loading
             import pandas as pd
             import numpy as np
-            from sklearn.ensemble import IsolationForest, GradientBoostingClassifier
+            from sklearn.ensemble import GradientBoostingClassifier
             
             logger.info("Initializing ML models in AI Engine...")
-            self._abnormality_detector = IsolationForest(contamination=0.1)
             self._skin_risk_model = GradientBoostingClassifier()
             self._initialized = True
 
-    def analyze_gait(self, metrics: Dict[str, Any]) -> str:
-        # Simple rule-based logic doesn't strictly need the ML model yet, 
-        # but we ensure initialization if we use it later.
-        # self._ensure_initialized() 
-        
-        symmetry = metrics.get("gait_symmetry_index", 1.0)
-        speed = metrics.get("walking_speed_mps", 1.0)
-        step = metrics.get("step_length_cm", 50)
-        cadence = metrics.get("cadence_spm", 100)
-        pressure = metrics.get("pressure_distribution_index", 1.0)
-
-        if symmetry < 0.75 or speed < 0.7 or step < 30 or cadence < 70 or pressure < 0.6:
-            return "Abnormal"
-        return "Normal"
+    # The rules themselves live in services/clinical_rules.py
 
-    def analyze_skin_risk(self, metrics: Dict[str, Any]) -> str:
-        temp = metrics.get("skin_temperature_c", 30)
-        moisture = metrics.get("skin_moisture", 50)
-        wear = metrics.get("daily_wear_hours", 8)
+    def evaluate(self, metrics: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Labels, health score, overall risk, alerts, recommendations and report
+        interpretations for one record (with its "profile"), in a single pass.
+        """
+        return clinical_rules.evaluate(metrics)
 
-        risk_score = 0
-        if temp > 34: risk_score += 1
-        if moisture > 70: risk_score += 1
-        if wear > 12: risk_score += 1
+    def analyze_gait(self, metrics: Dict[str, Any]) -> str:
+        return clinical_rules.evaluate(metrics)["gait_abnormality"]
 
-        if risk_score <= 1: return "Low"
-        if risk_score == 2: return "Medium"
-        return "High"
+    def analyze_skin_risk(self, metrics: Dict[str, Any]) -> str:
+        return clinical_rules.evaluate(metrics)["skin_risk"]
 
     def calculate_prosthetic_health_score(self, metrics: Dict[str, Any]) -> float:
-        symmetry = metrics.get("gait_symmetry_index", 1.0)
-        pressure = metrics.get("pressure_distribution_index", 1.0)
-        speed = metrics.get("walking_speed_mps", 0.7)
-        moisture = metrics.get("skin_moisture", 70)
-        
-        profile = metrics.get("profile", {})
-        bmi = profile.get("bmi", 22)
-        bp_sys = profile.get("blood_pressure_systolic", 120)
-        sugar = profile.get("blood_sugar_mg_dl", 90)
-
-        score = 100
-        score -= (1 - symmetry) * 40
-        score -= max(0, 0.8 - pressure) * 30
-        score -= max(0, 0.7 - speed) * 25
-        score -= max(0, moisture - 70) * 0.5
-        
-        # Systemic Penalties
-        if bmi > 30:
-            score -= 10
-        if bp_sys > 140:
-            score -= 10
-        if sugar > 180:
-            score -= 15
-
-        return round(min(max(float(score), 0.0), 100.0), 2)
+        return clinical_rules.evaluate(metrics)["prosthetic_health_score"]
 
     def determine_overall_risk(self, metrics: Dict[str, Any]) -> str:
-        gait = self.analyze_gait(metrics)
-        skin = self.analyze_skin_risk(metrics)
-        pressure = metrics.get("pressure_distribution_index", 1.0)
-        
-        profile = metrics.get("profile", {})
-        bmi = profile.get("bmi", 22)
-        bp_sys = profile.get("blood_pressure_systolic", 120)
-        sugar = profile.get("blood_sugar_mg_dl", 90)
-        
-        risk_points = 0
-        if gait == "Abnormal": risk_points += 2
-        if skin == "High": risk_points += 2
-        elif skin == "Medium": risk_points += 1
-        if pressure < 0.6: risk_points += 2
-        
-        if bmi > 30: risk_points += 1
-        if bp_sys > 140 or sugar > 180: risk_points += 1
-        
-        if risk_points >= 4: return "High"
-        if risk_points >= 2: return "Moderate"
-        return "Low"
+        return clinical_rules.evaluate(metrics)["overall_risk"]
+
+    def gait_anomaly_fields(self, records: Sequence[Dict[str, Any]],
+                            profile: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        IsolationForest anomaly score for each record of one patient, from the
+        active trained model (see services/anomaly_models.py), as DailyRecord
+        fields to store next to the rule-based gait label. Empty dicts when no
+        model has been trained or it cannot be loaded, and for records missing a
+        model feature (e.g. sensor uploads without skin channels); scoring never
+        blocks a submission.
+        """
+        from app.services.anomaly_models import registry
+
+        try:
+            result = registry.score(records, profile)
+        except Exception as e:
+            logger.warning(f"Gait anomaly scoring unavailable: {e}")
+            result = None
+        if result is None:
+            return [{} for _ in records]
+        scores, model = result
+        return [
+            {"gait_anomaly_score": round(score, 4), "gait_anomaly_model": model} if not math.isnan(score) else {}
+            for score in scores.tolist()
+        ]
+
+    def score_columns(self, metrics: Mapping[str, Any], profile: Optional[Mapping[str, Any]] = None,
+                      size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Vectorized analyze_gait / analyze_skin_risk / calculate_prosthetic_health_score /
+        determine_overall_risk over columnar input.
+
+        `metrics` maps metric names to equal-length arrays; `profile` maps
+        bmi / blood_pressure_systolic / blood_sugar_mg_dl to per-row arrays or to
+        one value for every row. Missing columns take the scalar methods' defaults.
+        Returns NumPy arrays: gait_abnormality, skin_risk, prosthetic_health_score
+        and overall_risk, equal element for element to the scalar results.
+        """
+        profile = profile or {}
+        cols = clinical_rules.Columns.from_arrays(metrics, profile, size)
+        return _labels(clinical_rules.evaluate_columns(cols, [clinical_rules.cohort(profile)]))
+
+    def score_records(self, records: Sequence[Dict[str, Any]],
+                      profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        score_columns for a list of metric dicts. A record's own "profile" entry
+        (as passed to the scalar methods) takes precedence over `profile`.
+        """
+        return _labels(clinical_rules.evaluate_records(records, profile))
+
+    def score_batch(self, records: List[Dict[str, Any]], profile: Dict[str, Any]) -> Dict[str, List[Any]]:
+        """
+        score_records for many records of one patient, as plain lists aligned
+        with `records`.
+        """
+        scores = self.score_records(records, profile)
+        return {key: values.tolist() for key, values in scores.items()}
+
+def _labels(evaluated: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: evaluated[key] for key in SCORE_KEYS}
 
 # Global singleton is fine, but it won't load ML models until first use or manual init
 ai_engine = AIEngine()
@@ -1,112 +1,187 @@
+from app.config import settings
 from app.database import get_db
-from app.services.gemini_service import generate_medical_analysis
+from app.services.gemini_service import GeminiUnavailable, generate_medical_analysis
+from app.services.single_flight import flights
+from app.services.summary_cache import cached_summary, summary_key
 from datetime import datetime, timedelta, timezone
 from bson import ObjectId
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
 
-async def get_patient_health_summary(patient_id: ObjectId):
-    db = get_db()
-    
-    # 1. Fetch patient profile
-    profile = await db["patient_profiles"].find_one({"_id": patient_id})
-    if not profile:
-        return None
-    
-    # 2. Fetch daily_metrics (Temporarily remove date filter to verify retrieval)
-    # seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
-    daily_records = await db["daily_metrics"].find({
-        "patient_id": patient_id,
-        # "created_at": {"$gte": seven_days_ago}
-    }).limit(100).to_list(100)
-    
-    # 3. Compute biomechanical averages
-    if daily_records:
-        avg_step_length_cm = sum(r.get("step_length_cm", 0) for r in daily_records) / len(daily_records)
-        avg_cadence_spm = sum(r.get("cadence_spm", 0) for r in daily_records) / len(daily_records)
-        avg_walking_speed_mps = sum(r.get("walking_speed_mps", 0) for r in daily_records) / len(daily_records)
-        avg_gait_symmetry = sum(r.get("gait_symmetry_index", 0) for r in daily_records) / len(daily_records)
-        avg_skin_temp = sum(r.get("skin_temperature_c", 0) for r in daily_records) / len(daily_records)
-        avg_skin_moisture = sum(r.get("skin_moisture", 0) for r in daily_records) / len(daily_records)
-        avg_pressure_distribution = sum(r.get("pressure_distribution_index", 0) for r in daily_records) / len(daily_records)
-        avg_health_score = sum(r.get("prosthetic_health_score", 0) for r in daily_records) / len(daily_records)
-        
-        last_record = daily_records[-1]
-        gait_abnormality = last_record.get("gait_abnormality", "Normal")
-        skin_risk = last_record.get("skin_risk", "Low")
-    else:
-        avg_step_length_cm = avg_cadence_spm = avg_walking_speed_mps = avg_gait_symmetry = avg_skin_temp = avg_skin_moisture = avg_pressure_distribution = avg_health_score = 0
-        gait_abnormality = "No Data"
-        skin_risk = "No Data"
-    
-    # 4. Prepare improved structured prompt
+logger = logging.getLogger(__name__)
+
+# Averaged over the report's window; all but the health score appear in the AI prompt
+REPORT_METRICS = (
+    "step_length_cm", "cadence_spm", "walking_speed_mps", "gait_symmetry_index",
+    "pressure_distribution_index", "skin_temperature_c", "skin_moisture", "prosthetic_health_score",
+)
+# (label, field, decimals, unit) in the order the AI prompt lists them
+PROMPT_METRICS = (
+    ("Step Length", "step_length_cm", 1, " cm"),
+    ("Cadence", "cadence_spm", 1, " spm"),
+    ("Walking Speed", "walking_speed_mps", 2, " m/s"),
+    ("Gait Symmetry", "gait_symmetry_index", 2, ""),
+    ("Pressure Distribution", "pressure_distribution_index", 2, ""),
+    ("Skin Temperature", "skin_temperature_c", 1, " °C"),
+    ("Skin Moisture", "skin_moisture", 1, " %"),
+)
+WINDOW_STATS_CHUNK = 500 # Patients per aggregation
+
+ANALYSIS_INSTRUCTIONS = "Write strictly 2-3 lines of paragraph summarizing the key gait issues, stability, and clinical risks. Do not use bullet points."
+
+def _window_pipeline(patient_ids: List[ObjectId], since: datetime) -> List[Dict[str, Any]]:
+    return [
+        # Served by the (patient_id, created_at) index, which also provides the sort
+        {"$match": {"patient_id": {"$in": patient_ids}, "created_at": {"$gte": since}}},
+        {"$sort": {"patient_id": 1, "created_at": 1}},
+        {"$group": {
+            "_id": "$patient_id",
+            "records": {"$sum": 1},
+            "latest_at": {"$last": "$created_at"},
+            "gait_abnormality": {"$last": "$gait_abnormality"},
+            "skin_risk": {"$last": "$skin_risk"},
+            **{name: {"$avg": f"${name}"} for name in REPORT_METRICS},
+        }},
+    ]
+
+async def window_stats(db, patient_ids: List[ObjectId],
+                       window_days: int = settings.HEALTH_SUMMARY_WINDOW_DAYS) -> Dict[ObjectId, Dict[str, Any]]:
+    """
+    Per patient, over their daily_metrics of the last `window_days` days: the
+    average of each REPORT_METRICS field (records without the field do not
+    count towards it; None when no record has it), the number of records, and
+    the classification of the latest record. One aggregation per WINDOW_STATS_CHUNK patients; patients
+    without records in the window are left out.
+    """
+    since = datetime.now(timezone.utc) - timedelta(days=window_days)
+    stats = {}
+    for start in range(0, len(patient_ids), WINDOW_STATS_CHUNK):
+        chunk = list(patient_ids[start:start + WINDOW_STATS_CHUNK])
+        async for row in db["daily_metrics"].aggregate(_window_pipeline(chunk, since)):
+            stats[row["_id"]] = {
+                "averages": {name: row.get(name) for name in REPORT_METRICS},
+                "records": row["records"],
+                "latest_at": row["latest_at"],
+                "gait_abnormality": row.get("gait_abnormality") or "Normal",
+                "skin_risk": row.get("skin_risk") or "Low",
+            }
+    return stats
+
+def empty_stats() -> Dict[str, Any]:
+    """window_stats() for a patient without records in the window."""
+    return {
+        "averages": {name: None for name in REPORT_METRICS},
+        "records": 0,
+        "latest_at": None,
+        "gait_abnormality": "No Data",
+        "skin_risk": "No Data",
+    }
+
+def _rounded(value: Optional[float], digits: int) -> Optional[float]:
+    return None if value is None else round(value, digits)
+
+def summary_inputs(profile: Dict[str, Any], averages: Dict[str, Optional[float]],
+                   window_days: int = settings.HEALTH_SUMMARY_WINDOW_DAYS) -> Dict[str, Any]:
+    """
+    What the AI prompt shows: the averages at the precision it prints them
+    with, their window, and the clinical profile fields. The cached summary is
+    keyed on exactly these values (see services/summary_cache.py).
+    """
     cli = {
         "gender": profile.get("gender", "Unknown"),
         "bmi": profile.get("bmi", 0),
         "bp": f"{profile.get('blood_pressure_systolic', 0)}/{profile.get('blood_pressure_diastolic', 0)}",
         "sugar": profile.get("blood_sugar_mg_dl", 0)
     }
-    
-    prompt = f"""
-You are a prosthetic biomechanics specialist.
+    rounded = {field: _rounded(averages[field], digits) for _, field, digits, _ in PROMPT_METRICS}
+    return {"averages": rounded, "profile": cli, "window_days": window_days}
 
-Patient Clinical Profile:
+def patient_section(inputs: Dict[str, Any]) -> str:
+    """The prompt's description of one patient; a metric without data in the window reads N/A."""
+    cli, averages = inputs["profile"], inputs["averages"]
+    days = inputs["window_days"]
+    period = "Weekly Averages" if days == 7 else f"Averages over the Last {days} Days"
+    metrics = "".join(
+        f"{label}: {'N/A' if averages[field] is None else f'{averages[field]:.{digits}f}{unit}'}\n"
+        for label, field, digits, unit in PROMPT_METRICS
+    )
+    return f"""Patient Clinical Profile:
 Gender: {cli['gender']}
 BMI: {cli['bmi']}
 Blood Pressure: {cli['bp']}
 Blood Sugar: {cli['sugar']} mg/dL
 
-Biomechanical Metrics (Weekly Averages):
-Step Length: {avg_step_length_cm:.1f} cm
-Cadence: {avg_cadence_spm:.1f} spm
-Walking Speed: {avg_walking_speed_mps:.2f} m/s
-Gait Symmetry: {avg_gait_symmetry:.2f}
-Pressure Distribution: {avg_pressure_distribution:.2f}
-Skin Temperature: {avg_skin_temp:.1f} °C
-Skin Moisture: {avg_skin_moisture:.1f} %
+Biomechanical Metrics ({period}):
+{metrics}"""
+
+def analysis_prompt(inputs: Dict[str, Any]) -> str:
+    return f"""
+You are a prosthetic biomechanics specialist.
 
-Analyze the patient's prosthetic health based on the above metrics. Write strictly 2-3 lines of paragraph summarizing the key gait issues, stability, and clinical risks. Do not use bullet points.
+{patient_section(inputs)}
+Analyze the patient's prosthetic health based on the above metrics. {ANALYSIS_INSTRUCTIONS}
 """
 
-    try:
-        import asyncio
-        # Add a 15-second timeout for the AI call
-        analysis_text = await asyncio.wait_for(generate_medical_analysis(prompt), timeout=15.0)
-    except Exception as e:
-        error_msg = str(e)
-        print(f"AI ENGINE ERROR: {error_msg}")
-        
-        if "429" in error_msg or "Quota exceeded" in error_msg:
-             analysis_text = "AI Clinical Interpretation based on patient health temporarily unavailable due to high usage. Please try again later."
-        else:
-             analysis_text = f"AI interpretation failed to generate. Error: {error_msg}. Please check system logs and API key configuration."
+async def get_patient_health_summary(patient_id: ObjectId, record_as: Optional[str] = None,
+                                     window_days: int = settings.HEALTH_SUMMARY_WINDOW_DAYS):
+    """
+    Report data for a patient: metric averages over the last `window_days`
+    days, the latest classification, clinical profile and the AI summary. With
+    `record_as`, the result is also kept as today's analysis_results document
+    of that type.
+    """
+    db = get_db()
     
-    print("--- GENERATING AI ANALYSIS ---")
-    print(analysis_text)
-    print("------------------------------")
+    # 1. Fetch patient profile
+    profile = await db["patient_profiles"].find_one({"_id": patient_id})
+    if not profile:
+        return None
+    
+    # 2-3. Biomechanical averages and latest classification, computed by Mongo
+    stats = (await window_stats(db, [patient_id], window_days)).get(patient_id) or empty_stats()
+    avg = stats["averages"]
+    avg_step_length_cm = avg["step_length_cm"]
+    avg_cadence_spm = avg["cadence_spm"]
+    avg_walking_speed_mps = avg["walking_speed_mps"]
+    avg_gait_symmetry = avg["gait_symmetry_index"]
+    avg_skin_temp = avg["skin_temperature_c"]
+    avg_skin_moisture = avg["skin_moisture"]
+    avg_pressure_distribution = avg["pressure_distribution_index"]
+    avg_health_score = avg["prosthetic_health_score"]
+    gait_abnormality = stats["gait_abnormality"]
+    skin_risk = stats["skin_risk"]
     
+    # 4. Prepare improved structured prompt
+    inputs = summary_inputs(profile, avg, window_days)
+    cli = inputs["profile"]
+    prompt = analysis_prompt(inputs)
+
     from app.services.ai_engine import ai_engine
     composite_metrics = {
         "gait_symmetry_index": avg_gait_symmetry,
         "pressure_distribution_index": avg_pressure_distribution,
         "skin_temperature_c": avg_skin_temp,
         "skin_moisture": avg_skin_moisture,
-        "profile": profile
     }
-    clinical_risk = ai_engine.determine_overall_risk(composite_metrics)
+    # A metric without data in the window is left to the rules' defaults, as a missing field is
+    composite_metrics = {name: value for name, value in composite_metrics.items() if value is not None}
+    clinical_risk = ai_engine.evaluate({**composite_metrics, "profile": profile})["overall_risk"]
 
     summary_data = {
         "metrics": {
-            "avg_step_length_cm": round(avg_step_length_cm, 2),
-            "avg_cadence_spm": round(avg_cadence_spm, 2),
-            "avg_walking_speed_mps": round(avg_walking_speed_mps, 2),
-            "avg_gait_symmetry_index": round(avg_gait_symmetry, 2),
-            "avg_pressure_distribution_index": round(avg_pressure_distribution, 2),
-            "avg_skin_temperature_c": round(avg_skin_temp, 2),
-            "avg_skin_moisture": round(avg_skin_moisture, 2),
+            "avg_step_length_cm": _rounded(avg_step_length_cm, 2),
+            "avg_cadence_spm": _rounded(avg_cadence_spm, 2),
+            "avg_walking_speed_mps": _rounded(avg_walking_speed_mps, 2),
+            "avg_gait_symmetry_index": _rounded(avg_gait_symmetry, 2),
+            "avg_pressure_distribution_index": _rounded(avg_pressure_distribution, 2),
+            "avg_skin_temperature_c": _rounded(avg_skin_temp, 2),
+            "avg_skin_moisture": _rounded(avg_skin_moisture, 2),
         },
         "classification": {
             "gait_abnormality": gait_abnormality,
             "skin_risk": skin_risk,
-            "prosthetic_health_score": round(avg_health_score, 2),
+            "prosthetic_health_score": _rounded(avg_health_score, 2),
             "overall_clinical_risk": clinical_risk
         },
         "clinical_profile": {
@@ -116,15 +191,56 @@ Analyze the patient's prosthetic health based on the above metrics. Write strict
             "bmi": cli["bmi"],
             "blood_pressure": cli["bp"],
             "blood_sugar_mg_dl": cli["sugar"],
-            "medical_conditions": profile.get("medical_conditions", [])
+            "medical_conditions": profile.get("medical_conditions", []),
+            "amputation_level": profile.get("amputation_level")
         },
-        "analysis": analysis_text,
         "patient_name": profile.get('name', 'Unknown'),
         "patient_age": profile.get('age', 0),
+        "window_days": window_days,
+        "records_in_window": stats["records"],
         "recent_alerts": []
     }
 
-    if avg_pressure_distribution < 0.6:
+    if avg_pressure_distribution is not None and avg_pressure_distribution < 0.6:
         summary_data["recent_alerts"].append("Load Imbalance Detected")
     
-    return summary_data
+    # Concurrent requests over the same data (double clicks, patient and admin at
+    # once, several workers) share one AI call and one analysis_results write
+    fingerprint = summary_key({"patient_id": str(patient_id), "record_as": record_as, "summary": summary_data})
+
+    async def complete() -> dict:
+        summary_data["analysis"] = await _analysis_text(db, patient_id, prompt, inputs)
+        if record_as:
+            await db["analysis_results"].update_one(
+                {"patient_id": patient_id, "date": datetime.now(timezone.utc).strftime("%Y-%m-%d"), "type": record_as},
+                {"$set": {"data": summary_data, "created_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+        return summary_data
+
+    return await flights.run(db, f"health_summary:{fingerprint}", complete)
+
+async def _analysis_text(db, patient_id: ObjectId, prompt: str, inputs: Dict[str, Any]) -> str:
+    async def generate() -> str:
+        # Deadline, retries and rate limiting are handled by the shared Gemini client
+        return await generate_medical_analysis(prompt)
+
+    try:
+        analysis_text, cache_status = await cached_summary(
+            db, patient_id, inputs, generate
+        )
+        logger.info(f"AI summary for patient {patient_id}: {cache_status}")
+    except Exception as e:
+        error_msg = str(e)
+        print(f"AI ENGINE ERROR: {error_msg}")
+        
+        if isinstance(e, GeminiUnavailable) and (e.quota or e.reason == "circuit_open"):
+             analysis_text = "AI Clinical Interpretation based on patient health temporarily unavailable due to high usage. Please try again later."
+        else:
+             analysis_text = f"AI interpretation failed to generate. Error: {error_msg}. Please check system logs and API key configuration."
+    
+    print("--- GENERATING AI ANALYSIS ---")
+    print(analysis_text)
+    print("------------------------------")
+    
+    return analysis_text
@@ -0,0 +1,284 @@
+"""
+Gait anomaly detection with IsolationForest models trained offline
+(scripts/train_gait_anomaly_models.py) on historical `daily_metrics`.
+
+A trained forest is exported to flat NumPy node arrays and scored here with a
+branch-free traversal of all trees at once, so serving needs neither sklearn
+nor pickles and a single record scores in well under a millisecond.
+
+Registry layout (settings.GAIT_MODEL_DIR):
+
+    CURRENT                         active version id
+    <version>/manifest.json         training metadata and the cohorts it holds
+    <version>/<cohort>/model.json   offset, normaliser, tree depth
+    <version>/<cohort>/*.npy        node arrays, opened with mmap_mode="r"
+
+Artifacts are memory-mapped read-only, so every worker on a host shares the
+same page-cache pages instead of holding its own copy. Versions are loaded on
+first use and the least recently used ones are dropped past a small cap.
+
+Scores follow sklearn's decision_function: negative means anomalous.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import uuid
+
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+FEATURES = (
+    "step_length_cm", "cadence_spm", "walking_speed_mps", "gait_symmetry_index",
+    "skin_temperature_c", "skin_moisture", "pressure_distribution_index", "daily_wear_hours"
+)
+POPULATION = "population"
+NODE_ARRAYS = ("feature", "threshold", "left", "right", "path_length", "roots")
+BLOCK_ROWS = 1024
+COHORT_FIELD = "amputation_level" # The profile field cohort_of reads
+
+def cohort_of(profile: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Cohort name for a patient profile (its amputation level), or None."""
+    level = (profile or {}).get(COHORT_FIELD)
+    if not level:
+        return None
+    return re.sub(r"[^a-z0-9]+", "_", str(level).strip().lower()).strip("_") or None
+
+def feature_matrix(records: Sequence[Dict[str, Any]]) -> np.ndarray:
+    """(n x FEATURES) float64 matrix; a missing metric becomes NaN."""
+    return np.array([[r.get(f, np.nan) for f in FEATURES] for r in records], dtype=np.float64).reshape(-1, len(FEATURES))
+
+class ForestModel:
+    """An exported IsolationForest: all trees' nodes concatenated into flat arrays."""
+    def __init__(self, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]):
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.path_length = arrays["path_length"]
+        self.roots = arrays["roots"]
+        self.offset = float(meta["offset"])
+        self.denominator = float(meta["denominator"])
+        self.max_depth = int(meta["max_depth"])
+
+    @classmethod
+    def from_sklearn(cls, forest) -> "ForestModel":
+        """
+        Flatten a fitted sklearn IsolationForest. Leaves point at themselves, so
+        traversal can run a fixed max_depth steps without checking for leaves.
+        Each node carries its final path length: depth + c(n_node_samples) - 1,
+        exactly the per-leaf term sklearn adds up in score_samples.
+        """
+        from sklearn.ensemble._iforest import _average_path_length
+
+        subsampled = forest._max_features != forest.n_features_in_
+        parts = {name: [] for name in NODE_ARRAYS if name != "roots"}
+        roots, start = [], 0
+        for tree, features in zip(forest.estimators_, forest.estimators_features_):
+            t = tree.tree_
+            leaf = t.children_left == -1
+            local = np.arange(t.node_count)
+            feature = np.asarray(features)[t.feature] if subsampled else t.feature.copy()
+            feature[leaf] = 0
+            parts["feature"].append(feature.astype(np.int32))
+            parts["threshold"].append(np.where(leaf, 0.0, t.threshold))
+            parts["left"].append((np.where(leaf, local, t.children_left) + start).astype(np.int32))
+            parts["right"].append((np.where(leaf, local, t.children_right) + start).astype(np.int32))
+            parts["path_length"].append(
+                t.compute_node_depths() + _average_path_length(t.n_node_samples) - 1.0
+            )
+            roots.append(start)
+            start += t.node_count
+
+        arrays = {name: np.concatenate(values) for name, values in parts.items()}
+        arrays["roots"] = np.array(roots, dtype=np.int32)
+        meta = {
+            "offset": float(forest.offset_),
+            "denominator": float(len(forest.estimators_) * _average_path_length([forest._max_samples])[0]),
+            "max_depth": int(max(tree.tree_.max_depth for tree in forest.estimators_)),
+        }
+        return cls(arrays, meta)
+
+    @classmethod
+    def load(cls, path: Path) -> "ForestModel":
+        meta = json.loads((path / "model.json").read_text())
+        # Plain ndarray views of the read-only mappings: same shared pages, without
+        # np.memmap's per-indexing overhead
+        arrays = {name: np.asarray(np.load(path / f"{name}.npy", mmap_mode="r")) for name in NODE_ARRAYS}
+        return cls(arrays, meta)
+
+    def save(self, path: Path, **extra_meta):
+        path.mkdir(parents=True, exist_ok=True)
+        for name in NODE_ARRAYS:
+            np.save(path / f"{name}.npy", np.ascontiguousarray(getattr(self, name)))
+        meta = {"offset": self.offset, "denominator": self.denominator, "max_depth": self.max_depth, **extra_meta}
+        (path / "model.json").write_text(json.dumps(meta, indent=2))
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        # sklearn's trees compare float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if len(X) <= BLOCK_ROWS:
+            return self._decision_block(X)
+        # Blocks keep the (rows x trees) working arrays cache-sized
+        return np.concatenate([self._decision_block(X[i:i + BLOCK_ROWS]) for i in range(0, len(X), BLOCK_ROWS)])
+
+    def _decision_block(self, X: np.ndarray) -> np.ndarray:
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        depths = self.path_length[node].sum(axis=1)
+        return -(2.0 ** (-depths / self.denominator)) - self.offset
+
+class ModelVersion:
+    """One trained version: its manifest plus lazily opened cohort models."""
+    def __init__(self, path: Path):
+        self.path = path
+        self.version = path.name
+        self.manifest = json.loads((path / "manifest.json").read_text())
+        self._models: Dict[str, ForestModel] = {}
+        self._lock = threading.Lock()
+
+    def model_for(self, cohort: Optional[str]) -> tuple:
+        """(cohort name, model): the cohort's own model if one was trained, else the population model."""
+        name = cohort if cohort in self.manifest["cohorts"] else POPULATION
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    model = self._models[name] = ForestModel.load(self.path / name)
+        return name, model
+
+class ModelRegistry:
+    """Versioned model directory with lazy loading and an LRU cap on open versions."""
+    def __init__(self, root: str, max_versions: int = settings.GAIT_MODEL_MAX_LOADED_VERSIONS):
+        self.root = Path(root)
+        self.max_versions = max_versions
+        self._versions: "OrderedDict[str, ModelVersion]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._current: Optional[str] = None
+        self._current_mtime: Optional[float] = None
+
+    def active_version(self) -> Optional[str]:
+        """The version named in CURRENT; re-read only when the file changes."""
+        pointer = self.root / "CURRENT"
+        try:
+            mtime = pointer.stat().st_mtime
+        except FileNotFoundError:
+            self._current = self._current_mtime = None
+            return None
+        if mtime != self._current_mtime:
+            self._current = pointer.read_text().strip() or None
+            self._current_mtime = mtime
+        return self._current
+
+    def get(self, version: Optional[str] = None) -> Optional[ModelVersion]:
+        version = version or self.active_version()
+        if not version:
+            return None
+        with self._lock:
+            loaded = self._versions.get(version)
+            if loaded is not None:
+                self._versions.move_to_end(version)
+                return loaded
+            path = self.root / version
+            if not (path / "manifest.json").exists():
+                return None
+            loaded = self._versions[version] = ModelVersion(path)
+            while len(self._versions) > self.max_versions:
+                evicted, _ = self._versions.popitem(last=False)
+                logger.info(f"Unloaded gait anomaly model version {evicted}")
+            logger.info(f"Loaded gait anomaly model version {version}")
+            return loaded
+
+    def versions(self) -> List[str]:
+        if not self.root.exists():
+            return []
+        return sorted(p.name for p in self.root.iterdir() if (p / "manifest.json").exists())
+
+    def activate(self, version: str):
+        if not (self.root / version / "manifest.json").exists():
+            raise ValueError(f"Unknown model version {version}")
+        tmp = self.root / "CURRENT.tmp"
+        tmp.write_text(version + "\n")
+        os.replace(tmp, self.root / "CURRENT")
+
+    def score(self, records: Sequence[Dict[str, Any]], profile: Optional[Dict[str, Any]] = None) -> Optional[tuple]:
+        """
+        (scores, "<version>/<cohort>") for records of one patient, or None without
+        an active model. A record missing any feature scores NaN: the models are
+        trained on complete records only and the traversal cannot route a NaN.
+        """
+        loaded = self.get()
+        if loaded is None:
+            return None
+        cohort, model = loaded.model_for(cohort_of(profile))
+        X = feature_matrix(records)
+        complete = ~np.isnan(X).any(axis=1)
+        scores = np.full(len(X), np.nan)
+        if complete.any():
+            scores[complete] = model.decision_function(X[complete])
+        return scores, f"{loaded.version}/{cohort}"
+
+def train_version(X: np.ndarray, cohorts: Sequence[Optional[str]], root: str,
+                  n_estimators: int = 100, contamination: Any = "auto",
+                  min_cohort_samples: int = settings.GAIT_MODEL_MIN_COHORT_SAMPLES,
+                  random_state: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Fit a population model on all of X plus one model per cohort with at least
+    `min_cohort_samples` rows, and write them as a new version under `root`.
+    The version is written to a temporary directory and renamed into place, so
+    readers never see a partial version. Does not activate it.
+    """
+    from sklearn.ensemble import IsolationForest
+
+    X = np.asarray(X, dtype=np.float64)
+    cohorts = np.array([c or "" for c in cohorts], dtype=object)
+    # Time first so versions sort by training time; the suffix keeps same-second trainings apart
+    version = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+    root_path = Path(root)
+    staging = root_path / f".{version}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+
+    groups = {POPULATION: np.ones(len(X), dtype=bool)}
+    for name in sorted(set(cohorts) - {""}):
+        mask = cohorts == name
+        if mask.sum() >= min_cohort_samples:
+            groups[name] = mask
+
+    manifest = {
+        "version": version,
+        "trained_at": datetime.now(timezone.utc).isoformat(),
+        "features": list(FEATURES),
+        "n_estimators": n_estimators,
+        "contamination": contamination,
+        "cohorts": {},
+    }
+    for name, mask in groups.items():
+        forest = IsolationForest(n_estimators=n_estimators, contamination=contamination, random_state=random_state)
+        forest.fit(X[mask])
+        model = ForestModel.from_sklearn(forest)
+        # The exported traversal must reproduce sklearn before it is published
+        sample = X[mask][:2000]
+        if not np.allclose(model.decision_function(sample), forest.decision_function(sample), rtol=0, atol=1e-9):
+            raise RuntimeError(f"Exported {name} model does not match sklearn")
+        model.save(staging / name, n_samples=int(mask.sum()))
+        manifest["cohorts"][name] = {"n_samples": int(mask.sum()), "nodes": int(len(model.feature))}
+        logger.info(f"Trained {name} gait anomaly model on {mask.sum()} records")
+
+    (staging / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    os.replace(staging, root_path / version)
+    return manifest
+
+registry = ModelRegistry(settings.GAIT_MODEL_DIR)
@@ -0,0 +1,260 @@
+"""
+Chat history storage: small session documents plus fixed-size message buckets.
+
+`patient_chat_sessions` holds one document per session:
+- status and owner;
+- `message_count`;
+- the rolling summary.
+
+The messages themselves live in `chat_buckets`, CHAT_BUCKET_SIZE per
+document. Message number i (its `index`, counted from 0) is in the bucket
+with `seq` i // CHAT_BUCKET_SIZE. An append first reserves its indexes with
+$inc on message_count, so concurrent appends never overfill a bucket. Each
+push keeps its bucket sorted by index.
+
+Reads never load a whole conversation:
+- gemini_context(): the rolling summary, then the last CHAT_CONTEXT_MESSAGES
+  messages, read with a negative $slice from the newest bucket(s);
+- history_page(): one page of messages before an index, from the one to
+  three buckets covering it.
+
+Once CHAT_SUMMARY_BATCH messages have left the context window without being
+summarised, a background task asks Gemini to fold them into the session's
+`summary` (at most CHAT_SUMMARY_MAX_CHARS). The summary covers every message
+before `summary_through`. Both document size and prompt size stay bounded,
+however long a patient keeps chatting.
+
+Sessions written before buckets existed keep their messages in an embedded
+`messages` array. Such a session is moved to buckets the first time it is
+read.
+"""
+from typing import Any, Dict, List, Optional, Set
+from datetime import datetime, timezone
+from itertools import groupby
+import asyncio
+import logging
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+from app.services.gemini_service import gemini
+from app.services.single_flight import flights
+
+logger = logging.getLogger(__name__)
+
+# Session reads never pull in a legacy embedded array
+SESSION_PROJECTION = {"messages": 0}
+# Messages summarised per Gemini call, when the summary has fallen far behind
+MAX_FOLD_MESSAGES = 100
+
+SUMMARY_PROMPT = """You keep a running clinical summary of a conversation between a prosthetic patient and the ProthexaI Clinical Assistant.
+
+Summary so far:
+{summary}
+
+New messages:
+{transcript}
+
+Write the updated summary in at most {words} words. Keep the symptoms, concerns and metrics the patient reported and the advice given; leave out greetings and repetition. Plain prose, no bullet points."""
+
+_background: Set[asyncio.Task] = set()
+
+def _seq(index: int) -> int:
+    return index // settings.CHAT_BUCKET_SIZE
+
+# ─── Sessions ──────────────────────────────────────────────
+async def find_session(db, query: Dict[str, Any], sort: Optional[list] = None) -> Optional[Dict[str, Any]]:
+    """The first session matching `query`, without messages. Legacy sessions are moved to buckets first."""
+    session = await db["patient_chat_sessions"].find_one(query, SESSION_PROJECTION, sort=sort)
+    if session is not None and "message_count" not in session:
+        session = await _migrate_legacy(db, session)
+    return session
+
+async def active_session(db, patient_id, user_id: str) -> Dict[str, Any]:
+    """The patient's active chat session, created if there is none."""
+    session = await find_session(db, {"patient_id": patient_id, "session_status": "active"})
+    if session:
+        return session
+
+    now = datetime.now(timezone.utc)
+    session = {
+        "patient_id": patient_id,
+        "user_id": user_id,
+        "session_status": "active",
+        "message_count": 0,
+        "summary": None,
+        "summary_through": 0,
+        "created_at": now,
+        "updated_at": now
+    }
+    result = await db["patient_chat_sessions"].insert_one(session)
+    session["_id"] = result.inserted_id
+    return session
+
+async def _migrate_legacy(db, session: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Move an embedded `messages` array into buckets. Safe to run twice at once:
+    bucket contents are only set on insert, and the session is switched over
+    only if it has not been already.
+    """
+    legacy = await db["patient_chat_sessions"].find_one({"_id": session["_id"]}, {"messages": 1})
+    messages = (legacy or {}).get("messages") or []
+    size = settings.CHAT_BUCKET_SIZE
+    for start in range(0, len(messages), size):
+        chunk = [{**msg, "index": start + k} for k, msg in enumerate(messages[start:start + size])]
+        try:
+            await db["chat_buckets"].update_one(
+                {"session_id": session["_id"], "seq": _seq(start)},
+                {"$setOnInsert": {"patient_id": session["patient_id"], "messages": chunk, "count": len(chunk)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass # Migrated concurrently
+
+    await db["patient_chat_sessions"].update_one(
+        {"_id": session["_id"], "message_count": {"$exists": False}},
+        {"$set": {"message_count": len(messages), "summary": None, "summary_through": 0},
+         "$unset": {"messages": ""}}
+    )
+    logger.info(f"Moved {len(messages)} chat messages of session {session['_id']} into buckets")
+    return await db["patient_chat_sessions"].find_one({"_id": session["_id"]}, SESSION_PROJECTION)
+
+# ─── Messages ──────────────────────────────────────────────
+async def append(db, session: Dict[str, Any], messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Store `messages` at the end of the session. Returns them with their `index`."""
+    updated = await db["patient_chat_sessions"].find_one_and_update(
+        {"_id": session["_id"]},
+        {"$inc": {"message_count": len(messages)}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        projection={"message_count": 1, "summary_through": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    first = updated["message_count"] - len(messages)
+    indexed = [{**msg, "index": first + k} for k, msg in enumerate(messages)]
+
+    for seq, group in groupby(indexed, key=lambda msg: _seq(msg["index"])):
+        group = list(group)
+        update = {
+            "$push": {"messages": {"$each": group, "$sort": {"index": 1}}},
+            "$inc": {"count": len(group)},
+            "$setOnInsert": {"patient_id": session["patient_id"]}
+        }
+        try:
+            await db["chat_buckets"].update_one({"session_id": session["_id"], "seq": seq}, update, upsert=True)
+        except DuplicateKeyError:
+            # Another append created this bucket at the same moment; it exists now
+            await db["chat_buckets"].update_one({"session_id": session["_id"], "seq": seq}, update)
+
+    session["message_count"] = updated["message_count"]
+    _compact_if_due(db, session["_id"], updated["message_count"], updated.get("summary_through", 0))
+    return indexed
+
+async def tail(db, session: Dict[str, Any], n: int) -> List[Dict[str, Any]]:
+    """The last `n` messages, oldest first, sliced out of the newest bucket(s)."""
+    count = session.get("message_count", 0)
+    n = min(n, count)
+    if n <= 0:
+        return []
+    cursor = db["chat_buckets"].find(
+        {"session_id": session["_id"], "seq": {"$gte": _seq(count - n)}},
+        {"messages": {"$slice": -n}, "seq": 1}
+    ).sort("seq", 1)
+    messages = [msg async for bucket in cursor for msg in bucket["messages"]]
+    return [msg for msg in messages if count - n <= msg["index"] < count]
+
+async def read_range(db, session_id, start: int, stop: int) -> List[Dict[str, Any]]:
+    """Messages with start <= index < stop, oldest first."""
+    if stop <= start:
+        return []
+    cursor = db["chat_buckets"].find(
+        {"session_id": session_id, "seq": {"$gte": _seq(start), "$lte": _seq(stop - 1)}},
+        {"messages": 1, "seq": 1}
+    ).sort("seq", 1)
+    messages = [msg async for bucket in cursor for msg in bucket["messages"]]
+    return [msg for msg in messages if start <= msg["index"] < stop]
+
+async def history_page(db, session: Dict[str, Any], before: Optional[int], limit: int) -> Dict[str, Any]:
+    """
+    Up to `limit` messages just before index `before` (default: the newest),
+    oldest first. `next_before` fetches the page before this one; it is None
+    at the start of the conversation.
+    """
+    total = session.get("message_count", 0)
+    stop = total if before is None else max(0, min(before, total))
+    start = max(0, stop - limit)
+    return {
+        "messages": await read_range(db, session["_id"], start, stop),
+        "total": total,
+        "next_before": start if start > 0 else None
+    }
+
+# ─── Gemini context ────────────────────────────────────────
+async def gemini_context(db, session: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Chat history for Gemini: the rolling summary, then the most recent messages verbatim."""
+    unsummarised = session.get("message_count", 0) - session.get("summary_through", 0)
+    recent = await tail(db, session, min(settings.CHAT_CONTEXT_MESSAGES, unsummarised))
+    # The conversation handed to Gemini must open with a user turn
+    while recent and recent[0]["sender"] != "user":
+        recent.pop(0)
+
+    history = []
+    if session.get("summary"):
+        history += [
+            {"role": "user", "parts": [f"Summary of our conversation so far:\n{session['summary']}"]},
+            {"role": "model", "parts": ["Understood, I will keep that in mind."]},
+        ]
+    history += [
+        {"role": "user" if msg["sender"] == "user" else "model", "parts": [msg["message"]]}
+        for msg in recent
+    ]
+    return history
+
+def _compact_if_due(db, session_id, count: int, summary_through: int):
+    if count - settings.CHAT_CONTEXT_MESSAGES - summary_through < settings.CHAT_SUMMARY_BATCH:
+        return
+
+    async def run():
+        try:
+            # One summariser per session and starting point across workers
+            await flights.run(db, f"chat_summary:{session_id}:{summary_through}", lambda: compact(db, session_id))
+        except Exception as e:
+            logger.warning(f"Chat summary update failed for session {session_id}: {e}")
+
+    task = asyncio.create_task(run())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+async def compact(db, session_id) -> int:
+    """
+    Fold messages that have left the context window into the rolling summary.
+    Returns the new `summary_through`. Raises GeminiUnavailable.
+    """
+    session = await db["patient_chat_sessions"].find_one(
+        {"_id": session_id}, {"message_count": 1, "summary": 1, "summary_through": 1}
+    )
+    through = session.get("summary_through", 0)
+    stop = session["message_count"] - settings.CHAT_CONTEXT_MESSAGES
+    if stop - through < settings.CHAT_SUMMARY_BATCH:
+        return through
+    stop = min(stop, through + MAX_FOLD_MESSAGES)
+
+    older = await read_range(db, session_id, through, stop)
+    transcript = "\n".join(
+        f"{'Patient' if msg['sender'] == 'user' else 'Assistant'}: {msg['message']}" for msg in older
+    )
+    text = await gemini.generate(SUMMARY_PROMPT.format(
+        summary=session.get("summary") or "(none yet)",
+        transcript=transcript,
+        words=settings.CHAT_SUMMARY_MAX_CHARS // 7
+    ))
+    # Only if nobody moved the summary on meanwhile
+    await db["patient_chat_sessions"].update_one(
+        {"_id": session_id, "summary_through": through},
+        {"$set": {
+            "summary": text.strip()[:settings.CHAT_SUMMARY_MAX_CHARS],
+            "summary_through": stop,
+            "summary_updated_at": datetime.now(timezone.utc)
+        }}
+    )
+    logger.info(f"Chat session {session_id}: summary now covers {stop} messages")
+    return stop
@@ -0,0 +1,298 @@
+"""
+Precomputed clinical context per patient, for grounding the chat assistant.
+
+One document per patient in `patient_clinical_context`. It holds per-day
+metric sums for the last 2 x CLINICAL_CONTEXT_WINDOW_DAYS days of data,
+counted back from the newest record. Also kept: the labels of the newest
+record and what is derived from those. That is:
+- averages over the recent window, each compared with the window before it
+  (trend);
+- the overall clinical risk of those averages;
+- the alerts of the newest record;
+- `prompt`, the whole context rendered as text for the chat system prompt.
+
+Every stored daily record is folded in with update_context() (compare-and-set
+on `version`, like services/patient_baseline.py), without re-reading any
+history. A chat message therefore costs one point read of this document and no
+aggregation. The document is rebuilt from `daily_metrics` only when it is
+missing or was scored under another SCORING_VERSION. A profile change is
+picked up by re-deriving from the stored sums.
+"""
+from typing import Any, Dict, Optional, Sequence
+from datetime import datetime, timedelta, timezone
+import logging
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+from app.services.patient_baseline import METRICS
+
+logger = logging.getLogger(__name__)
+
+MAX_UPDATE_ATTEMPTS = 5
+
+# name -> (label, unit suffix, decimals) as shown to the model
+METRIC_LABELS = {
+    "step_length_cm": ("Step length", " cm", 1),
+    "cadence_spm": ("Cadence", " steps/min", 1),
+    "walking_speed_mps": ("Walking speed", " m/s", 2),
+    "gait_symmetry_index": ("Gait symmetry index", "", 2),
+    "pressure_distribution_index": ("Pressure distribution index", "", 2),
+    "skin_temperature_c": ("Skin temperature", " °C", 1),
+    "skin_moisture": ("Skin moisture", " %", 1),
+    "daily_wear_hours": ("Daily wear", " h", 1),
+    "prosthetic_health_score": ("Prosthetic health score", "/100", 1),
+}
+LATEST_FIELDS = ("date", "gait_abnormality", "skin_risk", "prosthetic_health_score", "gait_anomaly_score")
+PROFILE_FACTS = (
+    "name", "age", "gender", "bmi", "blood_pressure_systolic", "blood_pressure_diastolic",
+    "blood_sugar_mg_dl", "medical_conditions", "amputation_level", "device_type"
+)
+
+def _profile_facts(profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return {name: (profile or {}).get(name) for name in PROFILE_FACTS}
+
+def _day(value: str, offset: int) -> str:
+    return (datetime.strptime(value, "%Y-%m-%d") + timedelta(days=offset)).strftime("%Y-%m-%d")
+
+def _record_day(record: Dict[str, Any]) -> str:
+    return record.get("date") or record["created_at"].strftime("%Y-%m-%d")
+
+def _newer(record: Dict[str, Any], latest: Optional[Dict[str, Any]]) -> bool:
+    if latest is None:
+        return True
+    created = record.get("created_at")
+    if created is not None and created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    latest_created = latest.get("created_at")
+    if latest_created is not None and latest_created.tzinfo is None:
+        latest_created = latest_created.replace(tzinfo=timezone.utc)
+    return (_record_day(record), created or datetime.min.replace(tzinfo=timezone.utc)) >= (
+        latest["date"], latest_created or datetime.min.replace(tzinfo=timezone.utc)
+    )
+
+# ─── Folding records in ───────────────────────────────────────
+
+def _fold(state: Dict[str, Any], records: Sequence[Dict[str, Any]]):
+    """Add `records` to the per-day sums and newest-record fields of `state`, in place."""
+    days = state.setdefault("days", {})
+    for record in records:
+        day = _record_day(record)
+        newest = max(days) if days else None
+        if newest is not None and day < _day(newest, -2 * settings.CLINICAL_CONTEXT_WINDOW_DAYS + 1):
+            continue # Backfill older than anything the windows show
+        bucket = days.setdefault(day, {"n": 0, "sums": {}, "counts": {}})
+        bucket["n"] += 1
+        for name in METRICS:
+            value = record.get(name)
+            if value is None:
+                continue
+            bucket["sums"][name] = bucket["sums"].get(name, 0.0) + float(value)
+            bucket["counts"][name] = bucket["counts"].get(name, 0) + 1
+
+        if _newer(record, state.get("latest")):
+            latest = {name: record.get(name) for name in LATEST_FIELDS}
+            latest["date"] = day
+            latest["created_at"] = record.get("created_at")
+            latest["metrics"] = {name: record.get(name) for name in METRICS if record.get(name) is not None}
+            state["latest"] = latest
+
+    # Keep only the two windows, counted back from the newest day
+    if days:
+        cutoff = _day(max(days), -2 * settings.CLINICAL_CONTEXT_WINDOW_DAYS + 1)
+        for day in [d for d in days if d < cutoff]:
+            del days[day]
+
+def _window_averages(days: Dict[str, Any], first: str, last: str) -> Dict[str, Any]:
+    sums, counts, records = {}, {}, 0
+    for day, bucket in days.items():
+        if first <= day <= last:
+            records += bucket["n"]
+            for name, total in bucket["sums"].items():
+                sums[name] = sums.get(name, 0.0) + total
+                counts[name] = counts.get(name, 0) + bucket["counts"][name]
+    return {"records": records, "averages": {name: sums[name] / counts[name] for name in sums}}
+
+def _derive(state: Dict[str, Any], profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Averages, trends, risk, alerts and prompt text from the stored sums and newest record."""
+    from app.services.ai_engine import ai_engine
+
+    days = state.get("days") or {}
+    latest = state.get("latest")
+    derived = {"profile": _profile_facts(profile), "averages": {}, "trends": {}, "recent_records": 0,
+               "overall_risk": None, "alerts": [], "as_of": None}
+    if not days or latest is None:
+        derived["prompt"] = _render(derived, latest)
+        return derived
+
+    window = settings.CLINICAL_CONTEXT_WINDOW_DAYS
+    newest = max(days)
+    recent = _window_averages(days, _day(newest, -window + 1), newest)
+    previous = _window_averages(days, _day(newest, -2 * window + 1), _day(newest, -window))
+
+    trends = {}
+    for name, value in recent["averages"].items():
+        before = previous["averages"].get(name)
+        if before is None:
+            continue
+        change = (value - before) / abs(before) if abs(before) > 1e-9 else None
+        if change is None or abs(change) < settings.CLINICAL_CONTEXT_TREND_THRESHOLD:
+            direction = "stable"
+        else:
+            direction = "up" if change > 0 else "down"
+        trends[name] = {"previous": before, "change_pct": round(change * 100, 1) if change is not None else None,
+                        "direction": direction}
+
+    # Same composite as the report's overall risk (services/analysis_engine.py)
+    averages = recent["averages"]
+    derived.update(
+        averages=averages,
+        trends=trends,
+        recent_records=recent["records"],
+        overall_risk=ai_engine.evaluate({**averages, "profile": profile or {}})["overall_risk"],
+        alerts=ai_engine.evaluate({**latest["metrics"], "profile": profile or {}})["alerts"],
+        as_of=newest
+    )
+    derived["prompt"] = _render(derived, latest)
+    return derived
+
+def _fmt(name: str, value: float) -> str:
+    _, unit, decimals = METRIC_LABELS[name]
+    return f"{value:.{decimals}f}{unit}"
+
+def _render(derived: Dict[str, Any], latest: Optional[Dict[str, Any]]) -> str:
+    facts = derived["profile"]
+    lines = ["Patient clinical context (from the patient's own records; use it to ground answers, "
+             "refer to it when relevant, and do not invent values that are not listed):"]
+
+    profile_bits = []
+    if facts.get("age"):
+        profile_bits.append(f"{facts['age']} years")
+    if facts.get("gender") and facts["gender"] != "Unknown":
+        profile_bits.append(str(facts["gender"]))
+    if facts.get("amputation_level"):
+        profile_bits.append(f"{facts['amputation_level']} amputation")
+    if facts.get("device_type"):
+        profile_bits.append(f"device: {facts['device_type']}")
+    if facts.get("bmi"):
+        profile_bits.append(f"BMI {facts['bmi']}")
+    if facts.get("blood_pressure_systolic"):
+        profile_bits.append(f"BP {facts['blood_pressure_systolic']}/{facts.get('blood_pressure_diastolic') or '?'}")
+    if facts.get("blood_sugar_mg_dl"):
+        profile_bits.append(f"blood sugar {facts['blood_sugar_mg_dl']} mg/dL")
+    if facts.get("medical_conditions"):
+        profile_bits.append("conditions: " + ", ".join(facts["medical_conditions"]))
+    lines.append("Profile: " + ("; ".join(profile_bits) if profile_bits else "not filled in"))
+
+    if not derived["averages"]:
+        lines.append("No daily metrics recorded yet.")
+        return "\n".join(lines)
+
+    window = settings.CLINICAL_CONTEXT_WINDOW_DAYS
+    lines.append(f"{window}-day averages up to {derived['as_of']} ({derived['recent_records']} records), "
+                 f"with the change from the {window} days before:")
+    for name in METRIC_LABELS:
+        if name not in derived["averages"]:
+            continue
+        trend = derived["trends"].get(name)
+        change = ""
+        if trend is not None:
+            change = " (stable)" if trend["direction"] == "stable" else f" ({trend['direction']} {abs(trend['change_pct'])}%)"
+        lines.append(f"- {METRIC_LABELS[name][0]}: {_fmt(name, derived['averages'][name])}{change}")
+
+    latest_bits = [f"gait {latest.get('gait_abnormality')}", f"skin risk {latest.get('skin_risk')}"]
+    if latest.get("prosthetic_health_score") is not None:
+        latest_bits.append(f"health score {latest['prosthetic_health_score']:.1f}/100")
+    lines.append(f"Latest record ({latest['date']}): " + ", ".join(latest_bits))
+    lines.append(f"Overall clinical risk: {derived['overall_risk']}")
+    lines.append("Active alerts: " + (" ".join(derived["alerts"]) if derived["alerts"] else "none"))
+    return "\n".join(lines)
+
+# ─── Storage ──────────────────────────────────────────────────
+
+async def update_context(db, patient_id: ObjectId, records: Sequence[Dict[str, Any]],
+                         profile: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Fold newly stored `records` into the patient's context with a
+    compare-and-set on `version`, retrying on a concurrent update. A patient
+    without a context document gets one built from `daily_metrics`, which
+    already holds `records`.
+    """
+    if not records:
+        return None
+    from app.services.ai_engine import SCORING_VERSION
+
+    patient_id = ObjectId(patient_id)
+    if profile is None:
+        profile = await db["patient_profiles"].find_one({"_id": patient_id})
+
+    for _ in range(MAX_UPDATE_ATTEMPTS):
+        context = await db["patient_clinical_context"].find_one({"patient_id": patient_id})
+        if context is None or context.get("scoring_version") != SCORING_VERSION:
+            return await rebuild_context(db, patient_id, profile)
+
+        state = {"days": context["days"], "latest": context.get("latest")}
+        _fold(state, records)
+        update = {**state, **_derive(state, profile), "version": context["version"] + 1,
+                  "updated_at": datetime.now(timezone.utc)}
+        result = await db["patient_clinical_context"].update_one(
+            {"_id": context["_id"], "version": context["version"]}, {"$set": update}
+        )
+        if result.modified_count:
+            return update
+
+    logger.warning(f"Clinical context update for patient {patient_id} gave up after {MAX_UPDATE_ATTEMPTS} conflicting attempts")
+    return None
+
+async def rebuild_context(db, patient_id: ObjectId, profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Recompute the patient's context from the last two windows of `daily_metrics`."""
+    from app.services.ai_engine import SCORING_VERSION
+
+    patient_id = ObjectId(patient_id)
+    if profile is None:
+        profile = await db["patient_profiles"].find_one({"_id": patient_id})
+
+    newest = await db["daily_metrics"].find_one({"patient_id": patient_id}, {"date": 1}, sort=[("date", -1)])
+    records = []
+    if newest is not None:
+        cutoff = _day(newest["date"], -2 * settings.CLINICAL_CONTEXT_WINDOW_DAYS + 1)
+        projection = {name: 1 for name in (*METRICS, *LATEST_FIELDS, "created_at")}
+        records = await db["daily_metrics"].find(
+            {"patient_id": patient_id, "date": {"$gte": cutoff}}, projection
+        ).to_list(None)
+
+    state: Dict[str, Any] = {"days": {}, "latest": None}
+    _fold(state, records)
+    context = {**state, **_derive(state, profile), "scoring_version": SCORING_VERSION,
+               "updated_at": datetime.now(timezone.utc)}
+
+    existing = await db["patient_clinical_context"].find_one({"patient_id": patient_id}, {"version": 1})
+    context["version"] = (existing["version"] + 1) if existing else 1
+    try:
+        await db["patient_clinical_context"].update_one(
+            {"patient_id": patient_id}, {"$set": context}, upsert=True
+        )
+    except DuplicateKeyError:
+        pass # Built concurrently; either copy is current
+    return context
+
+async def get_context(db, profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The patient's context, for a chat request: one indexed read. The document
+    is built when it is missing or outdated, and re-derived without touching
+    `daily_metrics` when the profile has changed since it was written.
+    """
+    from app.services.ai_engine import SCORING_VERSION
+
+    context = await db["patient_clinical_context"].find_one({"patient_id": profile["_id"]})
+    if context is None or context.get("scoring_version") != SCORING_VERSION:
+        return await rebuild_context(db, profile["_id"], profile)
+    if context.get("profile") != _profile_facts(profile):
+        derived = _derive(context, profile)
+        await db["patient_clinical_context"].update_one(
+            {"_id": context["_id"], "version": context["version"]},
+            {"$set": {**derived, "version": context["version"] + 1}}
+        )
+        context.update(derived)
+    return context
@@ -0,0 +1,411 @@
+"""
+Clinical rule table and its compiled evaluator.
+
+Every threshold-based judgement in the app is declared once, in the tables
+below: the AIEngine labels and health score, the overall clinical risk, the
+dashboard alerts, the /analysis recommendations and the PDF interpretation
+column. `THRESHOLDS` holds the numbers; `COHORT_OVERRIDES` (plus
+settings.CLINICAL_COHORT_OVERRIDES) replaces some of them for a cohort
+(the profile's amputation level, see anomaly_models.cohort_of).
+
+For each cohort the tables are compiled once into a single Python function
+with the thresholds inlined as constants, so one call evaluates everything for
+a record. evaluate_columns is the NumPy counterpart for many records; both
+produce identical labels and scores.
+
+Each condition names the field it reads and the value used when the field is
+missing, mirroring `dict.get(field, default)` in the original per-rule code.
+Changing a threshold changes stored labels: bump ai_engine.SCORING_VERSION.
+"""
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+import threading
+
+from app.config import settings
+
+METRIC_FIELDS = (
+    "step_length_cm", "cadence_spm", "walking_speed_mps", "gait_symmetry_index",
+    "skin_temperature_c", "skin_moisture", "pressure_distribution_index", "daily_wear_hours"
+)
+PROFILE_FIELDS = ("bmi", "blood_pressure_systolic", "blood_sugar_mg_dl")
+
+THRESHOLDS = {
+    "gait_symmetry_min": 0.75,
+    "gait_symmetry_excellent": 0.9,
+    "walking_speed_min": 0.7,
+    "walking_speed_alignment_check": 0.6,
+    "step_length_min_cm": 30,
+    "cadence_min_spm": 70,
+    "pressure_balance_min": 0.6,
+    "pressure_balanced": 0.8,
+    "skin_temperature_max_c": 34,
+    "skin_moisture_max": 70,
+    "daily_wear_max_hours": 12,
+    "bmi_max": 30,
+    "blood_pressure_systolic_max": 140,
+    "blood_sugar_max_mg_dl": 180,
+    "health_score_consult": 60,
+}
+
+# cohort -> {threshold: value}; merged with settings.CLINICAL_COHORT_OVERRIDES
+COHORT_OVERRIDES: Dict[str, Dict[str, float]] = {}
+
+# name -> (field, operator, threshold, value when the field is missing).
+# "profile." fields are read from the record's patient profile.
+CONDITIONS = {
+    "symmetry_low": ("gait_symmetry_index", "<", "gait_symmetry_min", 1.0),
+    "speed_low": ("walking_speed_mps", "<", "walking_speed_min", 1.0),
+    "step_short": ("step_length_cm", "<", "step_length_min_cm", 50),
+    "cadence_low": ("cadence_spm", "<", "cadence_min_spm", 100),
+    "pressure_imbalance": ("pressure_distribution_index", "<", "pressure_balance_min", 1.0),
+    "skin_hot": ("skin_temperature_c", ">", "skin_temperature_max_c", 30),
+    "skin_moist": ("skin_moisture", ">", "skin_moisture_max", 50),
+    "long_wear": ("daily_wear_hours", ">", "daily_wear_max_hours", 8),
+    "obese": ("profile.bmi", ">", "bmi_max", 22),
+    "hypertensive": ("profile.blood_pressure_systolic", ">", "blood_pressure_systolic_max", 120),
+    "hyperglycemic": ("profile.blood_sugar_mg_dl", ">", "blood_sugar_max_mg_dl", 90),
+    "speed_alignment_check": ("walking_speed_mps", "<", "walking_speed_alignment_check", 1.0),
+    "symmetry_not_excellent": ("gait_symmetry_index", "<", "gait_symmetry_excellent", 1.0),
+    "pressure_unbalanced": ("pressure_distribution_index", "<", "pressure_balanced", 1.0),
+}
+
+# Gait is "Abnormal" when any of these holds
+GAIT_CONDITIONS = ("symmetry_low", "speed_low", "step_short", "cadence_low", "pressure_imbalance")
+
+# Skin risk: one point per condition; 2 points = "Medium", 3 = "High"
+SKIN_CONDITIONS = ("skin_hot", "skin_moist", "long_wear")
+
+# Health score: 100 minus these terms, in this order, then clipped to 0-100 and rounded.
+# (field, value when missing, kind, pivot, weight); pivot is a number or a threshold name.
+#   linear: (pivot - x) * weight    below: max(0, pivot - x) * weight    above: max(0, x - pivot) * weight
+SCORE_TERMS = (
+    ("gait_symmetry_index", 1.0, "linear", 1, 40),
+    ("pressure_distribution_index", 1.0, "below", "pressure_balanced", 30),
+    ("walking_speed_mps", 0.7, "below", "walking_speed_min", 25),
+    ("skin_moisture", 70, "above", "skin_moisture_max", 0.5),
+)
+SCORE_PENALTIES = (("obese", 10), ("hypertensive", 10), ("hyperglycemic", 15))
+
+# Overall clinical risk: points per condition (any of the names), then levels by total
+RISK_POINTS = (
+    (("gait_abnormal",), 2),
+    (("skin_high",), 2),
+    (("skin_medium",), 1),
+    (("pressure_imbalance",), 2),
+    (("obese",), 1),
+    (("hypertensive", "hyperglycemic"), 1),
+)
+RISK_LEVELS = ((4, "High"), (2, "Moderate"))
+
+# Derived conditions usable below: gait_abnormal, skin_high, skin_medium, health_low
+ALERTS = (
+    ("gait_abnormal", "Significant gait abnormality detected."),
+    ("skin_high", "High risk of skin irritation. Check socket fit."),
+    ("pressure_imbalance", "Load Imbalance Detected."),
+)
+RECOMMENDATIONS = (
+    ("gait_abnormal", "Significant gait asymmetry detected. Clinical gait analysis recommended."),
+    ("skin_high", "Critical skin irritation risk. Inspect residual limb and socket immediately."),
+    ("speed_alignment_check", "Low walking speed detected. Consider prosthetic alignment check."),
+    ("pressure_imbalance", "Load imbalance detected. Check socket padding and alignment."),
+    ("obese", "High BMI detected. Weight management may improve prosthetic comfort."),
+    ("hypertensive", "Hypertension detected. Consult clinical team regarding cardiovascular stress."),
+    ("health_low", "Overall prosthetic health score is moderate. Consultation with a prosthetist advised."),
+)
+
+# Report interpretation column: field -> (condition, label when it holds, label otherwise)
+INTERPRETATIONS = {
+    "step_length_cm": ("step_short", "Low", "Normal"),
+    "cadence_spm": ("cadence_low", "Low", "Normal"),
+    "walking_speed_mps": ("speed_low", "Reduced", "Optimal"),
+    "gait_symmetry_index": ("symmetry_not_excellent", "Monitor", "Excellent"),
+    "skin_temperature_c": ("skin_hot", "Alert", "Stable"),
+    "pressure_distribution_index": ("pressure_unbalanced", "Imbalanced", "Balanced"),
+    "skin_moisture": ("skin_moist", "High Risk", "Low Risk"),
+}
+PROFILE_FLAGS = {
+    "bmi": ("obese", "Obesity Risk"),
+    "blood_pressure_systolic": ("hypertensive", "Hypertension Alert"),
+    "blood_sugar_mg_dl": ("hyperglycemic", "Hyperglycemia Risk"),
+}
+
+# ─── Compilation ──────────────────────────────────────────────
+
+def thresholds_for(cohort: Optional[str]) -> Dict[str, float]:
+    merged = dict(THRESHOLDS)
+    for source in (COHORT_OVERRIDES, settings.CLINICAL_COHORT_OVERRIDES):
+        overrides = source.get(cohort, {}) if cohort else {}
+        unknown = set(overrides) - set(THRESHOLDS)
+        if unknown:
+            raise ValueError(f"Unknown threshold(s) in overrides for cohort {cohort}: {', '.join(sorted(unknown))}")
+        merged.update(overrides)
+    return merged
+
+def _pivot(pivot, t: Dict[str, float]):
+    return t[pivot] if isinstance(pivot, str) else pivot
+
+def _read(field: str, default) -> str:
+    if field.startswith("profile."):
+        return f"p.get({field[len('profile.'):]!r}, {default!r})"
+    return f"m.get({field!r}, {default!r})"
+
+def _any(names: Sequence[str]) -> str:
+    return " or ".join(names)
+
+def _scalar_source(t: Dict[str, float]) -> str:
+    lines = [
+        "def evaluate(m):",
+        "    p = m.get('profile') or {}",
+    ]
+    for name, (field, op, threshold, default) in CONDITIONS.items():
+        lines.append(f"    {name} = {_read(field, default)} {op} {t[threshold]!r}")
+
+    lines.append(f"    gait_abnormal = {_any(GAIT_CONDITIONS)}")
+    lines.append(f"    skin_points = {' + '.join(SKIN_CONDITIONS)}")
+    lines.append("    skin_high = skin_points >= 3")
+    lines.append("    skin_medium = skin_points == 2")
+
+    lines.append("    score = 100")
+    for field, default, kind, pivot, weight in SCORE_TERMS:
+        x, pv = _read(field, default), _pivot(pivot, t)
+        term = {
+            "linear": f"({pv!r} - {x})",
+            "below": f"max(0, {pv!r} - {x})",
+            "above": f"max(0, {x} - {pv!r})",
+        }[kind]
+        lines.append(f"    score -= {term} * {weight!r}")
+    for condition, penalty in SCORE_PENALTIES:
+        lines.append(f"    if {condition}: score -= {penalty!r}")
+    lines.append("    health = round(min(max(float(score), 0.0), 100.0), 2)")
+    lines.append(f"    health_low = health < {t['health_score_consult']!r}")
+
+    lines.append("    risk_points = 0")
+    for names, points in RISK_POINTS:
+        lines.append(f"    if {_any(names)}: risk_points += {points}")
+    risk = "'Low'"
+    for minimum, label in reversed(RISK_LEVELS):
+        risk = f"{label!r} if risk_points >= {minimum} else ({risk})"
+
+    alerts = ", ".join(f"({name}, {message!r})" for name, message in ALERTS)
+    recommendations = ", ".join(f"({name}, {message!r})" for name, message in RECOMMENDATIONS)
+    interpretations = ", ".join(
+        f"{field!r}: {hit!r} if {name} else {miss!r}" for field, (name, hit, miss) in INTERPRETATIONS.items()
+    )
+    flags = ", ".join(f"{field!r}: {label!r} if {name} else None" for field, (name, label) in PROFILE_FLAGS.items())
+    lines += [
+        "    return {",
+        "        'gait_abnormality': 'Abnormal' if gait_abnormal else 'Normal',",
+        "        'skin_risk': 'High' if skin_high else ('Medium' if skin_medium else 'Low'),",
+        "        'prosthetic_health_score': health,",
+        f"        'overall_risk': {risk},",
+        f"        'alerts': [text for hit, text in ({alerts},) if hit],",
+        f"        'recommendations': [text for hit, text in ({recommendations},) if hit],",
+        f"        'interpretations': {{{interpretations}}},",
+        f"        'profile_flags': {{{flags}}},",
+        "    }",
+    ]
+    return "\n".join(lines)
+
+class RuleSet:
+    """The rule tables compiled for one cohort."""
+    def __init__(self, cohort: Optional[str]):
+        self.cohort = cohort
+        self.thresholds = thresholds_for(cohort)
+        self.source = _scalar_source(self.thresholds)
+        namespace: Dict[str, Any] = {}
+        exec(compile(self.source, f"<clinical rules: {cohort or 'default'}>", "exec"), namespace)
+        self.evaluate: Callable[[Mapping[str, Any]], Dict[str, Any]] = namespace["evaluate"]
+
+_rule_sets: Dict[Optional[str], RuleSet] = {}
+_compile_lock = threading.Lock()
+
+def rule_set(cohort: Optional[str] = None) -> RuleSet:
+    compiled = _rule_sets.get(cohort)
+    if compiled is None:
+        with _compile_lock:
+            compiled = _rule_sets.get(cohort)
+            if compiled is None:
+                compiled = _rule_sets[cohort] = RuleSet(cohort)
+    return compiled
+
+def cohort(profile: Optional[Mapping[str, Any]]) -> Optional[str]:
+    if not (COHORT_OVERRIDES or settings.CLINICAL_COHORT_OVERRIDES):
+        return None
+    from app.services.anomaly_models import cohort_of
+    cohort = cohort_of(profile)
+    # Cohorts without overrides share the default compiled rules
+    if cohort in COHORT_OVERRIDES or cohort in settings.CLINICAL_COHORT_OVERRIDES:
+        return cohort
+    return None
+
+def evaluate(record: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Every label, score, alert, recommendation and interpretation for one record
+    (metric fields plus an optional "profile" dict), in one pass.
+    """
+    return rule_set(cohort(record.get("profile"))).evaluate(record)
+
+# ─── Vectorized evaluation ────────────────────────────────────
+
+class Columns:
+    """
+    Float64 columns with per-row presence, so every rule can apply its own
+    default for a missing value the way `dict.get(key, default)` does.
+    """
+    def __init__(self, size: int, values: Dict[str, Any], present: Dict[str, Any]):
+        self.size = size
+        self._values = values
+        self._present = present
+
+    @classmethod
+    def from_arrays(cls, metrics: Mapping[str, Any], profile: Mapping[str, Any], size: Optional[int]) -> "Columns":
+        import numpy as np
+
+        # Profile columns may also come in with the metrics, under their own names
+        values = {
+            ("profile." + key if key in PROFILE_FIELDS else key): np.asarray(col, dtype=np.float64)
+            for key, col in metrics.items()
+        }
+        if size is None:
+            sizes = {len(col) for col in values.values()}
+            if len(sizes) > 1:
+                raise ValueError("Metric columns must all have the same length")
+            size = sizes.pop() if sizes else 0
+        for key in PROFILE_FIELDS:
+            if profile.get(key) is not None:
+                values["profile." + key] = np.broadcast_to(np.asarray(profile[key], dtype=np.float64), (size,))
+        return cls(size, values, {})
+
+    @classmethod
+    def from_records(cls, records: Sequence[Mapping[str, Any]], profiles: Sequence[Mapping[str, Any]]) -> "Columns":
+        import numpy as np
+
+        values, present = {}, {}
+        for keys, rows, prefix in ((METRIC_FIELDS, records, ""), (PROFILE_FIELDS, profiles, "profile.")):
+            for key in keys:
+                raw = [row.get(key) for row in rows]
+                mask = np.fromiter((v is not None for v in raw), dtype=bool, count=len(raw))
+                if not mask.any():
+                    continue
+                values[prefix + key] = np.array([v if v is not None else np.nan for v in raw], dtype=np.float64)
+                if not mask.all():
+                    present[prefix + key] = mask
+        return cls(len(records), values, present)
+
+    def get(self, key: str, default: float):
+        import numpy as np
+
+        if key not in self._values:
+            return np.full(self.size, float(default))
+        if key in self._present:
+            return np.where(self._present[key], self._values[key], default)
+        return self._values[key]
+
+    def take(self, rows) -> "Columns":
+        return Columns(
+            len(rows),
+            {key: values[rows] for key, values in self._values.items()},
+            {key: mask[rows] for key, mask in self._present.items()}
+        )
+
+def _round2(score):
+    """
+    round(x, 2) element-wise. np.round scales by 100 and can differ from Python's
+    correctly-rounded round() when x*100 sits on a .5 boundary, so those few rows
+    are redone with the builtin.
+    """
+    import numpy as np
+
+    rounded = np.round(score, 2)
+    scaled = score * 100
+    tie = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    if len(tie):
+        rounded[tie] = [round(v, 2) for v in score[tie].tolist()]
+    return rounded
+
+def _evaluate_block(cols: Columns, t: Dict[str, float]) -> Dict[str, Any]:
+    import numpy as np
+
+    compare = {"<": np.less, ">": np.greater, "<=": np.less_equal, ">=": np.greater_equal}
+    c = {
+        name: compare[op](cols.get(field, default), t[threshold])
+        for name, (field, op, threshold, default) in CONDITIONS.items()
+    }
+    c["gait_abnormal"] = np.logical_or.reduce([c[name] for name in GAIT_CONDITIONS])
+    skin_points = sum(c[name].astype(np.int8) for name in SKIN_CONDITIONS)
+    c["skin_high"] = skin_points >= 3
+    c["skin_medium"] = skin_points == 2
+
+    # Same operation order as the compiled scalar function, so floats match exactly
+    score = np.full(cols.size, 100.0)
+    for field, default, kind, pivot, weight in SCORE_TERMS:
+        x, pv = cols.get(field, default), _pivot(pivot, t)
+        if kind == "linear":
+            score -= (pv - x) * weight
+        elif kind == "below":
+            score -= np.fmax(0, pv - x) * weight # fmax: max(0, nan) is 0, as in Python
+        else:
+            score -= np.fmax(0, x - pv) * weight
+    for condition, penalty in SCORE_PENALTIES:
+        score -= np.where(c[condition], float(penalty), 0.0) # subtracting 0.0 leaves other rows untouched
+    health = _round2(np.clip(score, 0.0, 100.0))
+    c["health_low"] = health < t["health_score_consult"]
+
+    risk_points = np.zeros(cols.size, dtype=np.int16)
+    for names, points in RISK_POINTS:
+        risk_points += np.where(np.logical_or.reduce([c[name] for name in names]), points, 0).astype(np.int16)
+    risk = np.select([risk_points >= minimum for minimum, _ in RISK_LEVELS], [label for _, label in RISK_LEVELS], "Low")
+
+    return {
+        "gait_abnormality": np.where(c["gait_abnormal"], "Abnormal", "Normal"),
+        "skin_risk": np.select([c["skin_high"], c["skin_medium"]], ["High", "Medium"], "Low"),
+        "prosthetic_health_score": health,
+        "overall_risk": risk,
+        "alerts": np.column_stack([c[name] for name, _ in ALERTS]),
+        "recommendations": np.column_stack([c[name] for name, _ in RECOMMENDATIONS]),
+        "interpretations": {
+            field: np.where(c[name], hit, miss) for field, (name, hit, miss) in INTERPRETATIONS.items()
+        },
+        "profile_flags": {field: c[name] for field, (name, _) in PROFILE_FLAGS.items()},
+    }
+
+def evaluate_columns(cols: Columns, cohorts: Optional[Sequence[Optional[str]]] = None) -> Dict[str, Any]:
+    """
+    Vectorized `evaluate`. Labels, scores and interpretations come back as arrays;
+    alerts and recommendations as (rows x rules) boolean matrices whose columns
+    follow ALERTS / RECOMMENDATIONS (see messages()). `cohorts` gives each row's
+    cohort; rows are evaluated per cohort with that cohort's thresholds.
+    """
+    import numpy as np
+
+    groups = {}
+    for i, cohort in enumerate(cohorts or ()):
+        groups.setdefault(cohort, []).append(i)
+    if len(groups) <= 1:
+        return _evaluate_block(cols, rule_set(next(iter(groups), None)).thresholds)
+
+    order = np.concatenate([np.array(rows) for rows in groups.values()])
+    parts = [_evaluate_block(cols.take(np.array(rows)), rule_set(cohort).thresholds) for cohort, rows in groups.items()]
+
+    def merge(get):
+        joined = np.concatenate([get(part) for part in parts])
+        out = np.empty_like(joined)
+        out[order] = joined
+        return out
+
+    merged: Dict[str, Any] = {
+        key: merge(lambda part, key=key: part[key])
+        for key in ("gait_abnormality", "skin_risk", "prosthetic_health_score", "overall_risk", "alerts", "recommendations")
+    }
+    merged["interpretations"] = {f: merge(lambda part, f=f: part["interpretations"][f]) for f in INTERPRETATIONS}
+    merged["profile_flags"] = {f: merge(lambda part, f=f: part["profile_flags"][f]) for f in PROFILE_FLAGS}
+    return merged
+
+def evaluate_records(records: Sequence[Mapping[str, Any]], profile: Optional[Mapping[str, Any]] = None) -> Dict[str, Any]:
+    """evaluate_columns for metric dicts; a record's own "profile" takes precedence over `profile`."""
+    profiles = [r.get("profile", profile) or {} for r in records]
+    return evaluate_columns(Columns.from_records(records, profiles), [cohort(p) for p in profiles])
+
+def messages(flags, table: Sequence[Tuple[str, str]]) -> List[List[str]]:
+    """Turn an alerts / recommendations matrix from evaluate_columns into per-row message lists."""
+    texts = [text for _, text in table]
+    return [[texts[j] for j in row.nonzero()[0]] for row in flags]
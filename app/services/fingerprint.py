@@ -0,0 +1,30 @@
+"""
+Content fingerprints used to recognise client retries.
+
+Uploads and daily inputs carry a `content_hash`; a unique (patient_id, content_hash)
+index on each collection turns a resubmission into a DuplicateKeyError, and the
+routes answer it with the original record instead of storing it again.
+"""
+from typing import Any, Dict
+import hashlib
+import json
+
+from app.config import settings
+
+async def hash_upload(file) -> str:
+    """SHA-256 of an UploadFile's bytes, read in pieces; rewinds the file afterwards."""
+    digest = hashlib.sha256()
+    while True:
+        data = await file.read(settings.SENSOR_UPLOAD_READ_BYTES)
+        if not data:
+            break
+        digest.update(data)
+    await file.seek(0)
+    return digest.hexdigest()
+
+def hash_daily_input(date: str, metrics: Dict[str, Any]) -> str:
+    """SHA-256 over the day and the submitted metrics in canonical (sorted, compact) JSON form."""
+    digest = hashlib.sha256(date.encode())
+    for key in sorted(metrics):
+        digest.update(json.dumps([key, metrics[key]], separators=(",", ":")).encode())
+    return digest.hexdigest()
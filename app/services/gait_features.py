@@ -0,0 +1,221 @@
+"""
+Gait feature extraction from raw sensor recordings.
+
+Turns a stored recording (see services/sensor_store.py) into the same metrics a
+patient would otherwise type into /patient/daily-input. Everything is computed
+with whole-array NumPy operations; there is no per-sample Python loop.
+
+Recognised channels:
+    left_pressure, right_pressure   plantar/socket load per side (required)
+    speed_mps                       device-reported walking speed (optional)
+    skin_temperature_c              socket liner temperature (optional)
+    skin_moisture                   liner relative humidity, % (optional)
+
+Without `speed_mps`, step length is estimated as 0.415 x body height (the usual
+anthropometric ratio) and walking speed follows from cadence. Without a skin
+channel the matching metric is left out rather than stored as a made-up 0.
+A recording's length says nothing about how long the prosthesis was worn that
+day, so daily_wear_hours gets DailyInput's default.
+"""
+from typing import Dict, List, Optional
+from datetime import datetime, timezone
+import asyncio
+import logging
+
+import numpy as np
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+SIDES = ("left_pressure", "right_pressure")
+SMOOTHING_S = 0.05 # Moving-average window applied before contact detection
+MIN_STEP_S = 0.25 # Heel strikes closer than this on the same side are chatter
+MAX_STEP_S = 2.0 # Longer gaps are pauses, not steps
+MIN_STEPS = 10
+STEP_LENGTH_HEIGHT_RATIO = 0.415
+DEFAULT_STEP_LENGTH_CM = 65.0
+DEFAULT_WEAR_HOURS = 8.0 # DailyInput's default, below every wear-time rule
+
+class InsufficientGaitData(ValueError):
+    pass
+
+def _moving_average(x: np.ndarray, window: int) -> np.ndarray:
+    if window <= 1:
+        return x
+    c = np.cumsum(np.insert(np.nan_to_num(x, nan=0.0).astype(np.float64), 0, 0.0))
+    out = (c[window:] - c[:-window]) / window
+    return np.concatenate([np.full(window - 1, out[0]), out])
+
+def detect_heel_strikes(t: np.ndarray, load: np.ndarray, fs: float) -> np.ndarray:
+    """Indices where the smoothed load rises through a contact threshold set from its own range."""
+    smooth = _moving_average(load, max(1, int(round(SMOOTHING_S * fs))))
+    low, high = np.percentile(smooth, [20, 95])
+    if high - low <= 1e-6:
+        return np.empty(0, dtype=np.int64)
+    contact = smooth > low + 0.5 * (high - low)
+    strikes = np.flatnonzero(contact[1:] & ~contact[:-1]) + 1
+    if len(strikes) > 1:
+        keep = np.r_[True, np.diff(t[strikes]) >= MIN_STEP_S]
+        strikes = strikes[keep]
+    return strikes
+
+def extract_gait_features(t: np.ndarray, values: np.ndarray, channels: List[str],
+                          height_cm: Optional[float] = None) -> Dict[str, float]:
+    """
+    Compute DailyInput-compatible metrics for one recording; skin metrics are
+    missing when the recording has no usable skin channel.
+    `t` is float64 seconds, `values` an (n x channels) array as returned by read_sensor_range.
+    Raises InsufficientGaitData when the recording cannot be analysed.
+    """
+    index = {ch: i for i, ch in enumerate(channels)}
+    missing = [ch for ch in SIDES if ch not in index]
+    if missing:
+        raise InsufficientGaitData(f"Recording has no {', '.join(missing)} channel")
+    if len(t) < 2:
+        raise InsufficientGaitData("Recording is too short")
+
+    # Repeated timestamps (several samples in one clock tick) are not a sample interval
+    intervals = np.diff(t)
+    intervals = intervals[intervals > 0]
+    if len(intervals) == 0:
+        raise InsufficientGaitData("Recording timestamps do not advance")
+    fs = 1.0 / float(np.median(intervals))
+    left = values[:, index["left_pressure"]]
+    right = values[:, index["right_pressure"]]
+
+    # 1. Step detection: heel strikes per side, merged into one time-ordered sequence
+    strikes_l = detect_heel_strikes(t, left, fs)
+    strikes_r = detect_heel_strikes(t, right, fs)
+    strike_t = np.concatenate([t[strikes_l], t[strikes_r]])
+    strike_side = np.concatenate([np.zeros(len(strikes_l), np.int8), np.ones(len(strikes_r), np.int8)])
+    order = np.argsort(strike_t, kind="stable")
+    strike_t, strike_side = strike_t[order], strike_side[order]
+
+    # A step is a strike following a strike of the other foot within MAX_STEP_S
+    step_time = np.diff(strike_t)
+    is_step = (strike_side[1:] != strike_side[:-1]) & (step_time <= MAX_STEP_S)
+    if np.count_nonzero(is_step) < MIN_STEPS:
+        raise InsufficientGaitData("Not enough walking detected in the recording")
+    step_time, step_side = step_time[is_step], strike_side[1:][is_step]
+    step_end = strike_t[1:][is_step]
+
+    # 2. Cadence from the median step time (robust against pauses and turns)
+    cadence_spm = 60.0 / float(np.median(step_time))
+
+    # 3. Step length per side: distance covered during each step
+    if "speed_mps" in index:
+        speed = np.nan_to_num(values[:, index["speed_mps"]].astype(np.float64), nan=0.0)
+        distance = np.concatenate([[0.0], np.cumsum(0.5 * (speed[1:] + speed[:-1]) * np.diff(t))])
+        at_end = np.interp(step_end, t, distance)
+        at_start = np.interp(step_end - step_time, t, distance)
+        step_length_m = at_end - at_start
+    else:
+        nominal_m = (STEP_LENGTH_HEIGHT_RATIO * height_cm if height_cm else DEFAULT_STEP_LENGTH_CM) / 100.0
+        # Constant walking speed assumed: a side's step length scales with its step time
+        step_length_m = nominal_m * step_time / float(np.median(step_time))
+
+    mean_left = float(np.mean(step_length_m[step_side == 0])) if np.any(step_side == 0) else 0.0
+    mean_right = float(np.mean(step_length_m[step_side == 1])) if np.any(step_side == 1) else 0.0
+    longer = max(mean_left, mean_right)
+    symmetry = min(mean_left, mean_right) / longer if longer > 0 else 0.0
+    step_length_cm = float(np.median(step_length_m)) * 100.0
+    walking_speed_mps = step_length_cm / 100.0 * cadence_spm / 60.0
+
+    # 4. Pressure distribution: share of load carried by the less-loaded side (1.0 = balanced)
+    load_l, load_r = float(np.nansum(left)), float(np.nansum(right))
+    heavier = max(load_l, load_r)
+    pressure_index = min(load_l, load_r) / heavier if heavier > 0 else 0.0
+
+    # 5. Skin sensors
+    def channel_mean(name: str) -> Optional[float]:
+        if name not in index:
+            return None
+        column = values[:, index[name]]
+        return round(float(np.nanmean(column)), 2) if np.any(~np.isnan(column)) else None
+
+    metrics = {
+        "step_length_cm": round(step_length_cm, 2),
+        "cadence_spm": round(cadence_spm, 2),
+        "walking_speed_mps": round(walking_speed_mps, 3),
+        "gait_symmetry_index": round(symmetry, 3),
+        "skin_temperature_c": channel_mean("skin_temperature_c"),
+        "skin_moisture": channel_mean("skin_moisture"),
+        "pressure_distribution_index": round(min(max(pressure_index, 0.0), 1.0), 3),
+        "daily_wear_hours": DEFAULT_WEAR_HOURS
+    }
+    return {name: value for name, value in metrics.items() if value is not None}
+
+async def process_sensor_upload(upload_id: ObjectId):
+    """
+    Background task run after /patient/upload-gait: extract metrics from the
+    stored recording, score them like a manual daily input and store the result
+    in `daily_metrics`. The outcome is recorded on the upload as `analysis_status`.
+    """
+    from app.database import get_db
+    from app.models.database_models import DailyRecord
+    from app.services.ai_engine import ai_engine, SCORING_VERSION
+    from app.services.clinical_context import update_context
+    from app.services.patient_baseline import get_baseline, baseline_deviation, update_baseline
+    from app.services.sensor_store import read_sensor_range
+
+    db = get_db()
+    upload = await db["sensor_uploads"].find_one({"_id": upload_id})
+    if not upload:
+        return
+    profile = await db["patient_profiles"].find_one({"_id": upload["patient_id"]}) or {}
+
+    try:
+        frame = await read_sensor_range(db, upload_id=upload_id)
+        # NumPy releases the GIL for the heavy array work; keep it off the event loop
+        metrics = await asyncio.to_thread(
+            extract_gait_features, frame.timestamps, frame.values, frame.channels, profile.get("height_cm")
+        )
+    except InsufficientGaitData as e:
+        await db["sensor_uploads"].update_one(
+            {"_id": upload_id},
+            {"$set": {"analysis_status": "skipped", "analysis_error": str(e)}}
+        )
+        logger.info(f"Skipped gait extraction for upload {upload_id}: {e}")
+        return
+    except Exception as e:
+        await db["sensor_uploads"].update_one(
+            {"_id": upload_id},
+            {"$set": {"analysis_status": "failed", "analysis_error": str(e)}}
+        )
+        logger.error(f"Gait extraction failed for upload {upload_id}: {e}")
+        return
+
+    evaluated = ai_engine.evaluate({**metrics, "profile": profile})
+    gait_abnormality = evaluated["gait_abnormality"]
+    skin_risk = evaluated["skin_risk"]
+    health_score = evaluated["prosthetic_health_score"]
+    anomaly = ai_engine.gait_anomaly_fields([metrics], profile)[0]
+    baseline = await get_baseline(db, upload["patient_id"])
+    deviation = baseline_deviation(baseline, {**metrics, "prosthetic_health_score": health_score})
+
+    recorded = upload.get("start_time") or upload.get("created_at") or datetime.now(timezone.utc)
+    record = DailyRecord(
+        patient_id=upload["patient_id"],
+        date=recorded.strftime("%Y-%m-%d"),
+        **metrics,
+        gait_abnormality=gait_abnormality,
+        skin_risk=skin_risk,
+        prosthetic_health_score=health_score,
+        scoring_version=SCORING_VERSION,
+        **anomaly,
+        baseline_deviation=deviation,
+        source="sensor_upload",
+        upload_id=upload_id
+    ).model_dump(by_alias=True, exclude_none=True)
+    record["patient_id"] = ObjectId(record["patient_id"])
+    record["upload_id"] = ObjectId(record["upload_id"])
+    record["created_at"] = datetime.now(timezone.utc)
+
+    result = await db["daily_metrics"].insert_one(record)
+    await update_baseline(db, upload["patient_id"], [record])
+    await update_context(db, upload["patient_id"], [record], profile or None)
+    await db["sensor_uploads"].update_one(
+        {"_id": upload_id},
+        {"$set": {"analysis_status": "complete", "daily_record_id": result.inserted_id}}
+    )
+    logger.info(f"Extracted gait metrics for upload {upload_id} into daily record {result.inserted_id}")
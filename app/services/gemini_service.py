@@ -1,28 +1,343 @@
-from app.config import settings
+"""
+Shared Gemini client for every AI call in the app (report summaries, chat).
+
+One GeminiClient per worker. Before each attempt a call:
+- takes a token from a token bucket sized to the API quota
+  (GEMINI_REQUESTS_PER_MINUTE, per worker: divide the project quota by the
+  number of workers);
+- takes a slot from a global semaphore (GEMINI_MAX_CONCURRENCY).
+
+Waiting for either counts against the call's deadline. A call that cannot
+start in time fails fast instead of queueing behind a backlog.
+
+Transient failures (429, 500, 503, timeouts) are retried with full-jitter
+exponential backoff. A retry hint from the API (RetryInfo, "retry in Ns") is
+honoured as the minimum wait. Every call has an overall deadline
+(GEMINI_DEADLINE_SECONDS) in place of the callers' own timeouts.
+
+A circuit breaker opens after GEMINI_BREAKER_FAILURES consecutive transient
+failures. While it is open, calls fail immediately with GeminiUnavailable.
+After GEMINI_BREAKER_COOLDOWN_SECONDS one trial call is let through; its
+success closes the breaker.
+
+stream() yields the response as Gemini produces it (chat over SSE). It holds
+its concurrency slot until the stream ends, and closing it early cancels the
+upstream call.
+
+The model itself sits behind an AIBackend (services/ai_backends.py), chosen
+by AI_BACKEND: the Gemini API, or a local stand-in with canned answers for
+load tests and offline work. Everything above applies to either.
+
+metrics() reports counts, latency and stream time-to-first-chunk percentiles
+(GET /admin/ai-metrics).
+"""
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+from collections import deque
+import asyncio
 import logging
+import random
+import re
+import time
+
+from app.config import settings
+from app.services.ai_backends import AIBackend, AIStream, make_backend
 
 logger = logging.getLogger(__name__)
 
-# Defer heavy model initialization
-_model = None
+T = TypeVar("T")
+_RETRY_IN = re.compile(r"retry(?:_delay)?\D{0,20}?(\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+
+class GeminiUnavailable(Exception):
+    """The call was not (or could not be) completed: rate limited, breaker open, timed out or failing."""
+    def __init__(self, reason: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def quota(self) -> bool:
+        return self.reason in ("rate_limited", "quota")
+
+class GeminiEmptyResponse(Exception):
+    pass
+
+class TokenBucket:
+    def __init__(self, rate_per_s: float, burst: int):
+        self.rate = rate_per_s
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, max_wait: float) -> bool:
+        """Take one token, waiting up to `max_wait` seconds; False if that is not enough."""
+        async with self._lock: # FIFO: waiters are served in arrival order
+            self._refill()
+            wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+            if wait > max_wait:
+                return False
+            if wait > 0:
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= 1
+            return True
+
+class CircuitBreaker:
+    def __init__(self, failures: int, cooldown_s: float):
+        self.threshold = failures
+        self.cooldown_s = cooldown_s
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown_s else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.cooldown_s - (time.monotonic() - self.opened_at)) if self.opened_at else 0.0
+
+    def abandon(self):
+        """A trial call that did not reach the API, or failed on its own request, decides nothing."""
+        self._trial = False
+
+    def success(self):
+        if self.opened_at is not None:
+            logger.info("Gemini circuit breaker closed")
+        self.failures, self.opened_at, self._trial = 0, None, False
+
+    def failure(self):
+        self.failures += 1
+        if self._trial or (self.opened_at is None and self.failures >= self.threshold):
+            logger.warning(f"Gemini circuit breaker open after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+        self._trial = False
+
+def _classify(e: BaseException) -> str:
+    """'quota' / 'transient' (retry) or 'fatal' (do not retry)."""
+    from google.api_core import exceptions as api
+
+    if isinstance(e, (api.ResourceExhausted, api.TooManyRequests)):
+        return "quota"
+    if isinstance(e, (asyncio.TimeoutError, api.ServiceUnavailable, api.InternalServerError,
+                      api.DeadlineExceeded, api.BadGateway, api.GatewayTimeout, api.Unknown)):
+        return "transient"
+    if isinstance(e, api.GoogleAPICallError) or isinstance(e, GeminiEmptyResponse):
+        return "fatal"
+    return "transient" if isinstance(e, (ConnectionError, OSError)) else "fatal"
+
+def _retry_hint(e: BaseException) -> Optional[float]:
+    """Server-suggested wait before retrying, from RetryInfo details or the message."""
+    for detail in getattr(e, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and (delay.seconds or delay.nanos):
+            return delay.seconds + delay.nanos / 1e9
+    match = _RETRY_IN.search(str(e))
+    return float(match.group(1)) if match else None
+
+class GeminiClient:
+    def __init__(self, backend: Optional[AIBackend] = None):
+        self.backend = backend or make_backend()
+        self._bucket = TokenBucket(settings.GEMINI_REQUESTS_PER_MINUTE / 60.0, settings.GEMINI_BURST)
+        self._slots = asyncio.Semaphore(settings.GEMINI_MAX_CONCURRENCY)
+        self.breaker = CircuitBreaker(settings.GEMINI_BREAKER_FAILURES, settings.GEMINI_BREAKER_COOLDOWN_SECONDS)
+        self._counts: Dict[str, int] = {}
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self._first_chunk: Deque[float] = deque(maxlen=1000)
+        self._in_flight = 0
+
+    def _count(self, name: str):
+        self._counts[name] = self._counts.get(name, 0) + 1
+
+    async def generate(self, prompt: str, system_instruction: Optional[str] = None,
+                       history: Optional[List[Dict[str, Any]]] = None,
+                       deadline_s: float = settings.GEMINI_DEADLINE_SECONDS,
+                       response_schema: Optional[Dict[str, Any]] = None,
+                       attempt_timeout_s: float = settings.GEMINI_TIMEOUT_SECONDS) -> str:
+        """
+        Response text for `prompt`, optionally continuing a chat `history`
+        ([{"role": "user"|"model", "parts": [...]}]). With `response_schema`
+        (an OpenAPI-style dict) the text is JSON matching it. Long answers, such
+        as batches, need a longer `attempt_timeout_s` and `deadline_s`. Raises
+        GeminiUnavailable.
+        """
+        self._count("calls")
+        deadline = time.monotonic() + deadline_s
+
+        async def attempt() -> str:
+            await self._admit(deadline)
+            start = time.monotonic()
+            try:
+                timeout = max(0.0, min(attempt_timeout_s, deadline - time.monotonic()))
+                text = await asyncio.wait_for(
+                    self.backend.generate(prompt, system_instruction, history, response_schema), timeout
+                )
+                if not text:
+                    raise GeminiEmptyResponse("Empty response from Gemini API - Check API Key/Quota")
+                self._count("successes")
+                return text
+            finally:
+                self._latencies.append(time.monotonic() - start)
+                self._release()
+
+        return await self._with_retries(attempt, deadline)
+
+    async def stream(self, prompt: str, system_instruction: Optional[str] = None,
+                     history: Optional[List[Dict[str, Any]]] = None,
+                     deadline_s: float = settings.GEMINI_DEADLINE_SECONDS) -> AsyncIterator[str]:
+        """
+        Response text for `prompt` in pieces, as Gemini produces them.
+
+        The deadline and retries only cover getting the first piece: once text
+        has been handed out, a broken stream raises GeminiUnavailable rather than
+        starting over. The concurrency slot is held until the stream ends.
+        Closing the generator early (the consumer went away) cancels the
+        upstream call.
+        """
+        self._count("streams")
+        deadline = time.monotonic() + deadline_s
+        start = time.monotonic()
+
+        async def attempt() -> AIStream:
+            await self._admit(deadline)
+            response = None
+            try:
+                timeout = max(0.0, min(settings.GEMINI_TIMEOUT_SECONDS, deadline - time.monotonic()))
+                # Returns once the first chunk has arrived
+                response = await asyncio.wait_for(self.backend.stream(prompt, system_instruction, history), timeout)
+                if not response.first:
+                    raise GeminiEmptyResponse("Empty response from Gemini API - Check API Key/Quota")
+                return response
+            except BaseException:
+                if response is not None:
+                    response.cancel()
+                self._latencies.append(time.monotonic() - start)
+                self._release()
+                raise
+
+        response = await self._with_retries(attempt, deadline)
+        self._first_chunk.append(time.monotonic() - start)
+        finished = False
+        try:
+            yield response.first
+            chunks = response.chunks()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), settings.GEMINI_TIMEOUT_SECONDS)
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    self._count(f"errors_{_classify(e)}")
+                    raise GeminiUnavailable("error", f"Gemini stream broke off: {e}") from e
+                if chunk:
+                    yield chunk
+            finished = True
+            self._count("successes")
+        finally:
+            if not finished:
+                self._count("streams_abandoned")
+                response.cancel()
+            self._latencies.append(time.monotonic() - start)
+            self._release()
+
+    async def _with_retries(self, attempt: Callable[[], Awaitable[T]], deadline: float) -> T:
+        """attempt()'s result, retrying transient failures within the deadline, behind the breaker."""
+        failures = 0
+        while True:
+            if not self.breaker.allow():
+                self._count("rejected_breaker_open")
+                raise GeminiUnavailable("circuit_open", "Gemini is failing; not calling it for now",
+                                        retry_after=self.breaker.retry_after())
+            try:
+                result = await attempt()
+            except GeminiUnavailable:
+                self.breaker.abandon()
+                raise
+            except Exception as e:
+                kind = _classify(e)
+                self._count(f"errors_{kind}")
+                if kind == "fatal":
+                    # Bad request, bad key, empty answer: retrying will not help, but it
+                    # says nothing about the API being degraded either
+                    self.breaker.abandon()
+                    raise GeminiUnavailable("error", f"Gemini call failed: {e}") from e
+                self.breaker.failure()
+                failures += 1
+                hint = _retry_hint(e)
+                backoff = random.uniform(0, min(settings.GEMINI_MAX_BACKOFF_SECONDS,
+                                                settings.GEMINI_BASE_BACKOFF_SECONDS * 2 ** failures))
+                wait = max(backoff, hint or 0.0)
+                remaining = deadline - time.monotonic()
+                if failures > settings.GEMINI_MAX_RETRIES or wait >= remaining:
+                    reason = "quota" if kind == "quota" else ("timeout" if isinstance(e, asyncio.TimeoutError) else "error")
+                    raise GeminiUnavailable(reason, f"Gemini call failed after {failures} attempt(s): {e}",
+                                            retry_after=hint) from e
+                self._count("retries")
+                logger.info(f"Gemini {kind} error, retry {failures} in {wait:.1f}s: {e}")
+                await asyncio.sleep(wait)
+                continue
+            self.breaker.success()
+            return result
+
+    async def _admit(self, deadline: float):
+        """Take a rate-limit token and a concurrency slot (release with _release), or raise GeminiUnavailable."""
+        if not await self._bucket.acquire(max_wait=deadline - time.monotonic()):
+            self._count("rejected_rate_limited")
+            raise GeminiUnavailable("rate_limited", "Gemini request rate limit reached",
+                                    retry_after=1 / self._bucket.rate)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self._count("rejected_concurrency")
+            raise GeminiUnavailable("rate_limited", "Too many Gemini calls in progress")
+        self._in_flight += 1
+
+    def _release(self):
+        self._in_flight -= 1
+        self._slots.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        def percentiles(samples: Deque[float]) -> Dict[str, Any]:
+            ordered = sorted(samples)
+
+            def percentile(p: float) -> Optional[float]:
+                return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 1) if ordered else None
+
+            return {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99), "samples": len(ordered)}
+
+        return {
+            "backend": self.backend.name,
+            "counts": dict(self._counts),
+            "in_flight": self._in_flight,
+            "breaker": self.breaker.state,
+            "tokens_available": round(min(self._bucket.capacity, self._bucket.tokens), 2),
+            "latency_ms": percentiles(self._latencies),
+            "stream_first_chunk_ms": percentiles(self._first_chunk),
+            # The stand-in's own tally (calls, injected failures, cancellations)
+            **({"backend_counts": dict(self.backend.counts)} if hasattr(self.backend, "counts") else {}),
+        }
 
-def _get_model():
-    global _model
-    if _model is None:
-        import google.generativeai as genai
-        logger.info("Initializing Gemini AI model...")
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        _model = genai.GenerativeModel("gemini-2.0-flash")
-    return _model
+gemini = GeminiClient()
 
 async def generate_medical_analysis(prompt: str) -> str:
     try:
-        model = _get_model()
-        # Using generate_content_async for better integration with FastAPI
-        response = await model.generate_content_async(prompt)
-        if not response or not response.text:
-            raise Exception("Empty response from Gemini API - Check API Key/Quota")
-        return response.text
-    except Exception as e:
+        return await gemini.generate(prompt)
+    except GeminiUnavailable as e:
         logger.error(f"GEMINI CRITICAL ERROR: {str(e)}")
-        raise e
+        raise
@@ -0,0 +1,150 @@
+"""
+Nightly precomputation of the AI summaries shown in reports.
+
+Generated on the request path, a report's summary costs the first download of
+the day several seconds and one Gemini call per patient. This job runs
+off-peak (NARRATIVE_PRECOMPUTE_HOUR, UTC) and writes them into the summary
+cache (services/summary_cache.py) ahead of time:
+
+1. It finds patients with daily_metrics stored since their last summary, over
+   the last NARRATIVE_LOOKBACK_HOURS. New records are found by `_id`: an
+   ObjectId carries its insert time and, unlike created_at, is never
+   backdated by a batch upload.
+2. It builds each patient's summary inputs exactly as a default report
+   download does (analysis_engine.summary_inputs), over the default window,
+   with one aggregation for all of them. Inputs that already have a fresh
+   cached summary are skipped.
+3. It asks Gemini for NARRATIVE_BATCH_SIZE patients' summaries in one call,
+   as JSON ([{"id", "summary"}]) constrained by a response schema.
+4. It stores each parsed summary under the key a download looks up.
+
+Patients missing from a response, or in a batch whose call failed, are left to
+the download path. A quota or circuit-breaker failure ends the run early, and
+the rest wait for the next night.
+
+Runs once per day across workers (services/single_flight.py). To run it by
+hand, use scripts/precompute_narratives.py.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+
+from bson import ObjectId
+
+from app.config import settings
+from app.services.analysis_engine import (
+    ANALYSIS_INSTRUCTIONS, empty_stats, patient_section, summary_inputs, window_stats
+)
+from app.services.gemini_service import GeminiUnavailable, gemini
+from app.services.single_flight import flights
+from app.services.summary_cache import fresh_keys, last_summary_times, store_summary, summary_key
+
+logger = logging.getLogger(__name__)
+
+BATCH_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"id": {"type": "string"}, "summary": {"type": "string"}},
+        "required": ["id", "summary"],
+    },
+}
+
+BATCH_PROMPT = """
+You are a prosthetic biomechanics specialist.
+
+Below are {count} patients, each introduced by a "Patient ID:" line. For each patient separately, analyze their prosthetic health based on their own metrics. {instructions}
+
+Answer with a JSON array holding one object per patient: "id" (the Patient ID exactly as given) and "summary" (that patient's paragraph).
+{sections}"""
+
+async def find_candidates(db, since: datetime) -> List[ObjectId]:
+    """Patients with daily_metrics inserted after `since` and after their last summary."""
+    cursor = db["daily_metrics"].aggregate([
+        {"$match": {"_id": {"$gte": ObjectId.from_datetime(since)}}},
+        {"$group": {"_id": "$patient_id", "latest": {"$max": "$_id"}}},
+    ])
+    latest = {row["_id"]: row["latest"].generation_time async for row in cursor}
+    summarised = await last_summary_times(db, latest)
+    return [patient_id for patient_id, at in latest.items()
+            if patient_id not in summarised or summarised[patient_id] < at]
+
+async def pending_inputs(db, patient_ids: List[ObjectId]) -> List[Tuple[ObjectId, Dict[str, Any]]]:
+    """(patient_id, summary inputs) for the patients whose current inputs have no fresh summary."""
+    profiles = {p["_id"]: p async for p in db["patient_profiles"].find({"_id": {"$in": patient_ids}})}
+    stats = await window_stats(db, list(profiles))
+    pending = [
+        (patient_id, summary_inputs(profiles[patient_id], (stats.get(patient_id) or empty_stats())["averages"]))
+        for patient_id in patient_ids if patient_id in profiles
+    ]
+    fresh = await fresh_keys(db, [summary_key(inputs) for _, inputs in pending])
+    return [(patient_id, inputs) for patient_id, inputs in pending if summary_key(inputs) not in fresh]
+
+def batch_prompt(labelled: Dict[str, Dict[str, Any]]) -> str:
+    sections = "".join(f"\nPatient ID: {label}\n{patient_section(inputs)}" for label, inputs in labelled.items())
+    return BATCH_PROMPT.format(count=len(labelled), instructions=ANALYSIS_INSTRUCTIONS, sections=sections)
+
+def parse_batch(text: str, labels) -> Dict[str, str]:
+    """Summary per label from a batch response; unknown, repeated or empty items are dropped. Raises ValueError."""
+    items = json.loads(text)
+    if not isinstance(items, list):
+        raise ValueError(f"Expected a JSON array, got {type(items).__name__}")
+    summaries: Dict[str, str] = {}
+    for item in items:
+        if not isinstance(item, dict) or item.get("id") not in labels or item["id"] in summaries:
+            continue
+        summary = item.get("summary")
+        if isinstance(summary, str) and summary.strip():
+            summaries[item["id"]] = summary.strip()
+    return summaries
+
+async def precompute_narratives(db, batch_size: int = settings.NARRATIVE_BATCH_SIZE,
+                                lookback_hours: float = settings.NARRATIVE_LOOKBACK_HOURS,
+                                limit: Optional[int] = None) -> Dict[str, int]:
+    """Generate and cache the summaries due; returns counts for the run."""
+    since = datetime.now(timezone.utc) - timedelta(hours=lookback_hours)
+    candidates = await find_candidates(db, since)
+    pending = await pending_inputs(db, candidates)
+    if limit is not None:
+        pending = pending[:limit]
+    stats = {"candidates": len(candidates), "already_cached": len(candidates) - len(pending),
+             "calls": 0, "stored": 0, "missing": 0, "failed_batches": 0}
+
+    for start in range(0, len(pending), batch_size):
+        batch = {f"P{k + 1}": item for k, item in enumerate(pending[start:start + batch_size])}
+        stats["calls"] += 1
+        try:
+            text = await gemini.generate(
+                batch_prompt({label: inputs for label, (_, inputs) in batch.items()}),
+                response_schema=BATCH_SCHEMA,
+                deadline_s=settings.NARRATIVE_DEADLINE_SECONDS,
+                attempt_timeout_s=settings.NARRATIVE_TIMEOUT_SECONDS
+            )
+            summaries = parse_batch(text, batch)
+        except GeminiUnavailable as e:
+            stats["failed_batches"] += 1
+            if e.quota or e.reason == "circuit_open":
+                logger.warning(f"Narrative precompute stopped after {stats['calls']} call(s): {e}")
+                break
+            logger.warning(f"Narrative batch of {len(batch)} failed: {e}")
+            continue
+        except ValueError as e: # Includes json.JSONDecodeError
+            stats["failed_batches"] += 1
+            logger.warning(f"Narrative batch of {len(batch)} returned unusable JSON: {e}")
+            continue
+
+        for label, (patient_id, inputs) in batch.items():
+            if label in summaries:
+                await store_summary(db, patient_id, inputs, summaries[label])
+                stats["stored"] += 1
+            else:
+                stats["missing"] += 1
+
+    logger.info(f"Narrative precompute: {stats}")
+    return stats
+
+async def run_nightly(db) -> Dict[str, int]:
+    """Today's run; every worker's scheduler fires, one of them does the work."""
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    return await flights.run(db, f"precompute_narratives:{day}", lambda: precompute_narratives(db))
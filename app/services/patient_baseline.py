@@ -0,0 +1,214 @@
+"""
+Running per-patient baselines for the daily gait and skin metrics.
+
+Every stored daily record is folded into its patient's document in
+`patient_baselines` in O(1): no history is re-read on the write path. Per metric
+the document keeps
+
+    Welford count / mean / M2          mean and sample variance
+    EWMA mean and variance             recent level (BASELINE_EWMA_ALPHA)
+    P² median and P² median-of-|x-m|   robust centre and spread (MAD) sketch
+
+A new record is compared with the baseline as it stood before that record
+(standard and robust z-scores), then added to it. Updates are compare-and-set on
+`version`, so concurrent inserts for one patient both land.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+from datetime import datetime, timezone
+import logging
+import math
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+METRICS = (
+    "step_length_cm", "cadence_spm", "walking_speed_mps", "gait_symmetry_index",
+    "skin_temperature_c", "skin_moisture", "pressure_distribution_index", "daily_wear_hours",
+    "prosthetic_health_score"
+)
+MAD_TO_SD = 1.4826 # MAD of a normal distribution x 1.4826 = its standard deviation
+MAX_UPDATE_ATTEMPTS = 5
+
+# ─── P² streaming quantile (Jain & Chlamtac, 1985) ────────────
+
+P2_INCREMENTS = (0.0, 0.25, 0.5, 0.75, 1.0) # median: p = 0.5
+
+def _p2_new() -> Dict[str, Any]:
+    return {"init": []}
+
+def _p2_add(sketch: Dict[str, Any], x: float):
+    if "q" not in sketch:
+        sketch["init"].append(x)
+        if len(sketch["init"]) == 5:
+            sketch["q"] = sorted(sketch.pop("init"))
+            sketch["pos"] = [1, 2, 3, 4, 5]
+            sketch["des"] = [1.0, 2.0, 3.0, 4.0, 5.0]
+        return
+
+    q, pos, des = sketch["q"], sketch["pos"], sketch["des"]
+    if x < q[0]:
+        q[0], k = x, 0
+    elif x >= q[4]:
+        q[4], k = x, 3
+    else:
+        k = next(i for i in range(4) if x < q[i + 1])
+    for i in range(k + 1, 5):
+        pos[i] += 1
+    for i in range(5):
+        des[i] += P2_INCREMENTS[i]
+
+    for i in (1, 2, 3):
+        d = des[i] - pos[i]
+        if (d >= 1 and pos[i + 1] - pos[i] > 1) or (d <= -1 and pos[i - 1] - pos[i] < -1):
+            d = 1 if d > 0 else -1
+            parabolic = q[i] + d / (pos[i + 1] - pos[i - 1]) * (
+                (pos[i] - pos[i - 1] + d) * (q[i + 1] - q[i]) / (pos[i + 1] - pos[i])
+                + (pos[i + 1] - pos[i] - d) * (q[i] - q[i - 1]) / (pos[i] - pos[i - 1])
+            )
+            if q[i - 1] < parabolic < q[i + 1]:
+                q[i] = parabolic
+            else:
+                q[i] = q[i] + d * (q[i + d] - q[i]) / (pos[i + d] - pos[i])
+            pos[i] += d
+
+def _p2_median(sketch: Dict[str, Any]) -> Optional[float]:
+    if "q" in sketch:
+        return sketch["q"][2]
+    values = sorted(sketch["init"])
+    if not values:
+        return None
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+# ─── Per-metric running statistics ────────────────────────────
+
+def _new_stats() -> Dict[str, Any]:
+    return {"n": 0, "mean": 0.0, "m2": 0.0, "ewma": None, "ewm_var": 0.0, "median": _p2_new(), "mad": _p2_new()}
+
+def _add(stats: Dict[str, Any], x: float, alpha: float):
+    # Welford
+    stats["n"] += 1
+    delta = x - stats["mean"]
+    stats["mean"] += delta / stats["n"]
+    stats["m2"] += delta * (x - stats["mean"])
+
+    # Exponentially weighted mean and variance
+    if stats["ewma"] is None:
+        stats["ewma"] = x
+    else:
+        diff = x - stats["ewma"]
+        incr = alpha * diff
+        stats["ewma"] += incr
+        stats["ewm_var"] = (1 - alpha) * (stats["ewm_var"] + diff * incr)
+
+    # Robust sketch: the MAD sketch tracks |x - median| against the median so far
+    centre = _p2_median(stats["median"])
+    _p2_add(stats["median"], x)
+    _p2_add(stats["mad"], abs(x - (centre if centre is not None else x)))
+
+def _summary(stats: Dict[str, Any]) -> Dict[str, Any]:
+    n = stats["n"]
+    mad = _p2_median(stats["mad"])
+    return {
+        "n": n,
+        "mean": stats["mean"],
+        "sd": math.sqrt(stats["m2"] / (n - 1)) if n > 1 else None,
+        "ewma": stats["ewma"],
+        "ewm_sd": math.sqrt(stats["ewm_var"]) if n > 1 else None,
+        "median": _p2_median(stats["median"]),
+        "mad": mad,
+    }
+
+def _z(x: float, centre: Optional[float], spread: Optional[float]) -> Optional[float]:
+    if centre is None:
+        return None
+    if not spread or spread <= 1e-9:
+        # A constant baseline: matching it is no deviation, anything else is unmeasurable
+        return 0.0 if abs(x - centre) <= 1e-9 else None
+    return round((x - centre) / spread, 3)
+
+def baseline_deviation(baseline: Optional[Dict[str, Any]], record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Deviation of `record` from a patient's baseline: per metric the z-score
+    against the running mean/SD and the robust z against median/MAD, plus the
+    largest absolute robust z. None until BASELINE_MIN_SAMPLES records exist.
+    """
+    if not baseline or baseline.get("count", 0) < settings.BASELINE_MIN_SAMPLES:
+        return None
+    metrics, worst = {}, None
+    for name in METRICS:
+        stats = baseline["metrics"].get(name)
+        if stats is None or record.get(name) is None:
+            continue
+        s = _summary(stats)
+        x = float(record[name])
+        z = _z(x, s["mean"], s["sd"])
+        robust_z = _z(x, s["median"], s["mad"] * MAD_TO_SD if s["mad"] is not None else None)
+        metrics[name] = {"z": z, "robust_z": robust_z}
+        score = robust_z if robust_z is not None else z
+        if score is not None and (worst is None or abs(score) > abs(worst)):
+            worst = score
+    return {"samples": baseline["count"], "max_abs_z": abs(worst) if worst is not None else None, "metrics": metrics}
+
+def summarize_baseline(baseline: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Readable per-metric mean / SD / EWMA / median / MAD of a baseline document."""
+    if not baseline:
+        return {}
+    return {name: _summary(stats) for name, stats in baseline["metrics"].items()}
+
+# ─── Storage ──────────────────────────────────────────────────
+
+async def get_baseline(db, patient_id: ObjectId) -> Optional[Dict[str, Any]]:
+    return await db["patient_baselines"].find_one({"patient_id": ObjectId(patient_id)})
+
+async def update_baseline(db, patient_id: ObjectId, records: Sequence[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Fold `records` (in order) into the patient's baseline with a compare-and-set
+    on `version`, retrying on a concurrent update. Also keeps
+    `patient_profiles.baseline_score` at the EWMA of the health score.
+    """
+    if not records:
+        return None
+    patient_id = ObjectId(patient_id)
+    alpha = settings.BASELINE_EWMA_ALPHA
+
+    for _ in range(MAX_UPDATE_ATTEMPTS):
+        baseline = await get_baseline(db, patient_id)
+        version = baseline["version"] if baseline else 0
+        state = baseline["metrics"] if baseline else {}
+        count = baseline["count"] if baseline else 0
+
+        for record in records:
+            for name in METRICS:
+                value = record.get(name)
+                if value is None:
+                    continue
+                _add(state.setdefault(name, _new_stats()), float(value), alpha)
+            count += 1
+
+        update = {"metrics": state, "count": count, "version": version + 1, "updated_at": datetime.now(timezone.utc)}
+        try:
+            if baseline:
+                result = await db["patient_baselines"].update_one(
+                    {"_id": baseline["_id"], "version": version}, {"$set": update}
+                )
+                if result.modified_count == 0:
+                    continue
+            else:
+                await db["patient_baselines"].insert_one({"patient_id": patient_id, **update})
+        except DuplicateKeyError:
+            continue # Another insert created the document first
+
+        health = state.get("prosthetic_health_score")
+        if health and health["ewma"] is not None and count >= settings.BASELINE_MIN_SAMPLES:
+            await db["patient_profiles"].update_one(
+                {"_id": patient_id}, {"$set": {"baseline_score": round(health["ewma"], 2)}}
+            )
+        return update
+
+    logger.warning(f"Baseline update for patient {patient_id} gave up after {MAX_UPDATE_ATTEMPTS} conflicting attempts")
+    return None
@@ -0,0 +1,81 @@
+"""
+PDF rendering off the event loop.
+
+ReportLab lays out and writes a whole report in pure Python while holding the
+GIL, so a render in a thread would still stall every other request on the
+worker. Renders therefore run in a small process pool (PDF_RENDER_WORKERS
+processes per web worker).
+
+At most PDF_RENDER_MAX_QUEUE renders may be running or waiting per web
+worker. Past that, render() raises PdfRenderBusy at once, and the caller
+answers 503 with Retry-After; a burst of downloads does not build a queue
+nobody will wait out.
+
+The pool is created on first use, so it never exists in a gunicorn master
+before the fork. Its processes are spawned rather than forked from a worker
+that is running an event loop and Motor's threads. Each one builds the
+report templates (services/pdf_templates.py) once, when it starts. A pool
+broken by a crashed process is replaced on the next render. Spawned processes re-import the main module, so
+scripts that render through the pool need an `if __name__ == "__main__":` guard.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+import asyncio
+import logging
+import multiprocessing
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+class PdfRenderBusy(Exception):
+    """Too many renders queued on this worker."""
+    def __init__(self, retry_after: float):
+        super().__init__("Too many reports being generated; try again shortly")
+        self.retry_after = retry_after
+
+def _warm_process():
+    from app.services import pdf_templates
+    pdf_templates.warm()
+
+class PdfRenderPool:
+    def __init__(self, workers: int = settings.PDF_RENDER_WORKERS,
+                 max_queue: int = settings.PDF_RENDER_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.queued = 0 # Running or waiting
+        self.rejected = 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_process
+            )
+        return self._executor
+
+    async def render(self, fn: Callable[..., Any], *args) -> Any:
+        """fn(*args) in a pool process; fn and its arguments must be picklable. Raises PdfRenderBusy."""
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise PdfRenderBusy(retry_after=1.0)
+        self.queued += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool(), fn, *args)
+        except BrokenProcessPool:
+            logger.error("PDF render process died; starting a new pool")
+            self.shutdown()
+            raise
+        finally:
+            self.queued -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+pdf_pool = PdfRenderPool()
@@ -0,0 +1,286 @@
+"""
+Report templates: the parts of a PDF report that never change, built once per
+process.
+
+Every report has the same page setup, paragraph and table styles, logo, title
+block, divider and disclaimer. Building them cost each render a stylesheet,
+half a dozen ParagraphStyles and a decode of the logo PNG.
+
+Here the styles are created on first use and each template keeps its static
+flowables; the logo keeps its decoded pixels after the first render. A
+render only builds the flowables holding the patient's data.
+
+Each document still compresses and encodes the logo's pixels again as it is
+drawn; that is ReportLab's public drawImage path. Its ASCII85 encoder is
+pure Python unless the C accelerator from reportlab's `accel` extra is
+installed, which requirements.txt asks for.
+
+Templates are shared by the renders in a process and their flowables are laid
+out in place, so a process renders one report at a time: the render pool
+(services/pdf_pool.py) runs one render per process. This module imports
+ReportLab; import it lazily, as services/pdf_service.py does.
+"""
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
+from xml.sax.saxutils import escape
+import logging
+import os
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from app.services.pdf_service import LOGO_PATH, REPORT_METRICS, _evaluate_report
+
+logger = logging.getLogger(__name__)
+
+DISCLAIMER = ("This AI-generated report is for information purposes only "
+              "and does not replace professional medical consultation.")
+
+# ─── Styles ──────────────────────────────────────────────────────────────────
+
+@lru_cache(maxsize=None)
+def styles() -> Dict[str, Any]:
+    sample = getSampleStyleSheet()
+    return {
+        "title": ParagraphStyle(
+            'TitleStyle',
+            parent=sample['Heading1'],
+            fontSize=24,
+            textColor=colors.HexColor("#2C3E50"),
+            alignment=2, # Right Align for corporate look
+            spaceAfter=0
+        ),
+        "header": ParagraphStyle(
+            'HeaderStyle',
+            parent=sample['Heading2'],
+            fontSize=14,
+            textColor=colors.HexColor("#2980B9"),
+            spaceBefore=12,
+            spaceAfter=6
+        ),
+        "body": sample['Normal'],
+        "disclaimer": ParagraphStyle(
+            'DisclaimerStyle',
+            parent=sample['Normal'],
+            fontSize=8,
+            textColor=colors.grey,
+            italic=True,
+            alignment=1
+        ),
+        "info_table": TableStyle([
+            ('VALIGN', (0,0), (-1,-1), 'TOP'),
+            ('BOTTOMPADDING', (0,0), (-1,-1), 12),
+        ]),
+        "data_table": TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#ECF0F1")),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor("#2C3E50")),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('BOTTOMPADDING', (0,0), (-1,0), 12),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ]),
+    }
+
+# ─── Logo ────────────────────────────────────────────────────────────────────
+
+@lru_cache(maxsize=None)
+def logo() -> Optional[Image]:
+    """The logo flowable, or None when logo/logo.png is missing or unreadable."""
+    if not os.path.exists(LOGO_PATH):
+        return None
+    try:
+        # Maintain aspect ratio with fixed width
+        image = Image(LOGO_PATH, width=1.5*inch, height=1.5*inch, kind='proportional')
+        image.hAlign = 'LEFT'
+        return image
+    except Exception as e:
+        logger.warning(f"Report logo unavailable: {e}")
+        return None
+
+# ─── Templates ───────────────────────────────────────────────────────────────
+
+class ReportTemplate:
+    """Branded letter-size report: logo, title and divider, the body, then the disclaimer."""
+    title = ""
+
+    def __init__(self):
+        style = styles()
+        self.head: List[Any] = []
+        if logo() is not None:
+            self.head += [logo(), Spacer(1, 0.2*inch)]
+        divider = Table([[""]], colWidths=[6 * inch])
+        divider.setStyle(TableStyle([
+            ('LINEBELOW', (0, 0), (-1, -1), 1, colors.HexColor("#2C3E50"))
+        ]))
+        self.head += [
+            Paragraph(f"<b>{self.title}</b>", style["title"]),
+            Spacer(1, 0.1 * inch),
+            Paragraph("<font size=10 color='#7f8c8d'>Prothexa AI Clinical Mobility Platform</font>", style["body"]),
+            Spacer(1, 0.1 * inch),
+            divider,
+            Spacer(1, 0.3 * inch),
+        ]
+        self.foot = [
+            Spacer(1, 0.4 * inch),
+            Spacer(1, 0.5 * inch),
+            Paragraph(DISCLAIMER, style["disclaimer"]),
+        ]
+
+    def body(self, data: Dict[str, Any]) -> List[Any]:
+        raise NotImplementedError
+
+    def render(self, data: Dict[str, Any]) -> bytes:
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
+        doc.build([*self.head, *self.body(data), *self.foot])
+        return buffer.getvalue()
+
+class MedicalReport(ReportTemplate):
+    """The on-demand report: GET /report/patient/download-report."""
+    title = "Prosthetic Biomechanical Analysis Report"
+
+    def body(self, data: Dict[str, Any]) -> List[Any]:
+        style = styles()
+        header_style, body_style = style["header"], style["body"]
+        elements = []
+
+        # Patient Info
+        patient_info = [
+            [Paragraph(f"<b>Patient Name:</b> {escape(data['patient_name'])}", body_style),
+             Paragraph(f"<b>Date:</b> {datetime.now().strftime('%Y-%m-%d')}", body_style)],
+            [Paragraph(f"<b>Age:</b> {data['patient_age']}", body_style),
+             Paragraph(f"<b>Report ID:</b> PBAR-{datetime.now().strftime('%H%M%S')}", body_style)]
+        ]
+        info_table = Table(patient_info, colWidths=[3 * inch, 3 * inch])
+        info_table.setStyle(style["info_table"])
+        elements.append(info_table)
+        elements.append(Spacer(1, 0.2 * inch))
+
+        # Clinical Profile Table
+        elements.append(Paragraph("Patient Clinical Profile", header_style))
+        clinical = data.get('clinical_profile', {})
+        clinical_data = [
+            ["Parameter", "Value"],
+            ["Gender", clinical.get("gender", "N/A")],
+            ["Height", f"{clinical.get('height_cm', 'N/A')} cm"],
+            ["Weight", f"{clinical.get('weight_kg', 'N/A')} kg"],
+            ["BMI", f"{clinical.get('bmi', 'N/A')}"],
+            ["Blood Pressure", f"{clinical.get('blood_pressure', 'N/A')} mmHg"],
+            ["Blood Sugar", f"{clinical.get('blood_sugar_mg_dl', 'N/A')} mg/dL"],
+            ["Existing Conditions", ", ".join(clinical.get('medical_conditions', [])) if clinical.get('medical_conditions') else "None"]
+        ]
+
+        # Risk highlighting and interpretations come from the clinical rule table
+        metrics = data.get('metrics', {})
+        evaluated = _evaluate_report(metrics, clinical)
+        flags = evaluated["profile_flags"]
+
+        clin_table = Table(clinical_data, colWidths=[2.5 * inch, 3.5 * inch])
+        clin_table_style = [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#ECF0F1")),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ]
+        for row, field in ((4, "bmi"), (5, "blood_pressure_systolic"), (6, "blood_sugar_mg_dl")):
+            if flags[field]:
+                clin_table_style.append(('TEXTCOLOR', (1, row), (1, row), colors.red))
+                clinical_data[row][1] += f" ({flags[field]})"
+        clin_table.setStyle(TableStyle(clin_table_style))
+        elements.append(clin_table)
+        elements.append(Spacer(1, 0.2 * inch))
+
+        # Metrics Table
+        window = f" (Last {data['window_days']} Days)" if data.get('window_days') else ""
+        elements.append(Paragraph(f"Gait Metrics Summary{window}", header_style))
+        classification = data.get('classification', {})
+        interpretations = evaluated["interpretations"]
+
+        table_data = [["Metric", "Value", "Interpretation"]]
+        for label, field, unit in REPORT_METRICS:
+            value = metrics.get(f"avg_{field}")
+            table_data.append([label, "N/A" if value is None else f"{value}{unit}", interpretations[field]])
+        metrics_table = Table(table_data, colWidths=[2 * inch, 1.5 * inch, 2.5 * inch])
+        metrics_table.setStyle(style["data_table"])
+        elements.append(metrics_table)
+        elements.append(Spacer(1, 0.2 * inch))
+
+        # Risk Classification Section
+        elements.append(Paragraph("Risk Classification", header_style))
+        health_score = classification.get("prosthetic_health_score")
+        risk_data = [
+            ["Factor", "Status"],
+            ["Gait Abnormality", classification.get("gait_abnormality", "N/A")],
+            ["Skin Irritation Risk", classification.get("skin_risk", "N/A")],
+            ["Prosthetic Health Score", "N/A" if health_score is None else f"{health_score}/100"],
+            ["Overall Clinical Risk", classification.get("overall_clinical_risk", "Low")]
+        ]
+        risk_table = Table(risk_data, colWidths=[3 * inch, 3 * inch])
+        risk_table.setStyle(TableStyle([
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('BACKGROUND', (1, 4), (1, 4), colors.orange if classification.get("overall_clinical_risk") == "Moderate" else colors.red if classification.get("overall_clinical_risk") == "High" else colors.green),
+        ]))
+        elements.append(risk_table)
+        elements.append(Spacer(1, 0.3 * inch))
+
+        # AI Analysis Section
+        elements.append(Paragraph("AI Clinical Interpretation & Recommendations", header_style))
+        analysis_text = data['analysis'].replace('\n', '<br/>')
+        elements.append(Paragraph(analysis_text, body_style))
+        return elements
+
+class WeeklyReport(ReportTemplate):
+    """The weekly cron report (cron/weekly_job.py), from its 7-day aggregation."""
+    title = "Weekly Biomechanical Analysis Report"
+
+    def body(self, data: Dict[str, Any]) -> List[Any]:
+        style = styles()
+        header_style, body_style = style["header"], style["body"]
+
+        info_table = Table([
+            [Paragraph(f"<b>Patient Name:</b> {escape(data['patient_name'])}", body_style),
+             Paragraph(f"<b>Period:</b> {data['start_date'].date()} to {data['end_date'].date()}", body_style)]
+        ], colWidths=[3 * inch, 3 * inch])
+        info_table.setStyle(style["info_table"])
+
+        averages = Table([
+            ["Metric", "Weekly Average"],
+            ["Gait Symmetry", f"{data['avg_symmetry']:.2f}"],
+            ["Walking Speed", f"{data['avg_walking_speed']:.2f} m/s"],
+            ["Prosthetic Health Score", f"{data['avg_health_score']:.1f}/100"],
+        ], colWidths=[3 * inch, 3 * inch])
+        averages.setStyle(style["data_table"])
+
+        incidents = Table([
+            ["Incident", "Count"],
+            ["Gait Abnormality Events", str(data['abnormal_count'])],
+            ["High Skin Risk Alerts", str(data['high_skin_risk_count'])],
+        ], colWidths=[3 * inch, 3 * inch])
+        incidents.setStyle(style["data_table"])
+
+        return [
+            info_table,
+            Spacer(1, 0.2 * inch),
+            Paragraph("Biomechanical Averages", header_style),
+            averages,
+            Spacer(1, 0.2 * inch),
+            Paragraph("Weekly Incident Summary", header_style),
+            incidents,
+            Spacer(1, 0.3 * inch),
+            Paragraph("<i>Clinical Note: Consistently low gait symmetry may indicate need for socket adjustment.</i>", body_style),
+        ]
+
+@lru_cache(maxsize=None)
+def template(cls: type) -> ReportTemplate:
+    """This process's instance of a template class."""
+    return cls()
+
+def warm():
+    """Build the styles, logo and templates now rather than in the first render."""
+    for cls in (MedicalReport, WeeklyReport):
+        template(cls)
@@ -0,0 +1,215 @@
+"""
+Bulk re-scoring of stored `daily_metrics` after AIEngine's rules change.
+
+Bump ai_engine.SCORING_VERSION with any change to the rules, then run
+scripts/rescore_daily_metrics.py (or POST /admin/rescoring). The job:
+
+- walks the collection in `_id` order, in batches, skipping records already at
+  the current scoring_version, so no cursor is held open across batches;
+- scores each batch in one vectorized AIEngine.score_records pass, using each
+  record's patient profile (fetched once per patient and kept for the run):
+  the scored profile fields plus the amputation level, so a cohort patient is
+  re-scored with the cohort's thresholds, as on insert;
+- writes the new labels and the scoring_version back with an unordered
+  bulk_write, overlapping that write with the read of the next batch;
+- saves the last written `_id` to `job_checkpoints` after every batch, so a
+  crashed or stopped run resumes where it left off (re-writing at most one batch,
+  which is harmless: the writes are idempotent);
+- holds a lease on the checkpoint so only one run is active at a time;
+- throttles itself: it is busy at most RESCORE_MAX_DUTY of the wall clock, and
+  halves its batch size whenever a bulk write takes longer than
+  RESCORE_TARGET_WRITE_MS, growing it back while the database keeps up.
+"""
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import os
+import socket
+import time
+
+from pymongo import ReturnDocument, UpdateOne
+
+from app.config import settings
+from app.services.ai_engine import ai_engine, SCORING_VERSION, METRIC_FIELDS, PROFILE_FIELDS
+from app.services.anomaly_models import COHORT_FIELD
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "rescore_daily_metrics"
+MIN_BATCH_SIZE = 100
+MAX_BATCH_SIZE = 50000
+PROFILE_CACHE_MAX = 200000
+PROFILE_KEYS = (*PROFILE_FIELDS, COHORT_FIELD) # What the rules read from a profile
+
+class RescoringBusy(Exception):
+    """Another run holds the lease for this scoring version."""
+
+def checkpoint_id(version: int = SCORING_VERSION) -> str:
+    return f"{JOB_NAME}:v{version}"
+
+async def get_rescoring_status(db, version: int = SCORING_VERSION) -> Optional[Dict[str, Any]]:
+    return await db["job_checkpoints"].find_one({"_id": checkpoint_id(version)})
+
+async def rescoring_active(db, version: int = SCORING_VERSION) -> bool:
+    """True while some run holds an unexpired lease."""
+    checkpoint = await db["job_checkpoints"].find_one({
+        "_id": checkpoint_id(version),
+        "lease_until": {"$gt": datetime.now(timezone.utc)}
+    })
+    return checkpoint is not None
+
+async def _acquire_lease(db, job_id: str, owner: str, lease_s: float) -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    await db["job_checkpoints"].update_one(
+        {"_id": job_id},
+        {"$setOnInsert": {"last_id": None, "processed": 0, "started_at": now, "status": "pending"}},
+        upsert=True
+    )
+    checkpoint = await db["job_checkpoints"].find_one_and_update(
+        {
+            "_id": job_id,
+            "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}, {"owner": owner}]
+        },
+        {"$set": {"owner": owner, "lease_until": now + timedelta(seconds=lease_s), "status": "running"}},
+        return_document=ReturnDocument.AFTER
+    )
+    if checkpoint is None:
+        raise RescoringBusy(f"{job_id} is already running")
+    return checkpoint
+
+def scoring_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a patient profile the clinical rules read; scores the same as the whole profile."""
+    return {key: profile[key] for key in PROFILE_KEYS if profile.get(key) is not None}
+
+async def _load_profiles(db, patient_ids, cache: Dict[Any, Dict[str, Any]]):
+    missing = [pid for pid in set(patient_ids) if pid not in cache]
+    if not missing:
+        return
+    if len(cache) + len(missing) > PROFILE_CACHE_MAX:
+        cache.clear()
+    found = await db["patient_profiles"].find(
+        {"_id": {"$in": missing}}, {key: 1 for key in PROFILE_KEYS}
+    ).to_list(None)
+    for profile in found:
+        cache[profile["_id"]] = scoring_profile(profile)
+    for pid in missing:
+        cache.setdefault(pid, {})
+
+def _updates(docs: List[Dict[str, Any]], scores: Dict[str, Any], stamped_at: datetime) -> List[UpdateOne]:
+    gait = scores["gait_abnormality"].tolist()
+    skin = scores["skin_risk"].tolist()
+    health = scores["prosthetic_health_score"].tolist()
+    return [
+        UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {
+                "gait_abnormality": gait[i],
+                "skin_risk": skin[i],
+                "prosthetic_health_score": health[i],
+                "scoring_version": SCORING_VERSION,
+                "rescored_at": stamped_at
+            }}
+        )
+        for i, doc in enumerate(docs)
+    ]
+
+async def run_rescoring(db, batch_size: int = settings.RESCORE_BATCH_SIZE,
+                        max_duty: float = settings.RESCORE_MAX_DUTY,
+                        target_write_ms: float = settings.RESCORE_TARGET_WRITE_MS,
+                        limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Re-score every daily_metrics record not yet at SCORING_VERSION, resuming from
+    the saved checkpoint. Returns the final checkpoint document. `limit` stops
+    after roughly that many records (the checkpoint is kept for the next run).
+    """
+    job_id = checkpoint_id()
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    lease_s = max(60.0, target_write_ms / 1000 * 20)
+    checkpoint = await _acquire_lease(db, job_id, owner, lease_s)
+    last_id = checkpoint.get("last_id")
+    processed = checkpoint.get("processed", 0)
+    logger.info(f"Re-scoring daily_metrics to v{SCORING_VERSION} from {last_id or 'the start'} ({processed} done)")
+
+    projection = {key: 1 for key in METRIC_FIELDS}
+    projection["patient_id"] = 1
+    profiles: Dict[Any, Dict[str, Any]] = {}
+    batch_size = min(max(batch_size, MIN_BATCH_SIZE), MAX_BATCH_SIZE)
+    run_started, run_processed, stopped_early = time.monotonic(), 0, False
+
+    async def read_batch(after, size: int) -> List[Dict[str, Any]]:
+        query: Dict[str, Any] = {"scoring_version": {"$ne": SCORING_VERSION}}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        return await db["daily_metrics"].find(query, projection).sort("_id", 1).limit(size).to_list(size)
+
+    async def write_batch(updates: List[UpdateOne]) -> float:
+        start = time.monotonic()
+        await db["daily_metrics"].bulk_write(updates, ordered=False)
+        return (time.monotonic() - start) * 1000
+
+    try:
+        docs = await read_batch(last_id, batch_size)
+        while docs:
+            busy_start = time.monotonic()
+            await _load_profiles(db, [d["patient_id"] for d in docs], profiles)
+            for doc in docs:
+                doc["profile"] = profiles.get(doc["patient_id"], {})
+            scores = ai_engine.score_records(docs)
+            updates = _updates(docs, scores, datetime.now(timezone.utc))
+
+            # Write this batch while the next one is read
+            batch_last_id = docs[-1]["_id"]
+            done = limit is not None and run_processed + len(docs) >= limit
+            write = asyncio.create_task(write_batch(updates))
+            next_docs = [] if done else await read_batch(batch_last_id, batch_size)
+            write_ms = await write
+
+            processed += len(docs)
+            run_processed += len(docs)
+            await db["job_checkpoints"].update_one(
+                {"_id": job_id, "owner": owner},
+                {"$set": {
+                    "last_id": batch_last_id,
+                    "processed": processed,
+                    "batch_size": batch_size,
+                    "updated_at": datetime.now(timezone.utc),
+                    "lease_until": datetime.now(timezone.utc) + timedelta(seconds=lease_s)
+                }}
+            )
+
+            # Adapt to the database: back off on slow writes, grow while it keeps up
+            if write_ms > target_write_ms:
+                batch_size = max(MIN_BATCH_SIZE, batch_size // 2)
+            elif write_ms < target_write_ms / 2:
+                batch_size = min(MAX_BATCH_SIZE, batch_size + batch_size // 4)
+
+            # Stay idle for the rest of the duty cycle
+            busy = time.monotonic() - busy_start
+            if max_duty < 1.0:
+                await asyncio.sleep(busy * (1.0 / max_duty - 1.0))
+
+            docs = next_docs
+            if done:
+                stopped_early = True
+                break
+
+        status = "paused" if stopped_early else "complete"
+        elapsed = time.monotonic() - run_started
+        logger.info(
+            f"Re-scored {run_processed} records in {elapsed:.1f}s "
+            f"({run_processed / elapsed if elapsed else 0:.0f}/s); {processed} total, {status}"
+        )
+        return await db["job_checkpoints"].find_one_and_update(
+            {"_id": job_id, "owner": owner},
+            {"$set": {"status": status, "updated_at": datetime.now(timezone.utc)},
+             "$unset": {"lease_until": "", "owner": ""}},
+            return_document=ReturnDocument.AFTER
+        )
+    except BaseException:
+        # Release the lease so a restart does not have to wait for it to expire
+        await db["job_checkpoints"].update_one(
+            {"_id": job_id, "owner": owner},
+            {"$set": {"status": "interrupted"}, "$unset": {"lease_until": "", "owner": ""}}
+        )
+        raise
@@ -0,0 +1,313 @@
+"""
+Streaming ingestion of raw wearable recordings (/patient/upload-gait).
+
+Uploads are read in fixed-size pieces, parsed into typed NumPy blocks and handed
+to the bucket writer in services/sensor_store.py, so memory use does not depend
+on the length of the recording.
+
+CSV layout: one header row naming the channels, then one numeric row per sample.
+An optional `timestamp` column gives each sample's time in seconds, either epoch
+seconds or an offset from `recorded_at`; without it samples are spaced by the
+upload's sample rate.
+
+For high-rate devices the packed binary `.pxg` layout (see _stream_pxg) avoids
+text parsing altogether and feeds the same bucket writer.
+"""
+from typing import List, Optional
+from datetime import datetime, timedelta, timezone
+import logging
+import struct
+
+import numpy as np
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+from app.models.database_models import SensorUpload
+from app.services.fingerprint import hash_upload
+from app.services.sensor_store import SensorBucketWriter, TIME_COLUMN
+
+logger = logging.getLogger(__name__)
+
+MAX_LINE_BYTES = 64 * 1024
+
+class UploadRejected(Exception):
+    """Raised for uploads that are malformed or too large; carries the HTTP status to return."""
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+class CsvChunkParser:
+    """
+    Incremental CSV parser. `feed()` accepts arbitrary byte pieces and returns a
+    float64 (rows x columns) block for every complete line seen so far; a partial
+    trailing line is carried over to the next call.
+    """
+    def __init__(self, max_columns: int = settings.SENSOR_UPLOAD_MAX_COLUMNS):
+        self.max_columns = max_columns
+        self.columns: Optional[List[str]] = None
+        self._pending = b""
+        self._line_no = 0
+
+    def feed(self, data: bytes) -> Optional[np.ndarray]:
+        buffer = self._pending + data
+        cut = buffer.rfind(b"\n")
+        if cut == -1:
+            if len(buffer) > MAX_LINE_BYTES:
+                raise UploadRejected(400, f"Malformed CSV: line {self._line_no + 1} exceeds {MAX_LINE_BYTES} bytes")
+            self._pending = buffer
+            return None
+        self._pending = buffer[cut + 1:]
+        return self._parse(buffer[:cut + 1])
+
+    def finish(self) -> Optional[np.ndarray]:
+        remaining, self._pending = self._pending, b""
+        block = self._parse(remaining) if remaining.strip() else None
+        if self.columns is None:
+            raise UploadRejected(400, "Malformed CSV: missing header row")
+        return block
+
+    def _parse(self, raw: bytes) -> Optional[np.ndarray]:
+        try:
+            lines = raw.decode("utf-8-sig" if self._line_no == 0 else "utf-8").splitlines()
+        except UnicodeDecodeError:
+            raise UploadRejected(400, "Malformed CSV: file is not valid UTF-8 text")
+
+        if self.columns is None:
+            while lines and not lines[0].strip():
+                lines.pop(0)
+                self._line_no += 1
+            if not lines:
+                return None
+            self.columns = self._parse_header(lines.pop(0))
+            self._line_no += 1
+
+        first_line = self._line_no
+        self._line_no += len(lines)
+        if not any(line.strip() for line in lines):
+            return None
+
+        try:
+            block = np.loadtxt(lines, delimiter=",", dtype=np.float64, ndmin=2)
+        except ValueError as e:
+            raise UploadRejected(400, f"Malformed CSV near line {first_line + 1}: {e}")
+        # loadtxt only checks that the rows of one block agree with each other
+        if block.shape[1] != len(self.columns):
+            raise UploadRejected(400, f"Malformed CSV near line {first_line + 1}: "
+                                      f"{block.shape[1]} fields per row, the header has {len(self.columns)}")
+        return block
+
+    def _parse_header(self, line: str) -> List[str]:
+        columns = [c.strip() for c in line.split(",")]
+        if not all(columns):
+            raise UploadRejected(400, "Malformed CSV: empty column name in header")
+        if len(set(columns)) != len(columns):
+            raise UploadRejected(400, "Malformed CSV: duplicate column names in header")
+        if len(columns) > self.max_columns:
+            raise UploadRejected(400, f"Too many columns ({len(columns)} > {self.max_columns})")
+        return columns
+
+# ─── Packed binary format (.pxg) ──────────────────────────────
+
+PXG_MAGIC = b"PXG1"
+PXG_VERSION = 1
+PXG_HEADER = struct.Struct("<4sHHfI")
+PXG_NAME_BYTES = 32
+PXG_FLAG_TIMESTAMPS = 0x1
+
+def pxg_frame_dtype(channel_count: int, has_timestamps: bool) -> np.dtype:
+    fields = [("timestamp", "<f8")] if has_timestamps else []
+    fields.append(("values", "<f4", (channel_count,)))
+    return np.dtype(fields) # packed, no alignment padding
+
+def encode_pxg(channels: List[str], values: np.ndarray, timestamps: Optional[np.ndarray] = None,
+               sample_rate_hz: float = 0.0) -> bytes:
+    """Reference encoder for the .pxg layout (used by the benchmark and by client tooling)."""
+    has_ts = timestamps is not None
+    header = PXG_HEADER.pack(PXG_MAGIC, PXG_VERSION, len(channels), sample_rate_hz,
+                             PXG_FLAG_TIMESTAMPS if has_ts else 0)
+    names = b"".join(name.encode("ascii").ljust(PXG_NAME_BYTES, b"\0") for name in channels)
+    frames = np.empty(len(values), dtype=pxg_frame_dtype(len(channels), has_ts))
+    if has_ts:
+        frames["timestamp"] = timestamps
+    frames["values"] = values
+    return header + names + frames.tobytes()
+
+class _LimitedReader:
+    """Wraps an UploadFile, counting bytes and rejecting the upload once it passes the limit."""
+    def __init__(self, file, max_bytes: int):
+        self.file = file
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    async def read(self, n: int) -> bytes:
+        data = await self.file.read(n)
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadRejected(413, f"File too large (limit {self.max_bytes // (1024 * 1024)} MB)")
+        return data
+
+async def _stream_csv(reader: _LimitedReader, open_writer):
+    parser = CsvChunkParser()
+    writer = None
+    while True:
+        data = await reader.read(settings.SENSOR_UPLOAD_READ_BYTES)
+        last = not data
+        block = parser.finish() if last else parser.feed(data)
+        if writer is None and parser.columns is not None:
+            writer = open_writer(parser.columns, None)
+        if block is not None and len(block):
+            await writer.append(block)
+        if last:
+            return writer
+
+async def _stream_pxg(reader: _LimitedReader, open_writer):
+    """
+    Header: magic "PXG1", uint16 version, uint16 channel count C, float32 sample
+    rate (Hz, 0 = unknown), uint32 flags (bit 0: frames carry a timestamp), then C
+    NUL-padded 32-byte ASCII channel names. Frames follow back to back, little-endian:
+    [float64 timestamp] + C x float32. Frames are decoded with np.frombuffer
+    straight from the bytes read, without per-sample objects.
+    """
+    header = await reader.read(PXG_HEADER.size)
+    if len(header) < PXG_HEADER.size:
+        raise UploadRejected(400, "Malformed PXG: truncated header")
+    magic, version, channel_count, sample_rate_hz, flags = PXG_HEADER.unpack(header)
+    if magic != PXG_MAGIC or version != PXG_VERSION:
+        raise UploadRejected(400, "Malformed PXG: unsupported magic or version")
+    if not 1 <= channel_count <= settings.SENSOR_UPLOAD_MAX_COLUMNS:
+        raise UploadRejected(400, f"Malformed PXG: channel count must be 1-{settings.SENSOR_UPLOAD_MAX_COLUMNS}")
+
+    raw_names = await reader.read(PXG_NAME_BYTES * channel_count)
+    if len(raw_names) < PXG_NAME_BYTES * channel_count:
+        raise UploadRejected(400, "Malformed PXG: truncated channel names")
+    try:
+        names = [
+            raw_names[i:i + PXG_NAME_BYTES].rstrip(b"\0").decode("ascii").strip()
+            for i in range(0, len(raw_names), PXG_NAME_BYTES)
+        ]
+    except UnicodeDecodeError:
+        raise UploadRejected(400, "Malformed PXG: channel names must be ASCII")
+    if not all(names) or len(set(names)) != len(names) or TIME_COLUMN in names:
+        raise UploadRejected(400, "Malformed PXG: channel names must be unique and non-empty")
+
+    has_ts = bool(flags & PXG_FLAG_TIMESTAMPS)
+    frame = pxg_frame_dtype(channel_count, has_ts)
+    writer = open_writer(([TIME_COLUMN] if has_ts else []) + names, sample_rate_hz or None)
+
+    # Read whole frames only, so every piece decodes in place
+    piece = max(1, settings.SENSOR_UPLOAD_READ_BYTES // frame.itemsize) * frame.itemsize
+    while True:
+        data = await reader.read(piece)
+        if not data:
+            return writer
+        if len(data) % frame.itemsize:
+            raise UploadRejected(400, "Malformed PXG: truncated final frame")
+        frames = np.frombuffer(memoryview(data), dtype=frame)
+        await writer.append_samples(frames["timestamp"] if has_ts else None, frames["values"])
+
+async def ingest_upload(db, file, patient_id: ObjectId, recorded_at: Optional[datetime] = None,
+                        sample_rate_hz: float = settings.SENSOR_DEFAULT_SAMPLE_RATE_HZ) -> dict:
+    """
+    Stream an UploadFile (.csv/.txt or .pxg) into `sensor_uploads` (metadata) +
+    `sensor_buckets` (samples). Raises UploadRejected for oversized or malformed
+    files; nothing is kept in that case.
+
+    A file this patient already uploaded (same SHA-256) is not stored again: the
+    original upload is returned with `duplicate: True`. Only a complete upload
+    counts. The same file still being ingested by another request is answered
+    409; one left "processing" for SENSOR_UPLOAD_STALE_SECONDS (a crashed
+    ingest) is deleted and this upload stored in its place.
+    """
+    max_bytes = settings.SENSOR_UPLOAD_MAX_BYTES
+    if file.size is not None and file.size > max_bytes:
+        raise UploadRejected(413, f"File too large (limit {max_bytes // (1024 * 1024)} MB)")
+    upload_format = "pxg" if file.filename.lower().endswith(".pxg") else "csv"
+
+    # The body is already spooled by Starlette, so hashing it first is a cheap
+    # sequential read and lets a retry return before anything is written
+    content_hash = await hash_upload(file)
+    existing = await _find_upload_by_hash(db, patient_id, content_hash)
+    if existing:
+        return existing
+
+    upload = SensorUpload(
+        patient_id=patient_id,
+        filename=file.filename,
+        format=upload_format,
+        content_hash=content_hash
+    ).model_dump(by_alias=True, exclude_none=True)
+    upload["patient_id"] = ObjectId(upload["patient_id"])
+    for attempt in range(2):
+        try:
+            result = await db["sensor_uploads"].insert_one(upload)
+            break
+        except DuplicateKeyError:
+            # A retry of the same file got in first: finished, in progress, or orphaned
+            existing = await _find_upload_by_hash(db, patient_id, content_hash)
+            if existing:
+                return existing
+            if attempt or not await _delete_stale_upload(db, patient_id, content_hash):
+                raise UploadRejected(409, "This file is already being processed; try again shortly")
+    upload_id = result.inserted_id
+
+    def open_writer(columns: List[str], file_sample_rate_hz: Optional[float]) -> SensorBucketWriter:
+        return SensorBucketWriter(
+            db, patient_id, upload_id, columns,
+            recording_start=recorded_at or upload["created_at"],
+            sample_rate_hz=file_sample_rate_hz or sample_rate_hz
+        )
+
+    reader = _LimitedReader(file, max_bytes)
+    try:
+        try:
+            if upload_format == "pxg":
+                writer = await _stream_pxg(reader, open_writer)
+            else:
+                writer = await _stream_csv(reader, open_writer)
+        except ValueError as e:
+            raise UploadRejected(400, f"Malformed recording: {e}")
+
+        await writer.close()
+        if writer.row_count == 0:
+            raise UploadRejected(400, "Upload contains a header but no samples")
+    except Exception:
+        await db["sensor_buckets"].delete_many({"upload_id": upload_id})
+        await db["sensor_uploads"].delete_one({"_id": upload_id})
+        raise
+
+    summary = {
+        **writer.upload_summary(),
+        "size_bytes": reader.size,
+        "status": "complete",
+        "completed_at": datetime.now(timezone.utc)
+    }
+    await db["sensor_uploads"].update_one({"_id": upload_id}, {"$set": summary})
+    logger.info(f"Ingested {upload_format} upload {upload_id}: {writer.row_count} rows in {writer.bucket_count} buckets")
+    return {"_id": upload_id, **summary, "duplicate": False}
+
+async def _find_upload_by_hash(db, patient_id: ObjectId, content_hash: str) -> Optional[dict]:
+    existing = await db["sensor_uploads"].find_one(
+        {"patient_id": ObjectId(patient_id), "content_hash": content_hash, "status": "complete"},
+        {"row_count": 1}
+    )
+    if not existing:
+        return None
+    logger.info(f"Duplicate upload for patient {patient_id}; returning upload {existing['_id']}")
+    return {"_id": existing["_id"], "row_count": existing.get("row_count", 0), "duplicate": True}
+
+async def _delete_stale_upload(db, patient_id: ObjectId, content_hash: str) -> bool:
+    """Delete an upload of this file orphaned in "processing", with its samples; False if there is none."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.SENSOR_UPLOAD_STALE_SECONDS)
+    stale = await db["sensor_uploads"].find_one_and_delete({
+        "patient_id": ObjectId(patient_id),
+        "content_hash": content_hash,
+        "status": "processing",
+        "created_at": {"$lt": cutoff}
+    })
+    if stale is None:
+        return False
+    await db["sensor_buckets"].delete_many({"upload_id": stale["_id"]})
+    logger.warning(f"Deleted upload {stale['_id']} left processing since {stale['created_at']}; storing the retry")
+    return True
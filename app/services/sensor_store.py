@@ -0,0 +1,320 @@
+"""
+Time-bucketed storage for raw sensor samples (`sensor_buckets`).
+
+Each document covers one patient, one fixed time window (SENSOR_BUCKET_SECONDS)
+and one recording. Samples are stored column-wise as packed little-endian arrays:
+`timestamps` holds float64 epoch seconds, `channels.<name>` float32 values. A
+per-channel min/max/count summary sits next to the arrays so coarse queries
+never have to decode them. Windows holding more than SENSOR_BUCKET_MAX_SAMPLES
+samples continue in another document with the next `seq`.
+"""
+from typing import List, NamedTuple, Optional
+from datetime import datetime, timezone
+import logging
+import math
+
+import numpy as np
+from bson import Binary, ObjectId
+
+from app.config import settings
+from app.models.database_models import SensorBucket
+
+logger = logging.getLogger(__name__)
+
+TIME_COLUMN = "timestamp"
+# `timestamp` values at or above this are absolute epoch seconds, smaller ones
+# are offsets from the start of the recording.
+EPOCH_THRESHOLD = 1e9
+
+class SensorFrame(NamedTuple):
+    timestamps: np.ndarray # float64 epoch seconds, shape (n,)
+    values: np.ndarray # float32, shape (n, len(channels)); NaN where a channel was not recorded
+    channels: List[str]
+
+def window_start(ts: float, bucket_seconds: int = settings.SENSOR_BUCKET_SECONDS) -> datetime:
+    return datetime.fromtimestamp(math.floor(ts / bucket_seconds) * bucket_seconds, tz=timezone.utc)
+
+class SensorBucketWriter:
+    """
+    Accepts (rows x columns) float64 blocks in recording order and writes them
+    into `sensor_buckets`. Raises ValueError for non-finite or decreasing timestamps.
+    """
+    def __init__(self, db, patient_id: ObjectId, upload_id: ObjectId, columns: List[str],
+                 recording_start: datetime, sample_rate_hz: float = settings.SENSOR_DEFAULT_SAMPLE_RATE_HZ,
+                 bucket_seconds: int = settings.SENSOR_BUCKET_SECONDS,
+                 max_samples: int = settings.SENSOR_BUCKET_MAX_SAMPLES):
+        self.db = db
+        self.patient_id = patient_id
+        self.upload_id = upload_id
+        self.origin = recording_start.replace(tzinfo=recording_start.tzinfo or timezone.utc).timestamp()
+        self.sample_rate_hz = sample_rate_hz
+        self.bucket_seconds = bucket_seconds
+        self.max_samples = max_samples
+
+        self._time_index = columns.index(TIME_COLUMN) if TIME_COLUMN in columns else None
+        self._channel_index = [i for i, c in enumerate(columns) if c != TIME_COLUMN]
+        self.channels = [columns[i] for i in self._channel_index]
+
+        self._t = np.empty(max_samples, dtype="<f8")
+        self._values = np.empty((max_samples, len(self.channels)), dtype="<f4")
+        self._filled = 0
+        self._window: Optional[int] = None
+        self._epoch_timestamps: Optional[bool] = None
+        self._last_t = -math.inf
+
+        self.row_count = 0
+        self.bucket_count = 0
+        self.t_min: Optional[float] = None
+        self.t_max: Optional[float] = None
+
+    def _absolute_times(self, raw: Optional[np.ndarray], n: int) -> np.ndarray:
+        if raw is None:
+            offsets = (self.row_count + self._filled + np.arange(n)) / self.sample_rate_hz
+            return self.origin + offsets
+
+        if not np.all(np.isfinite(raw)):
+            raise ValueError("timestamp column contains empty or non-numeric values")
+        if self._epoch_timestamps is None:
+            self._epoch_timestamps = bool(raw[0] >= EPOCH_THRESHOLD)
+        return raw if self._epoch_timestamps else self.origin + raw
+
+    async def append(self, block: np.ndarray) -> None:
+        """Append a (rows x columns) block laid out like the `columns` given at construction."""
+        raw_t = block[:, self._time_index] if self._time_index is not None else None
+        await self.append_samples(raw_t, block[:, self._channel_index])
+
+    async def append_samples(self, raw_t: Optional[np.ndarray], values: np.ndarray) -> None:
+        """
+        Append already-split data: `raw_t` as found in the timestamp column (or None)
+        and a (rows x channels) array. Views are fine; they are copied into the bucket buffer.
+        """
+        if not len(values):
+            return
+        t = self._absolute_times(raw_t, len(values))
+        if t[0] < self._last_t or np.any(np.diff(t) < 0):
+            raise ValueError("timestamps must be non-decreasing")
+        self._last_t = t[-1]
+
+        windows = np.floor(t / self.bucket_seconds).astype(np.int64)
+        boundaries = np.flatnonzero(np.diff(windows)) + 1
+        for start, stop in zip(np.r_[0, boundaries].tolist(), np.r_[boundaries, len(t)].tolist()):
+            window = int(windows[start])
+            if self._filled and window != self._window:
+                await self._flush()
+            self._window = window
+
+            offset = start
+            while offset < stop:
+                take = min(self.max_samples - self._filled, stop - offset)
+                self._t[self._filled:self._filled + take] = t[offset:offset + take]
+                self._values[self._filled:self._filled + take] = values[offset:offset + take]
+                self._filled += take
+                offset += take
+                if self._filled == self.max_samples:
+                    await self._flush()
+
+    async def close(self) -> None:
+        if self._filled:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        n = self._filled
+        t = self._t[:n]
+        values = self._values[:n]
+        counts = np.count_nonzero(~np.isnan(values), axis=0)
+        mins = np.fmin.reduce(values, axis=0)
+        maxs = np.fmax.reduce(values, axis=0)
+
+        bucket = SensorBucket(
+            patient_id=self.patient_id,
+            upload_id=self.upload_id,
+            bucket_start=window_start(t[0], self.bucket_seconds),
+            seq=self.bucket_count,
+            count=n,
+            t_min=float(t[0]),
+            t_max=float(t[-1]),
+            channel_names=self.channels,
+            summary={
+                ch: {
+                    "min": float(mins[i]) if counts[i] else None,
+                    "max": float(maxs[i]) if counts[i] else None,
+                    "count": int(counts[i])
+                }
+                for i, ch in enumerate(self.channels)
+            }
+        ).model_dump(by_alias=True, exclude_none=True)
+        bucket["patient_id"] = ObjectId(bucket["patient_id"])
+        bucket["upload_id"] = ObjectId(bucket["upload_id"])
+        bucket["timestamps"] = Binary(t.tobytes())
+        bucket["channels"] = {
+            ch: Binary(np.ascontiguousarray(values[:, i]).tobytes())
+            for i, ch in enumerate(self.channels)
+        }
+        await self.db["sensor_buckets"].insert_one(bucket)
+
+        self.t_min = bucket["t_min"] if self.t_min is None else self.t_min
+        self.t_max = bucket["t_max"]
+        self.row_count += n
+        self.bucket_count += 1
+        self._filled = 0
+
+    def upload_summary(self) -> dict:
+        """Fields to $set on the `sensor_uploads` document once the recording is fully written."""
+        return {
+            "columns": self.channels,
+            "row_count": self.row_count,
+            "bucket_count": self.bucket_count,
+            "start_time": datetime.fromtimestamp(self.t_min, tz=timezone.utc) if self.t_min is not None else None,
+            "end_time": datetime.fromtimestamp(self.t_max, tz=timezone.utc) if self.t_max is not None else None,
+            "sample_rate_hz": None if self._time_index is not None else self.sample_rate_hz
+        }
+
+async def read_sensor_range(
+    db,
+    patient_id: Optional[ObjectId] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    channels: Optional[List[str]] = None,
+    upload_id: Optional[ObjectId] = None
+) -> SensorFrame:
+    """
+    Return the samples in [start, end) as one contiguous (n x channels) float32 array.
+    Filter by patient, by recording (`upload_id`) or both. `channels` defaults to
+    every channel seen in the range.
+    """
+    if patient_id is None and upload_id is None:
+        raise ValueError("patient_id or upload_id is required")
+
+    query = {}
+    if patient_id is not None:
+        query["patient_id"] = patient_id
+    if upload_id is not None:
+        query["upload_id"] = upload_id
+    start_ts = start.timestamp() if start else -math.inf
+    end_ts = end.timestamp() if end else math.inf
+    if start:
+        query["bucket_start"] = {"$gte": window_start(start_ts)}
+        query["t_max"] = {"$gte": start_ts}
+    if end:
+        query.setdefault("bucket_start", {})["$lt"] = end
+        query["t_min"] = {"$lt": end_ts}
+    order = [("bucket_start", 1), ("t_min", 1)]
+
+    # Pass 1: sizes and channel names only, to allocate the output once
+    metas = await db["sensor_buckets"].find(query, {"count": 1, "channel_names": 1}).sort(order).to_list(None)
+    if channels is None:
+        channels = list(dict.fromkeys(ch for m in metas for ch in m["channel_names"]))
+    total = sum(m["count"] for m in metas)
+
+    timestamps = np.empty(total, dtype="<f8")
+    values = np.full((total, len(channels)), np.nan, dtype="<f4")
+    if not metas:
+        return SensorFrame(timestamps, values, channels)
+
+    # Pass 2: copy each bucket's arrays straight into place
+    projection = {"timestamps": 1, **{f"channels.{ch}": 1 for ch in channels}}
+    cursor = db["sensor_buckets"].find({"_id": {"$in": [m["_id"] for m in metas]}}, projection).sort(order)
+    filled = 0
+    async for bucket in cursor:
+        t = np.frombuffer(bucket["timestamps"], dtype="<f8")
+        lo = int(np.searchsorted(t, start_ts, side="left"))
+        hi = int(np.searchsorted(t, end_ts, side="left"))
+        n = hi - lo
+        if n <= 0:
+            continue
+        timestamps[filled:filled + n] = t[lo:hi]
+        stored = bucket.get("channels", {})
+        for j, ch in enumerate(channels):
+            if ch in stored:
+                values[filled:filled + n, j] = np.frombuffer(stored[ch], dtype="<f4")[lo:hi]
+        filled += n
+
+    timestamps, values = timestamps[:filled], values[:filled]
+    if filled > 1 and np.any(np.diff(timestamps) < 0):
+        # Overlapping recordings: merge them into one time-ordered frame
+        order_idx = np.argsort(timestamps, kind="stable")
+        timestamps, values = timestamps[order_idx], values[order_idx]
+    return SensorFrame(timestamps, values, channels)
+
+# ─── Migration of pre-bucket sensor_uploads ───────────────────
+
+def _legacy_value(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return math.nan
+
+def _legacy_rows_to_block(rows: List[dict]):
+    columns = list(dict.fromkeys(k.strip() for row in rows for k in row if k and k.strip()))
+    block = np.full((len(rows), len(columns)), np.nan, dtype=np.float64)
+    for i, row in enumerate(rows):
+        for j, col in enumerate(columns):
+            if col in row:
+                block[i, j] = _legacy_value(row[col])
+    return columns, block
+
+async def _migrate_one(db, upload: dict) -> int:
+    upload_id = upload["_id"]
+    start = upload.get("created_at") or upload_id.generation_time
+
+    if "sensor_data" in upload:
+        # Original layout: list of {column: str} dicts on the upload document
+        columns, block = _legacy_rows_to_block(upload.get("sensor_data") or [])
+        blocks = [block]
+    else:
+        # Streaming layout: float arrays in sensor_upload_chunks
+        columns = upload.get("columns", [])
+        blocks = []
+        async for chunk in db["sensor_upload_chunks"].find({"upload_id": upload_id}).sort("seq", 1):
+            arrays = [np.frombuffer(chunk["data"][c], dtype="<f8" if c == TIME_COLUMN else "<f4") for c in columns]
+            blocks.append(np.column_stack(arrays).astype(np.float64) if arrays else np.empty((0, 0)))
+
+    # Start from a clean slate so an interrupted migration can simply be re-run
+    await db["sensor_buckets"].delete_many({"upload_id": upload_id})
+    writer = SensorBucketWriter(db, upload["patient_id"], upload_id, columns, start)
+    if TIME_COLUMN in columns:
+        # Legacy timestamps were free text and were never checked for order, even
+        # across chunks: sort the whole recording and drop rows that cannot be placed in time
+        t = columns.index(TIME_COLUMN)
+        block = np.concatenate(blocks) if blocks else np.empty((0, len(columns)))
+        block = block[np.isfinite(block[:, t])]
+        blocks = [block[np.argsort(block[:, t], kind="stable")]]
+    for block in blocks:
+        await writer.append(block)
+    await writer.close()
+
+    await db["sensor_uploads"].update_one(
+        {"_id": upload_id},
+        {
+            "$set": {**writer.upload_summary(), "status": "complete"},
+            "$unset": {"sensor_data": "", "chunk_count": ""}
+        }
+    )
+    await db["sensor_upload_chunks"].delete_many({"upload_id": upload_id})
+    return writer.row_count
+
+async def migrate_legacy_uploads(db) -> dict:
+    """
+    Move every `sensor_uploads` document that still carries inline `sensor_data`
+    (or `sensor_upload_chunks` from the first streaming version) into `sensor_buckets`.
+    Safe to re-run. An upload that cannot be converted is logged and left in its
+    legacy layout; the others are still migrated.
+    """
+    legacy = {"$or": [{"sensor_data": {"$exists": True}}, {"chunk_count": {"$exists": True}}]}
+    migrated, samples, skipped = 0, 0, 0
+    async for upload in db["sensor_uploads"].find(legacy, {"_id": 1}):
+        doc = await db["sensor_uploads"].find_one({"_id": upload["_id"]})
+        try:
+            samples += await _migrate_one(db, doc)
+        except ValueError as e:
+            await db["sensor_buckets"].delete_many({"upload_id": upload["_id"]})
+            skipped += 1
+            logger.error(f"Skipped sensor upload {upload['_id']}: {e}")
+            continue
+        migrated += 1
+        logger.info(f"Migrated sensor upload {upload['_id']}")
+    return {"uploads": migrated, "samples": samples, "skipped": skipped}
@@ -0,0 +1,125 @@
+"""
+Single-flight execution: concurrent callers asking for the same key share one
+computation instead of each running their own.
+
+- Within a worker, the first caller starts the computation as a task and
+  registers it in a map; later callers await the same task. A caller that
+  goes away (client disconnect) does not cancel it for the others.
+- Across workers, the task first takes a lease document in `flight_leases`
+  (insert with the key as `_id`). The worker holding the lease computes, renews
+  the lease while it works, and stores the result in the document. Other
+  workers poll the document and return that stored result. If the holder dies,
+  its lease expires and a waiting worker takes over.
+
+Results must be BSON-serializable. A finished result stays readable for
+SINGLE_FLIGHT_RESULT_SECONDS, so requests that arrive just after the
+computation finished reuse it too. Documents are removed by a TTL index on
+`expires_at`. The TTL monitor only runs about once a minute, so a finished
+document found past its `expires_at` is deleted and the key computed again.
+"""
+from typing import Any, Awaitable, Callable, Dict
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+def _aware(at: datetime) -> datetime:
+    # Motor returns naive UTC datetimes unless the client is tz_aware
+    return at if at.tzinfo is not None else at.replace(tzinfo=timezone.utc)
+
+class SingleFlight:
+    def __init__(self, lease_s: float = settings.SINGLE_FLIGHT_LEASE_SECONDS,
+                 poll_s: float = settings.SINGLE_FLIGHT_POLL_SECONDS,
+                 result_s: float = settings.SINGLE_FLIGHT_RESULT_SECONDS):
+        self.lease_s = lease_s
+        self.poll_s = poll_s
+        self.result_s = result_s
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def run(self, db, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """fn()'s result, computed once for all concurrent callers with this key."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run_across_workers(db, key, fn))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _run_across_workers(self, db, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        leases = db["flight_leases"]
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        while True:
+            now = datetime.now(timezone.utc)
+            lease = {
+                "owner": owner,
+                "status": "running",
+                "lease_until": now + timedelta(seconds=self.lease_s),
+                "expires_at": now + timedelta(seconds=self.lease_s + self.result_s),
+            }
+            try:
+                await leases.insert_one({"_id": key, **lease})
+                break
+            except DuplicateKeyError:
+                pass
+
+            doc = await leases.find_one({"_id": key})
+            if doc is None:
+                continue # Finished or abandoned in between: try again
+            if doc["status"] == "done":
+                if _aware(doc["expires_at"]) >= now:
+                    return doc["result"]
+                # Past its reuse window but not yet reaped by the TTL monitor
+                await leases.delete_one({"_id": key, "status": "done", "expires_at": doc["expires_at"]})
+                continue
+            if _aware(doc["lease_until"]) < now:
+                # The holder died: take its lease over
+                taken = await leases.find_one_and_update(
+                    {"_id": key, "owner": doc["owner"], "status": "running"},
+                    {"$set": lease},
+                    return_document=ReturnDocument.AFTER
+                )
+                if taken is not None:
+                    logger.warning(f"Took over expired single-flight lease {key} from {doc['owner']}")
+                    break
+            await asyncio.sleep(self.poll_s)
+
+        heartbeat = asyncio.create_task(self._renew(leases, key, owner))
+        try:
+            result = await fn()
+        except BaseException:
+            heartbeat.cancel()
+            await leases.delete_one({"_id": key, "owner": owner})
+            raise
+        heartbeat.cancel()
+        await leases.update_one(
+            {"_id": key, "owner": owner},
+            {"$set": {
+                "status": "done",
+                "result": result,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.result_s)
+            }, "$unset": {"lease_until": ""}}
+        )
+        return result
+
+    async def _renew(self, leases, key: str, owner: str):
+        while True:
+            await asyncio.sleep(self.lease_s / 3)
+            now = datetime.now(timezone.utc)
+            await leases.update_one(
+                {"_id": key, "owner": owner, "status": "running"},
+                {"$set": {
+                    "lease_until": now + timedelta(seconds=self.lease_s),
+                    "expires_at": now + timedelta(seconds=self.lease_s + self.result_s)
+                }}
+            )
+
+flights = SingleFlight()
@@ -0,0 +1,182 @@
+"""
+Cache for the Gemini clinical summaries used in reports.
+
+Entries are keyed by a hash of what the prompt actually shows the model: the
+metric averages, rounded to the precision the prompt prints them with, their
+window, and the profile fields in the prompt. The same inputs therefore never cost a second
+Gemini call, whatever day they are requested on.
+
+Two tiers: a per-worker LRU (app.core.cache.TTLCache) in front of the
+`ai_summaries` collection, which every worker shares and which survives
+restarts. Mongo removes entries SUMMARY_CACHE_STALE_SECONDS after they were
+written (TTL index on `expires_at`).
+
+Stale-while-revalidate:
+- fresh entry (younger than SUMMARY_CACHE_TTL_SECONDS): returned as is;
+- stale entry, or no entry for these exact inputs but a recent one for the
+  patient whose averages all lie within SUMMARY_CACHE_MATERIAL_CHANGE of the
+  current ones: returned immediately while a background task regenerates the
+  summary for the current inputs;
+- otherwise the caller waits for Gemini. If that fails, any cached summary for
+  the patient is served rather than an error.
+
+Generation runs through services/single_flight.py, so concurrent misses or
+refreshes of one key make one Gemini call and one write between all workers.
+
+The nightly job in services/narrative_precompute.py fills the cache ahead of
+time (store_summary), so most downloads find a fresh entry.
+"""
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+from datetime import datetime, timedelta, timezone
+import asyncio
+import hashlib
+import json
+import logging
+
+from bson import ObjectId
+
+from app.config import settings
+from app.core.cache import TTLCache
+from app.services.single_flight import flights
+
+logger = logging.getLogger(__name__)
+
+# Bump when the prompt template changes, so old summaries are not reused
+PROMPT_VERSION = 1
+
+_local = TTLCache(maxsize=settings.SUMMARY_CACHE_LOCAL_SIZE, ttl=settings.SUMMARY_CACHE_TTL_SECONDS)
+_background: Set[asyncio.Task] = set()
+
+def summary_key(inputs: Dict[str, Any]) -> str:
+    """Fingerprint of the (already rounded) prompt inputs."""
+    canonical = json.dumps({"v": PROMPT_VERSION, **inputs}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def _aware(value: datetime) -> datetime:
+    # Mongo hands datetimes back naive (UTC)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def _is_fresh(entry: Dict[str, Any]) -> bool:
+    return _aware(entry["fresh_until"]) > datetime.now(timezone.utc)
+
+def _close_enough(cached: Dict[str, Any], current: Dict[str, Any]) -> bool:
+    """Same profile fields and every average within the material-change tolerance."""
+    tolerance = settings.SUMMARY_CACHE_MATERIAL_CHANGE
+    if cached.get("profile") != current.get("profile") or cached.get("window_days") != current.get("window_days"):
+        return False
+    before, now = cached.get("averages", {}), current.get("averages", {})
+    if before.keys() != now.keys():
+        return False
+    for name, value in now.items():
+        old = before[name]
+        if value is None or old is None:
+            if value is not old:
+                return False
+            continue
+        if abs(value - old) > tolerance * max(abs(old), abs(value), 1e-9):
+            return False
+    return True
+
+async def _lookup(db, key: str) -> Optional[Dict[str, Any]]:
+    entry = _local.get(key)
+    if entry is not None and _is_fresh(entry):
+        return entry
+    # Not here or stale here: another worker may have refreshed it already
+    entry = await db["ai_summaries"].find_one({"_id": key})
+    if entry is not None:
+        _local.set(key, entry)
+    return entry
+
+async def _latest_for_patient(db, patient_id: ObjectId) -> Optional[Dict[str, Any]]:
+    return await db["ai_summaries"].find_one({"patient_id": patient_id}, sort=[("created_at", -1)])
+
+async def _store(db, key: str, patient_id: ObjectId, inputs: Dict[str, Any], text: str) -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    entry = {
+        "patient_id": patient_id,
+        "inputs": inputs,
+        "text": text,
+        "prompt_version": PROMPT_VERSION,
+        "created_at": now,
+        "fresh_until": now + timedelta(seconds=settings.SUMMARY_CACHE_TTL_SECONDS),
+        "expires_at": now + timedelta(seconds=settings.SUMMARY_CACHE_STALE_SECONDS),
+    }
+    await db["ai_summaries"].update_one({"_id": key}, {"$set": entry}, upsert=True)
+    entry["_id"] = key
+    _local.set(key, entry)
+    return entry
+
+async def store_summary(db, patient_id: ObjectId, inputs: Dict[str, Any], text: str) -> str:
+    """Cache `text` as the summary for `inputs`, generated elsewhere. Returns its key."""
+    key = summary_key(inputs)
+    await _store(db, key, ObjectId(patient_id), inputs, text)
+    return key
+
+async def fresh_keys(db, keys: Iterable[str]) -> Set[str]:
+    """Those of `keys` with a fresh summary cached."""
+    cursor = db["ai_summaries"].find(
+        {"_id": {"$in": list(keys)}, "fresh_until": {"$gt": datetime.now(timezone.utc)}}, {"_id": 1}
+    )
+    return {entry["_id"] async for entry in cursor}
+
+async def last_summary_times(db, patient_ids: Iterable[ObjectId]) -> Dict[ObjectId, datetime]:
+    """When each patient's most recent summary was written (patients without one are left out)."""
+    cursor = db["ai_summaries"].aggregate([
+        {"$match": {"patient_id": {"$in": list(patient_ids)}}},
+        {"$group": {"_id": "$patient_id", "created_at": {"$max": "$created_at"}}},
+    ])
+    return {row["_id"]: _aware(row["created_at"]) async for row in cursor}
+
+async def _generate(db, key: str, patient_id: ObjectId, inputs: Dict[str, Any],
+                    generate: Callable[[], Awaitable[str]]) -> str:
+    """One Gemini call and one write per key, however many requests or workers need it."""
+    async def generate_and_store() -> str:
+        text = await generate()
+        await _store(db, key, patient_id, inputs, text)
+        return text
+    return await flights.run(db, f"ai_summary:{key}", generate_and_store)
+
+def _refresh_in_background(db, key: str, patient_id: ObjectId, inputs: Dict[str, Any],
+                           generate: Callable[[], Awaitable[str]]):
+    async def refresh():
+        try:
+            await _generate(db, key, patient_id, inputs, generate)
+            logger.info(f"Refreshed cached AI summary {key[:12]} for patient {patient_id}")
+        except Exception as e:
+            logger.warning(f"Background AI summary refresh failed for patient {patient_id}: {e}")
+
+    task = asyncio.create_task(refresh())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+async def cached_summary(db, patient_id: ObjectId, inputs: Dict[str, Any],
+                         generate: Callable[[], Awaitable[str]]) -> Tuple[str, str]:
+    """
+    The summary for `inputs` ({"averages": {...}, "profile": {...},
+    "window_days": n}, rounded as the prompt shows them) as (text, status); status is "fresh", "stale",
+    "similar" or "generated". `generate` produces a new summary and raises on
+    failure; a failure is only raised when nothing is cached for the patient.
+    """
+    patient_id = ObjectId(patient_id)
+    key = summary_key(inputs)
+
+    entry = await _lookup(db, key)
+    if entry is not None:
+        if _is_fresh(entry):
+            return entry["text"], "fresh"
+        _refresh_in_background(db, key, patient_id, inputs, generate)
+        return entry["text"], "stale"
+
+    latest = await _latest_for_patient(db, patient_id)
+    if latest is not None and _close_enough(latest["inputs"], inputs):
+        _refresh_in_background(db, key, patient_id, inputs, generate)
+        return latest["text"], "similar"
+
+    try:
+        text = await _generate(db, key, patient_id, inputs, generate)
+    except Exception:
+        if latest is not None:
+            logger.warning(f"AI summary generation failed for patient {patient_id}; serving the last cached one")
+            return latest["text"], "stale"
+        raise
+    return text, "generated"
@@ -0,0 +1,24 @@
+"""
+Gunicorn settings for multi-worker deployments:
+
+    gunicorn app.main:app -c gunicorn.conf.py
+
+With PRELOAD_HEAVY_MODULES=true the app is imported in the master, the heavy
+modules and models are warmed there (app/core/preload.py), and workers are
+forked from it, sharing those pages copy-on-write.
+"""
+import os
+
+from app.config import settings
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = settings.PRELOAD_HEAVY_MODULES
+
+def when_ready(server):
+    # Runs in the master after the app is loaded, before the first fork
+    if settings.PRELOAD_HEAVY_MODULES:
+        from app.core.preload import freeze, warm
+        warm()
+        freeze()
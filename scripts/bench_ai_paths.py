@@ -0,0 +1,123 @@
+"""
+Report and chat throughput through the shared AI client, against the local
+stand-in backend: no network, no API key, no Gemini quota spent.
+
+    python scripts/bench_ai_paths.py [--reports 40] [--chats 40] [--rpm 600] [--concurrency 8]
+                                     [--latency lognormal:800:0.4] [--chunk-latency uniform:20:60]
+                                     [--rate-429 0.05] [--rate-500 0.02] [--seed 0]
+
+Runs every report call (gemini.generate, as analysis_engine does) and every
+chat call (gemini.stream, as POST /chat/message/stream does) at once, so
+they compete for the same rate limit and concurrency slots. Reports
+throughput, latency and time-to-first-chunk percentiles, and how the client
+coped with injected 429s and 500s: retries, calls that ran out of deadline,
+and the circuit breaker state. Any GEMINI_* setting can be overridden in the
+environment (e.g. GEMINI_DEADLINE_SECONDS=5).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from contextlib import aclosing
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+REPORT_PROMPT = (
+    "Act as a prosthetic rehabilitation biomechanics specialist. Summarise patient {n}'s week: "
+    "step length 61 cm, cadence 98 spm, walking speed 0.9 m/s, symmetry index 0.8{m}."
+)
+CHAT_PROMPT = "How is my gait symmetry this week? ({n})"
+
+def percentile(samples: list, p: float) -> str:
+    if not samples:
+        return "-"
+    ordered = sorted(samples)
+    return f"{ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000:.0f}"
+
+def fail(out: dict, e: Exception):
+    reason = getattr(e, "reason", type(e).__name__) # GeminiUnavailable: rate_limited, quota, timeout, ...
+    out["failed"][reason] = out["failed"].get(reason, 0) + 1
+
+async def report_call(gemini, n: int, out: dict):
+    start = time.perf_counter()
+    try:
+        await gemini.generate(REPORT_PROMPT.format(n=n, m=n % 10))
+        out["ok"].append(time.perf_counter() - start)
+    except Exception as e:
+        fail(out, e)
+
+async def chat_call(gemini, n: int, out: dict):
+    start = time.perf_counter()
+    first = None
+    try:
+        async with aclosing(gemini.stream(CHAT_PROMPT.format(n=n), system_instruction="You are a clinical assistant.")) as chunks:
+            async for _ in chunks:
+                if first is None:
+                    first = time.perf_counter() - start
+        out["ok"].append(time.perf_counter() - start)
+        out["first"].append(first)
+    except Exception as e:
+        fail(out, e)
+
+def show(label: str, out: dict, elapsed: float):
+    print(
+        f"{label:<7} {len(out['ok']):4d} ok  {len(out['ok']) / elapsed:6.2f}/s   "
+        f"total p50 {percentile(out['ok'], 0.5):>6} p95 {percentile(out['ok'], 0.95):>6} ms   "
+        + (f"first chunk p50 {percentile(out['first'], 0.5):>5} p95 {percentile(out['first'], 0.95):>5} ms   " if "first" in out else "")
+        + f"failed {out['failed'] or 0}"
+    )
+
+async def run(args):
+    from app.services.gemini_service import gemini
+
+    reports = {"ok": [], "failed": {}}
+    chats = {"ok": [], "first": [], "failed": {}}
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(report_call(gemini, n, reports) for n in range(args.reports)),
+        *(chat_call(gemini, n, chats) for n in range(args.chats)),
+    )
+    elapsed = time.perf_counter() - start
+
+    metrics = gemini.metrics()
+    print(f"{args.reports} report + {args.chats} chat calls in {elapsed:.2f} s "
+          f"(backend {metrics['backend']}, {args.rpm:g}/min, {args.concurrency} concurrent)")
+    show("reports", reports, elapsed)
+    show("chats", chats, elapsed)
+    counts = metrics["counts"]
+    print(f"retries {counts.get('retries', 0)}   errors quota {counts.get('errors_quota', 0)} "
+          f"transient {counts.get('errors_transient', 0)}   rejected breaker {counts.get('rejected_breaker_open', 0)} "
+          f"rate {counts.get('rejected_rate_limited', 0)}   breaker {metrics['breaker']}")
+    print(f"stand-in: {metrics.get('backend_counts')}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=40)
+    parser.add_argument("--chats", type=int, default=40)
+    parser.add_argument("--rpm", type=float, default=600, help="GEMINI_REQUESTS_PER_MINUTE")
+    parser.add_argument("--concurrency", type=int, default=8, help="GEMINI_MAX_CONCURRENCY")
+    parser.add_argument("--latency", default="lognormal:800:0.4", help="time to the first token, ms")
+    parser.add_argument("--chunk-latency", default="uniform:20:60", help="between streamed chunks, ms")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Read by app.config when the client is imported
+    os.environ.update({
+        "AI_BACKEND": "standin",
+        "AI_STANDIN_LATENCY": args.latency,
+        "AI_STANDIN_CHUNK_LATENCY": args.chunk_latency,
+        "AI_STANDIN_429_RATE": str(args.rate_429),
+        "AI_STANDIN_500_RATE": str(args.rate_500),
+        "AI_STANDIN_SEED": str(args.seed),
+        "GEMINI_REQUESTS_PER_MINUTE": str(args.rpm),
+        "GEMINI_MAX_CONCURRENCY": str(args.concurrency),
+    })
+    os.environ.setdefault("GEMINI_BURST", str(args.concurrency))
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Equivalence check and benchmark for AIEngine batch scoring.
+
+    python scripts/bench_batch_scoring.py [rows]
+
+1. Checks score_columns / score_records / score_batch and the scalar methods
+   (analyze_gait, analyze_skin_risk, calculate_prosthetic_health_score,
+   determine_overall_risk) against a frozen copy of the original scalar rules
+   (the `frozen_*` functions below, SCORING_VERSION 1), on random rows, rows
+   sitting exactly on every rule threshold, rows with missing metrics and
+   per-row profiles, and scores on .xx5 rounding boundaries. Every path now
+   runs services/clinical_rules.py, so the frozen copy is what catches a
+   regression there. Exits non-zero on the first mismatch.
+
+   A deliberate rule change bumps ai_engine.SCORING_VERSION; the script then
+   refuses to run until the frozen copy is updated to match.
+2. Times whole-population scoring of `rows` (default 1,000,000) columnar rows
+   against the scalar loop, which is timed on a sample and extrapolated.
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.ai_engine import ai_engine, METRIC_FIELDS, PROFILE_FIELDS, SCORING_VERSION
+
+OUTPUTS = ("gait_abnormality", "skin_risk", "prosthetic_health_score", "overall_risk")
+
+# Every threshold used by the rules, so edge rows land exactly on them
+THRESHOLDS = {
+    "gait_symmetry_index": [0.75, 0.8, 1.0],
+    "walking_speed_mps": [0.7, 1.0],
+    "step_length_cm": [30, 50],
+    "cadence_spm": [70, 100],
+    "pressure_distribution_index": [0.6, 0.8, 1.0],
+    "skin_temperature_c": [34, 30],
+    "skin_moisture": [70, 50],
+    "daily_wear_hours": [12, 8],
+    "bmi": [30, 22],
+    "blood_pressure_systolic": [140, 120],
+    "blood_sugar_mg_dl": [180, 90],
+}
+
+def random_columns(n: int, seed: int = 11) -> dict:
+    rng = np.random.default_rng(seed)
+    return {
+        "step_length_cm": rng.uniform(20, 80, n),
+        "cadence_spm": rng.uniform(50, 130, n),
+        "walking_speed_mps": rng.uniform(0.3, 1.6, n),
+        "gait_symmetry_index": rng.uniform(0.5, 1.0, n),
+        "skin_temperature_c": rng.uniform(28, 38, n),
+        "skin_moisture": rng.uniform(30, 95, n),
+        "pressure_distribution_index": rng.uniform(0.3, 1.0, n),
+        "daily_wear_hours": rng.uniform(2, 16, n),
+        "bmi": rng.uniform(18, 38, n),
+        "blood_pressure_systolic": rng.integers(100, 170, n).astype(float),
+        "blood_sugar_mg_dl": rng.integers(70, 250, n).astype(float),
+    }
+
+def to_records(columns: dict, n: int) -> list:
+    records = []
+    for i in range(n):
+        record = {key: float(columns[key][i]) for key in METRIC_FIELDS}
+        record["profile"] = {key: float(columns[key][i]) for key in PROFILE_FIELDS}
+        records.append(record)
+    return records
+
+def edge_records(seed: int = 5) -> list:
+    rng = np.random.default_rng(seed)
+    records = []
+    for _ in range(5000):
+        record, profile = {}, {}
+        for key, values in THRESHOLDS.items():
+            if rng.random() < 0.2:
+                continue # missing: the scalar default applies
+            target = profile if key in PROFILE_FIELDS else record
+            target[key] = values[rng.integers(len(values))]
+        if rng.random() < 0.8:
+            record["profile"] = profile
+        records.append(record)
+    # Scores landing on a .xx5 boundary, where np.round and round() can disagree
+    for symmetry in np.arange(0.9, 1.0, 0.000125):
+        records.append({"gait_symmetry_index": float(symmetry)})
+    return records
+
+# ─── The scalar rules as first written (SCORING_VERSION 1); do not refactor ───
+
+FROZEN_VERSION = 1
+
+def frozen_gait(metrics: dict) -> str:
+    symmetry = metrics.get("gait_symmetry_index", 1.0)
+    speed = metrics.get("walking_speed_mps", 1.0)
+    step = metrics.get("step_length_cm", 50)
+    cadence = metrics.get("cadence_spm", 100)
+    pressure = metrics.get("pressure_distribution_index", 1.0)
+
+    if symmetry < 0.75 or speed < 0.7 or step < 30 or cadence < 70 or pressure < 0.6:
+        return "Abnormal"
+    return "Normal"
+
+def frozen_skin_risk(metrics: dict) -> str:
+    temp = metrics.get("skin_temperature_c", 30)
+    moisture = metrics.get("skin_moisture", 50)
+    wear = metrics.get("daily_wear_hours", 8)
+
+    risk_score = 0
+    if temp > 34: risk_score += 1
+    if moisture > 70: risk_score += 1
+    if wear > 12: risk_score += 1
+
+    if risk_score <= 1: return "Low"
+    if risk_score == 2: return "Medium"
+    return "High"
+
+def frozen_health_score(metrics: dict) -> float:
+    symmetry = metrics.get("gait_symmetry_index", 1.0)
+    pressure = metrics.get("pressure_distribution_index", 1.0)
+    speed = metrics.get("walking_speed_mps", 0.7)
+    moisture = metrics.get("skin_moisture", 70)
+
+    profile = metrics.get("profile", {})
+    bmi = profile.get("bmi", 22)
+    bp_sys = profile.get("blood_pressure_systolic", 120)
+    sugar = profile.get("blood_sugar_mg_dl", 90)
+
+    score = 100
+    score -= (1 - symmetry) * 40
+    score -= max(0, 0.8 - pressure) * 30
+    score -= max(0, 0.7 - speed) * 25
+    score -= max(0, moisture - 70) * 0.5
+
+    if bmi > 30:
+        score -= 10
+    if bp_sys > 140:
+        score -= 10
+    if sugar > 180:
+        score -= 15
+
+    return round(min(max(float(score), 0.0), 100.0), 2)
+
+def frozen_overall_risk(metrics: dict) -> str:
+    gait = frozen_gait(metrics)
+    skin = frozen_skin_risk(metrics)
+    pressure = metrics.get("pressure_distribution_index", 1.0)
+
+    profile = metrics.get("profile", {})
+    bmi = profile.get("bmi", 22)
+    bp_sys = profile.get("blood_pressure_systolic", 120)
+    sugar = profile.get("blood_sugar_mg_dl", 90)
+
+    risk_points = 0
+    if gait == "Abnormal": risk_points += 2
+    if skin == "High": risk_points += 2
+    elif skin == "Medium": risk_points += 1
+    if pressure < 0.6: risk_points += 2
+
+    if bmi > 30: risk_points += 1
+    if bp_sys > 140 or sugar > 180: risk_points += 1
+
+    if risk_points >= 4: return "High"
+    if risk_points >= 2: return "Moderate"
+    return "Low"
+
+def frozen(record: dict) -> tuple:
+    return (frozen_gait(record), frozen_skin_risk(record), frozen_health_score(record), frozen_overall_risk(record))
+
+def scalar(record: dict) -> tuple:
+    return (
+        ai_engine.analyze_gait(record),
+        ai_engine.analyze_skin_risk(record),
+        ai_engine.calculate_prosthetic_health_score(record),
+        ai_engine.determine_overall_risk(record),
+    )
+
+def check(name: str, records: list, batch: dict):
+    for i, record in enumerate(records):
+        expected = frozen(record)
+        got = tuple(batch[key][i] for key in OUTPUTS)
+        if expected != got:
+            sys.exit(f"MISMATCH in {name} at row {i}: {record}\n  frozen {expected}\n  got    {got}")
+    print(f"  {name}: {len(records):,} rows identical")
+
+def scalar_columns(records: list) -> dict:
+    """The scalar methods' results laid out like a batch result."""
+    rows = [scalar(record) for record in records]
+    return {key: [row[k] for row in rows] for k, key in enumerate(OUTPUTS)}
+
+def main(rows: int):
+    if SCORING_VERSION != FROZEN_VERSION:
+        sys.exit(f"SCORING_VERSION is {SCORING_VERSION}, the frozen rules are version {FROZEN_VERSION}: "
+                 "update the frozen_* functions to the new rules first")
+
+    print(f"Equivalence with the frozen version {FROZEN_VERSION} rules")
+    columns = random_columns(100_000)
+    records = to_records(columns, 100_000)
+    check("scalar methods (random)", records, scalar_columns(records))
+    check("score_columns (random)", records, ai_engine.score_columns(columns))
+    check("score_records (random)", records, ai_engine.score_records(records))
+    edges = edge_records()
+    check("scalar methods (thresholds, missing fields)", edges, scalar_columns(edges))
+    check("score_records (thresholds, missing fields)", edges, ai_engine.score_records(edges))
+
+    profile = {"bmi": 31, "blood_pressure_systolic": 150, "blood_sugar_mg_dl": 90}
+    plain = [{key: value for key, value in r.items() if key != "profile"} for r in records[:10_000]]
+    batch = ai_engine.score_batch(plain, profile)
+    check("score_batch (shared profile)", [{**r, "profile": profile} for r in plain], batch)
+
+    print(f"\nThroughput ({rows:,} rows)")
+    columns = random_columns(rows)
+    start = time.perf_counter()
+    ai_engine.score_columns(columns)
+    vector_s = time.perf_counter() - start
+
+    sample = to_records(columns, min(rows, 100_000))
+    start = time.perf_counter()
+    for record in sample:
+        scalar(record)
+    scalar_s = (time.perf_counter() - start) * rows / len(sample)
+
+    print(f"  score_columns:  {vector_s * 1000:8.1f} ms  ({rows / vector_s / 1e6:.1f} M rows/s)")
+    print(f"  scalar methods: {scalar_s * 1000:8.1f} ms  (extrapolated from {len(sample):,} rows)")
+    print(f"  speed-up:       {scalar_s / vector_s:8.1f}x")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
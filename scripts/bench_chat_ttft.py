@@ -0,0 +1,92 @@
+"""
+Time-to-first-token of chat answers: POST /chat/message (the answer arrives
+all at once) against POST /chat/message/stream (Server-Sent Events).
+
+    python scripts/bench_chat_ttft.py --header "Authorization: Bearer <patient token>"
+                                      [--base-url http://127.0.0.1:8000] [--runs 5]
+                                      [--message "How is my gait symmetry?"] [--pause 4]
+
+Runs the two endpoints alternately, so both see the same API conditions. For
+the plain endpoint, the first token arrives with the full response. For the
+stream, it arrives with the first `chunk` event, and the answer is complete
+at the `done` event. Every run is a real exchange: it costs a Gemini call and
+is saved to the patient's chat history. Keep --runs times two within the
+Gemini request quota (GEMINI_REQUESTS_PER_MINUTE), or widen --pause.
+"""
+import argparse
+import json
+import statistics
+import time
+import urllib.request
+
+def post(url: str, headers: dict, message: str):
+    body = json.dumps({"message": message}).encode()
+    req = urllib.request.Request(url, data=body, method="POST",
+                                 headers={**headers, "Content-Type": "application/json"})
+    return urllib.request.urlopen(req, timeout=120)
+
+def plain(args, headers: dict) -> dict:
+    start = time.perf_counter()
+    with post(f"{args.base_url}/chat/message", headers, args.message) as response:
+        answer = json.loads(response.read())["message"]
+    total = (time.perf_counter() - start) * 1000
+    return {"first_ms": total, "total_ms": total, "chars": len(answer)}
+
+def streamed(args, headers: dict) -> dict:
+    start = time.perf_counter()
+    first = None
+    chunks = 0
+    answer = ""
+    event = None
+    with post(f"{args.base_url}/chat/message/stream", headers, args.message) as response:
+        for raw in response:
+            line = raw.decode().rstrip("\r\n")
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                if event == "chunk":
+                    chunks += 1
+                    if first is None:
+                        first = (time.perf_counter() - start) * 1000
+                elif event == "done":
+                    answer = json.loads(line[len("data: "):])["message"]
+    total = (time.perf_counter() - start) * 1000
+    return {"first_ms": first if first is not None else total, "total_ms": total,
+            "chars": len(answer), "chunks": chunks}
+
+def summary(name: str, runs: list):
+    def stats(key: str) -> str:
+        values = [r[key] for r in runs]
+        return f"median {statistics.median(values):7.0f} ms  max {max(values):7.0f} ms"
+
+    print(f"{name:<26} first token: {stats('first_ms')}   complete: {stats('total_ms')}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--header", action="append", default=[])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--message", default="How is my gait symmetry and what should I watch for?")
+    parser.add_argument("--pause", type=float, default=4.0)
+    args = parser.parse_args()
+    headers = dict(h.split(": ", 1) for h in args.header)
+
+    results = {"POST /chat/message": [], "POST /chat/message/stream": []}
+    for run in range(args.runs):
+        for name, measure in (("POST /chat/message", plain), ("POST /chat/message/stream", streamed)):
+            result = measure(args, headers)
+            results[name].append(result)
+            print(f"run {run + 1} {name:<26} first {result['first_ms']:6.0f} ms  complete {result['total_ms']:6.0f} ms  "
+                  f"{result['chars']} chars" + (f" in {result['chunks']} chunks" if "chunks" in result else ""))
+            time.sleep(args.pause)
+
+    print()
+    for name, runs in results.items():
+        summary(name, runs)
+    plain_first = statistics.median(r["first_ms"] for r in results["POST /chat/message"])
+    stream_first = statistics.median(r["first_ms"] for r in results["POST /chat/message/stream"])
+    print(f"\nMedian time-to-first-token: {plain_first:.0f} ms -> {stream_first:.0f} ms "
+          f"({plain_first / max(stream_first, 1e-9):.1f}x sooner)")
+
+if __name__ == "__main__":
+    main()
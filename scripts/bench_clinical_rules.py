@@ -0,0 +1,129 @@
+"""
+Equivalence check and per-record cost of the compiled clinical rules.
+
+    python scripts/bench_clinical_rules.py [rows]
+
+1. Checks clinical_rules.evaluate (compiled, one record) against
+   evaluate_records (vectorized) on every output: labels, health score,
+   overall risk, alerts, recommendations, interpretations and profile flags.
+   Rows mix patients from several cohorts, one of them with threshold
+   overrides, plus rows sitting exactly on the thresholds and rows with missing
+   fields. Exits non-zero on the first mismatch.
+2. Checks that re-scoring (services/rescoring.py) an already-scored record
+   changes nothing: the labels computed on insert, from the whole patient
+   profile, against AIEngine.score_records on the profile fields the re-scoring
+   job loads. Cohort patients must keep their cohort's labels.
+3. Reports the per-record cost of one evaluate() call, of the four separate
+   AIEngine calls consumers used to make, and of evaluate_records at several
+   batch sizes.
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services import clinical_rules
+from app.services.ai_engine import ai_engine
+from app.services.clinical_rules import ALERTS, INTERPRETATIONS, PROFILE_FLAGS, RECOMMENDATIONS, messages
+from app.services.rescoring import scoring_profile
+
+from bench_batch_scoring import edge_records, random_columns, to_records
+
+COHORTS = (None, "transtibial", "transfemoral")
+OVERRIDES = {"transfemoral": {"walking_speed_min": 0.55, "gait_symmetry_min": 0.7, "health_score_consult": 55}}
+
+def sample_records(rows: int) -> list:
+    rng = np.random.default_rng(17)
+    records = to_records(random_columns(rows), rows) + edge_records()
+    for record in records:
+        level = COHORTS[rng.integers(len(COHORTS))]
+        if level:
+            record["profile"] = {**record.get("profile", {}), "amputation_level": level.title()}
+    return records
+
+def row_of(batch: dict, i: int) -> dict:
+    return {
+        "gait_abnormality": str(batch["gait_abnormality"][i]),
+        "skin_risk": str(batch["skin_risk"][i]),
+        "prosthetic_health_score": float(batch["prosthetic_health_score"][i]),
+        "overall_risk": str(batch["overall_risk"][i]),
+        "alerts": batch["alert_messages"][i],
+        "recommendations": batch["recommendation_messages"][i],
+        "interpretations": {f: str(batch["interpretations"][f][i]) for f in INTERPRETATIONS},
+        "profile_flags": {
+            f: label if batch["profile_flags"][f][i] else None for f, (_, label) in PROFILE_FLAGS.items()
+        },
+    }
+
+def check(records: list):
+    batch = clinical_rules.evaluate_records(records)
+    batch["alert_messages"] = messages(batch["alerts"], ALERTS)
+    batch["recommendation_messages"] = messages(batch["recommendations"], RECOMMENDATIONS)
+    for i, record in enumerate(records):
+        expected, got = clinical_rules.evaluate(record), row_of(batch, i)
+        if expected != got:
+            sys.exit(f"MISMATCH at row {i}: {record}\n  compiled   {expected}\n  vectorized {got}")
+    print(f"  {len(records):,} rows identical on every output")
+
+def check_rescoring(records: list):
+    # A stored profile holds more than the rules read
+    stored = [{**r, "profile": {"name": "Bench", "gender": "Female", "age": 60, **r.get("profile", {})}} for r in records]
+    rescored = ai_engine.score_records([{**r, "profile": scoring_profile(r["profile"])} for r in stored])
+    changed = 0
+    for i, record in enumerate(stored):
+        on_insert = clinical_rules.evaluate(record)
+        if any(on_insert[key] != rescored[key][i] for key in ("gait_abnormality", "skin_risk", "prosthetic_health_score")):
+            changed += 1
+            if changed == 1:
+                print(f"  first changed row {i}: {record}")
+    if changed:
+        sys.exit(f"Re-scoring changed the labels of {changed:,} already-scored rows")
+    print(f"  {len(records):,} already-scored rows keep their labels")
+
+def per_record_us(fn, records: list) -> float:
+    start = time.perf_counter()
+    fn(records)
+    return (time.perf_counter() - start) / len(records) * 1e6
+
+def main(rows: int):
+    clinical_rules.COHORT_OVERRIDES.update(OVERRIDES)
+    clinical_rules._rule_sets.clear()
+    records = sample_records(rows)
+
+    print("Equivalence (with transfemoral overrides)")
+    check(records)
+    overridden = clinical_rules.rule_set("transfemoral").thresholds
+    print(f"  transfemoral thresholds: { {k: overridden[k] for k in OVERRIDES['transfemoral']} }")
+
+    print("\nRe-scoring")
+    check_rescoring(records)
+
+    def compiled(batch):
+        for record in batch:
+            clinical_rules.evaluate(record)
+
+    def four_calls(batch):
+        for record in batch:
+            ai_engine.analyze_gait(record)
+            ai_engine.analyze_skin_risk(record)
+            ai_engine.calculate_prosthetic_health_score(record)
+            ai_engine.determine_overall_risk(record)
+
+    print(f"\nPer-record cost ({len(records):,} records)")
+    compiled(records[:1000]) # warm up
+    print(f"  evaluate (compiled, all outputs):   {per_record_us(compiled, records):8.2f} us")
+    print(f"  four AIEngine calls (labels only):  {per_record_us(four_calls, records):8.2f} us")
+    for size in (1, 100, 10_000):
+        batches = [records[i:i + size] for i in range(0, min(len(records), size * 200), size)]
+        count = sum(len(b) for b in batches)
+        start = time.perf_counter()
+        for batch in batches:
+            clinical_rules.evaluate_records(batch)
+        cost = (time.perf_counter() - start) / count * 1e6
+        print(f"  evaluate_records, batches of {size:>6,}: {cost:8.2f} us")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,98 @@
+"""
+Latency benchmark for gait anomaly inference.
+
+    python scripts/bench_gait_anomaly.py [--registry DIR] [--budget-ms 1.0]
+
+Without --registry, trains population and cohort models on synthetic records
+into a temporary registry. Then:
+
+1. checks the exported traversal against sklearn's decision_function, and
+   that a record missing a feature (an upload without skin channels) gets no
+   score rather than one from NaN comparisons the models were never trained on,
+2. times single-record scoring through AIEngine.gait_anomaly_fields (the path
+   used by /patient/daily-input), first call excluded,
+3. reports batch throughput.
+
+Exits non-zero when a record missing a feature is scored or the p99 single-record latency is not below --budget-ms.
+"""
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services import anomaly_models
+from app.services.ai_engine import ai_engine
+from app.services.anomaly_models import FEATURES, ModelRegistry, train_version
+
+def synth_records(n: int, seed: int = 3) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centre = np.array([55, 100, 1.0, 0.9, 32, 55, 0.85, 9])
+    spread = np.array([8, 10, 0.15, 0.05, 1.0, 8, 0.08, 2.5])
+    return centre + rng.normal(size=(n, len(FEATURES))) * spread
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--registry")
+    parser.add_argument("--budget-ms", type=float, default=1.0)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    tmp = None
+    if args.registry:
+        registry = ModelRegistry(args.registry)
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        registry = ModelRegistry(tmp.name)
+        X = synth_records(20000)
+        cohorts = np.where(np.arange(len(X)) % 2, "transtibial", "transfemoral")
+        start = time.perf_counter()
+        manifest = train_version(X, cohorts, tmp.name, random_state=0)
+        registry.activate(manifest["version"])
+        print(f"Trained {len(manifest['cohorts'])} models on {len(X):,} synthetic records "
+              f"in {time.perf_counter() - start:.1f}s (sklearn equivalence checked)")
+
+    if registry.get() is None:
+        sys.exit("No active model version in the registry")
+    anomaly_models.registry = registry
+
+    profile = {"amputation_level": "Transtibial"}
+    records = [dict(zip(FEATURES, row)) for row in synth_records(args.iterations, seed=9).tolist()]
+    print(f"Model: {ai_engine.gait_anomaly_fields(records[:1], profile)[0]}")
+    partial = {f: v for f, v in records[0].items() if f not in ("skin_temperature_c", "skin_moisture")}
+    fields = ai_engine.gait_anomaly_fields([partial, records[0]], profile)
+    if fields[0] or fields[1] != ai_engine.gait_anomaly_fields(records[:1], profile)[0]:
+        sys.exit(f"FAIL: a record without skin metrics was scored, or changed its neighbour's score: {fields}")
+    print("A record without skin metrics gets no anomaly score")
+
+    timings = []
+    for record in records:
+        start = time.perf_counter()
+        ai_engine.gait_anomaly_fields([record], profile)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p50 = statistics.median(timings)
+    p99 = timings[int(len(timings) * 0.99)]
+    print(f"Single record: p50 {p50:.3f} ms, p99 {p99:.3f} ms, max {timings[-1]:.3f} ms")
+
+    batch = synth_records(100_000, seed=4)
+    loaded = registry.get()
+    _, model = loaded.model_for("transtibial")
+    start = time.perf_counter()
+    model.decision_function(batch)
+    elapsed = time.perf_counter() - start
+    print(f"Batch: {len(batch):,} records in {elapsed * 1000:.0f} ms ({len(batch) / elapsed:,.0f} records/s)")
+
+    if tmp:
+        tmp.cleanup()
+    if p99 >= args.budget_ms:
+        sys.exit(f"FAIL: p99 {p99:.3f} ms exceeds the {args.budget_ms} ms budget")
+    print(f"OK: p99 below {args.budget_ms} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Report averages: the old in-Python averaging against the windowed Mongo
+aggregation (analysis_engine.window_stats), on patients with years of data.
+
+    python scripts/bench_health_summary.py [--mongo-uri mongodb://localhost:27017]
+                                           [--patients 50] [--years 3] [--runs 20] [--keep]
+
+Seeds one daily_metrics record per patient per day into a scratch database
+(prothex_bench, dropped afterwards unless --keep), with the indexes
+database.py creates. Then:
+
+1. Checks every window's aggregation against the same window averaged in
+   Python, including the classification of the latest record. The first
+   patient has no skin metrics, whose averages must come back None. Exits
+   non-zero on a mismatch.
+2. Times per patient: the old query (100 unsorted documents, averaged in
+   Python), and the aggregation over 7, 30 and 90 days.
+3. Times all patients at once: one window_stats call against one aggregation
+   per patient.
+
+Never point --mongo-uri at a database holding real data you care about:
+the scratch database is dropped.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.analysis_engine import REPORT_METRICS, window_stats
+
+BENCH_DB = "prothex_bench"
+WINDOWS = (7, 30, 90)
+
+def make_record(rng: random.Random, patient_id, day: datetime, skin: bool = True) -> dict:
+    record = {
+        "patient_id": patient_id,
+        "created_at": day,
+        "step_length_cm": rng.gauss(60, 8),
+        "cadence_spm": rng.gauss(100, 10),
+        "walking_speed_mps": rng.gauss(1.0, 0.2),
+        "gait_symmetry_index": rng.uniform(0.6, 1.0),
+        "pressure_distribution_index": rng.uniform(0.5, 1.0),
+        "skin_temperature_c": rng.gauss(32, 1.5),
+        "skin_moisture": rng.gauss(50, 10),
+        "prosthetic_health_score": rng.uniform(40, 100),
+        "daily_wear_hours": rng.uniform(4, 14),
+        "gait_abnormality": rng.choice(["Normal", "Abnormal"]),
+        "skin_risk": rng.choice(["Low", "Medium", "High"]),
+    }
+    if rng.random() < 0.02: # Some older records lack a metric
+        del record["skin_moisture"]
+    if not skin: # Sensor uploads without skin channels
+        del record["skin_temperature_c"]
+        record.pop("skin_moisture", None)
+    return record
+
+async def seed(db, patients: int, years: float) -> list:
+    rng = random.Random(0)
+    await db["daily_metrics"].create_index("patient_id")
+    await db["daily_metrics"].create_index([("patient_id", 1), ("created_at", 1)])
+    today = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+    days = int(years * 365)
+    ids = []
+    for i in range(patients):
+        result = await db["patient_profiles"].insert_one({"name": "Bench"})
+        ids.append(result.inserted_id)
+        # Inserted in random order, as batch uploads and backfills leave them
+        records = [make_record(rng, result.inserted_id, today - timedelta(days=d), skin=i > 0) for d in range(days)]
+        rng.shuffle(records)
+        await db["daily_metrics"].insert_many(records, ordered=False)
+    return ids
+
+async def legacy_summary(db, patient_id) -> dict:
+    # get_patient_health_summary before the aggregation
+    daily_records = await db["daily_metrics"].find({"patient_id": patient_id}).limit(100).to_list(100)
+    averages = {name: sum(r.get(name, 0) for r in daily_records) / len(daily_records) for name in REPORT_METRICS}
+    last_record = daily_records[-1]
+    return {"averages": averages, "gait_abnormality": last_record.get("gait_abnormality", "Normal"),
+            "skin_risk": last_record.get("skin_risk", "Low")}
+
+async def expected(db, patient_id, window_days: int) -> dict:
+    since = datetime.now(timezone.utc) - timedelta(days=window_days)
+    records = await db["daily_metrics"].find(
+        {"patient_id": patient_id, "created_at": {"$gte": since}}
+    ).sort("created_at", 1).to_list(None)
+    averages = {}
+    for name in REPORT_METRICS:
+        values = [r[name] for r in records if name in r]
+        averages[name] = sum(values) / len(values) if values else None
+    return {"averages": averages, "records": len(records),
+            "gait_abnormality": records[-1]["gait_abnormality"], "skin_risk": records[-1]["skin_risk"]}
+
+def same_average(want, got) -> bool:
+    return want is got is None or (want is not None and got is not None and abs(want - got) < 1e-9)
+
+async def check(db, ids: list) -> bool:
+    ok = True
+    for window_days in WINDOWS:
+        stats = await window_stats(db, ids, window_days)
+        for patient_id in ids:
+            want, got = await expected(db, patient_id, window_days), stats[patient_id]
+            same = (
+                want["records"] == got["records"]
+                and want["gait_abnormality"] == got["gait_abnormality"]
+                and want["skin_risk"] == got["skin_risk"]
+                and all(same_average(want["averages"][n], got["averages"][n]) for n in REPORT_METRICS)
+            )
+            if not same:
+                print(f"MISMATCH patient {patient_id}, {window_days} days:\n  want {want}\n  got  {got}")
+                ok = False
+    return ok
+
+async def timed(label: str, fn, runs: int):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{label:<34} median {statistics.median(samples) * 1000:8.2f} ms   p95 {p95 * 1000:8.2f} ms")
+    return statistics.median(samples)
+
+async def run(db, args):
+    print(f"Seeding {args.patients} patients x {int(args.years * 365)} days...")
+    ids = await seed(db, args.patients, args.years)
+
+    if not await check(db, ids):
+        sys.exit("window_stats does not match the records")
+    print(f"window_stats matches the records for windows {WINDOWS}")
+
+    rng = random.Random(1)
+    pick = lambda: rng.choice(ids)
+    print("\nPer patient:")
+    await timed("old: 100 unsorted docs, Python", lambda: legacy_summary(db, pick()), args.runs)
+    for window_days in WINDOWS:
+        await timed(f"aggregation, {window_days} days", lambda: window_stats(db, [pick()], window_days), args.runs)
+
+    print(f"\nAll {len(ids)} patients, 30 days:")
+    one_each = await timed("one aggregation per patient",
+                           lambda: asyncio.gather(*(window_stats(db, [p], 30) for p in ids)), max(1, args.runs // 4))
+    batched = await timed("one batched window_stats", lambda: window_stats(db, ids, 30), max(1, args.runs // 4))
+    print(f"batched: {len(ids) / batched:.0f} patients/s ({one_each / batched:.1f}x)")
+
+async def main(args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(args.mongo_uri)
+    await client.drop_database(BENCH_DB)
+    try:
+        await run(client[BENCH_DB], args)
+    finally:
+        if not args.keep:
+            await client.drop_database(BENCH_DB)
+        client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded database")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,61 @@
+"""
+Login-burst benchmark for password verification.
+
+    python scripts/bench_login_throughput.py [concurrent_logins]
+
+Fires N concurrent verifications the way /auth/login does, once inline on the
+event loop (the old behaviour) and once through the hashing pool, while a
+heartbeat task measures how late the event loop wakes up. Reports logins/sec
+and the worst loop lag other requests would have seen.
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.security import pwd_context, verify_password, verify_and_update_password
+
+HEARTBEAT_S = 0.005
+
+async def heartbeat(stop: asyncio.Event, lags: list):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + HEARTBEAT_S
+        await asyncio.sleep(HEARTBEAT_S)
+        lags.append(max(0.0, loop.time() - expected))
+
+async def inline_login(password: str, hashed: str):
+    # Old handler: synchronous verify inside the coroutine
+    return verify_password(password, hashed)
+
+async def pooled_login(password: str, hashed: str):
+    return (await verify_and_update_password(password, hashed))[0]
+
+async def run(label: str, login, n: int, hashed: str):
+    stop, lags = asyncio.Event(), []
+    beat = asyncio.create_task(heartbeat(stop, lags))
+    await asyncio.sleep(HEARTBEAT_S * 2)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(login("correct horse battery", hashed) for _ in range(n)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await beat
+    assert all(results)
+    print(
+        f"{label:<8} {n / elapsed:8.1f} logins/s   "
+        f"max loop lag {max(lags, default=0) * 1000:8.1f} ms   "
+        f"total {elapsed:6.2f} s"
+    )
+
+async def main(n: int):
+    hashed = pwd_context.hash("correct horse battery")
+    print(f"{n} concurrent logins, hash: {hashed.split('$')[1]} {hashed.split('$')[3]}")
+    await run("inline", inline_login, n, hashed)
+    await run("pooled", pooled_login, n, hashed)
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
@@ -0,0 +1,122 @@
+"""
+Concurrent report downloads: PDF rendering inline on the event loop (the old
+handler) against the render process pool (services/pdf_pool.py).
+
+    python scripts/bench_pdf_downloads.py [concurrent_downloads] [--workers 2] [--max-queue 64]
+
+Fires N concurrent downloads of one sample report. A heartbeat task measures
+how late the event loop wakes up. That lateness is how long every other
+request on the worker would have stalled.
+
+- inline: the old handler. It renders, then writes the archive copy, both
+  synchronously in the coroutine.
+- pool: renders in the process pool, streams the bytes in chunks and writes
+  the archive copy in a thread.
+
+Reports downloads/sec, time to the first byte and the worst and p99 loop lag.
+Archive copies go to a temporary directory.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+HEARTBEAT_S = 0.005
+
+SAMPLE = {
+    "metrics": {
+        "avg_step_length_cm": 58.2, "avg_cadence_spm": 96.4, "avg_walking_speed_mps": 0.92,
+        "avg_gait_symmetry_index": 0.81, "avg_pressure_distribution_index": 0.74,
+        "avg_skin_temperature_c": 32.6, "avg_skin_moisture": 54.1,
+    },
+    "classification": {"gait_abnormality": "Normal", "skin_risk": "Medium",
+                       "prosthetic_health_score": 78.5, "overall_clinical_risk": "Moderate"},
+    "clinical_profile": {"gender": "Female", "height_cm": 168, "weight_kg": 71, "bmi": 25.2,
+                         "blood_pressure": "128/82", "blood_sugar_mg_dl": 104,
+                         "medical_conditions": ["Type 2 diabetes"], "amputation_level": "transtibial"},
+    "patient_name": "Bench Patient", "patient_age": 54, "window_days": 7, "recent_alerts": [],
+    "analysis": "Gait remains broadly stable with cadence and step length in the expected range, though the "
+                "symmetry index suggests mild favouring of the sound limb. Socket fit should be reviewed.",
+}
+
+async def heartbeat(stop: asyncio.Event, lags: list):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + HEARTBEAT_S
+        await asyncio.sleep(HEARTBEAT_S)
+        lags.append(max(0.0, loop.time() - expected))
+
+async def inline_download(n: int, out_dir: str) -> float:
+    from app.services.pdf_service import generate_medical_pdf
+
+    start = time.perf_counter()
+    buffer = generate_medical_pdf(SAMPLE)
+    with open(os.path.join(out_dir, f"inline_{n}.pdf"), "wb") as f:
+        f.write(buffer.getbuffer())
+    first_byte = time.perf_counter() - start
+    buffer.read()
+    return first_byte
+
+async def pooled_download(n: int, out_dir: str) -> float:
+    from app.routes.report import _archive, _chunks
+    from app.services.pdf_pool import pdf_pool
+    from app.services.pdf_service import render_medical_pdf
+
+    start = time.perf_counter()
+    pdf = await pdf_pool.render(render_medical_pdf, SAMPLE)
+    first_byte = None
+    async for _ in _chunks(pdf):
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+    await asyncio.to_thread(_archive, os.path.join(out_dir, f"pool_{n}.pdf"), pdf)
+    return first_byte
+
+async def run(label: str, download, n: int, out_dir: str):
+    stop, lags = asyncio.Event(), []
+    beat = asyncio.create_task(heartbeat(stop, lags))
+    await asyncio.sleep(HEARTBEAT_S * 2)
+
+    start = time.perf_counter()
+    first_bytes = await asyncio.gather(*(download(i, out_dir) for i in range(n)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await beat
+    lags.sort()
+    first_bytes.sort()
+    print(
+        f"{label:<7} {n / elapsed:7.1f} downloads/s   "
+        f"first byte p50 {first_bytes[len(first_bytes) // 2] * 1000:7.1f} ms   "
+        f"loop lag max {lags[-1] * 1000 if lags else 0:7.1f} ms  "
+        f"p99 {lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000 if lags else 0:7.1f} ms   "
+        f"total {elapsed:6.2f} s"
+    )
+
+async def main(args):
+    from app.services.pdf_pool import pdf_pool
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        # Warm both paths first: imports, and the pool's process start-up
+        await inline_download(-1, out_dir)
+        await asyncio.gather(*(pooled_download(-1 - i, out_dir) for i in range(args.workers)))
+
+        print(f"{args.downloads} concurrent downloads, {args.workers} render processes")
+        await run("inline", inline_download, args.downloads, out_dir)
+        await run("pool", pooled_download, args.downloads, out_dir)
+    pdf_pool.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("downloads", nargs="?", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2, help="PDF_RENDER_WORKERS")
+    parser.add_argument("--max-queue", type=int, default=64, help="Above the number of downloads, so none are refused")
+    args = parser.parse_args()
+    # Read by app.config when the pool is imported
+    os.environ["PDF_RENDER_WORKERS"] = str(args.workers)
+    os.environ["PDF_RENDER_MAX_QUEUE"] = str(args.max_queue)
+    asyncio.run(main(args))
@@ -0,0 +1,94 @@
+"""
+Report renders per second on one core: cached templates (services/pdf_templates.py)
+against building everything per render, as the code before them did.
+
+    python scripts/bench_pdf_templates.py [--seconds 5] [--no-logo]
+
+Renders in a loop in this process, so the rate is per core; the render pool
+(services/pdf_pool.py) runs one such loop per process.
+
+- cold: the styles, logo and templates are discarded before every render, so
+  each render creates the stylesheet, decodes the logo and builds the static
+  flowables, as every call to generate_medical_pdf used to.
+- warm: the templates are built once and each render fills in the patient's data.
+
+Both modes compress and encode the logo in every document; whether ReportLab's
+C accelerator (reportlab[accel]) does the ASCII85 part is printed first.
+
+Covers the on-demand medical report and the weekly report. Before timing, it
+checks that each report renders byte-for-byte the same warm as cold, and exits
+non-zero on a difference.
+"""
+import argparse
+import datetime
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from reportlab import rl_config
+from reportlab.lib import rl_accel
+
+from app.services import pdf_templates
+from app.services.pdf_service import render_medical_pdf, render_weekly_pdf
+
+from bench_pdf_downloads import SAMPLE
+
+WEEKLY = {
+    "start_date": datetime.datetime(2026, 1, 5), "end_date": datetime.datetime(2026, 1, 12),
+    "avg_symmetry": 0.81, "avg_walking_speed": 0.92, "avg_health_score": 78.5,
+    "abnormal_count": 2, "high_skin_risk_count": 1,
+}
+
+REPORTS = {
+    "medical": lambda: render_medical_pdf(SAMPLE),
+    "weekly": lambda: render_weekly_pdf("Bench Patient", WEEKLY),
+}
+
+def discard_templates():
+    for cached in (pdf_templates.styles, pdf_templates.logo, pdf_templates.template):
+        cached.cache_clear()
+
+def rate(render, seconds: float, cold: bool) -> float:
+    renders, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        if cold:
+            discard_templates()
+        render()
+        renders += 1
+    return renders / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5, help="per report and mode")
+    parser.add_argument("--no-logo", action="store_true", help="Time the reports without the logo")
+    args = parser.parse_args()
+
+    if args.no_logo:
+        pdf_templates.LOGO_PATH = "/nonexistent/logo.png"
+    accelerated = type(rl_accel.asciiBase85Encode).__name__ == "builtin_function_or_method"
+    print(f"ReportLab C accelerator: {'yes' if accelerated else 'no, install reportlab[accel]'}")
+    # Fixed document ID and dates, and the same clock reading, so renders can be compared byte for byte
+    rl_config.invariant = 1
+    fixed = datetime.datetime(2026, 1, 12, 9, 30)
+    pdf_templates.datetime = type("FixedDatetime", (datetime.datetime,), {"now": classmethod(lambda cls, tz=None: fixed)})
+
+    for name, render in REPORTS.items():
+        discard_templates()
+        cold_pdf = render()
+        if render() != cold_pdf:
+            sys.exit(f"{name}: a warm render differs from a cold one")
+    print(f"Warm renders match cold ones; {len(cold_pdf) / 1024:.0f} KiB weekly report"
+          + (" (no logo)" if args.no_logo else ""))
+
+    for name, render in REPORTS.items():
+        cold = rate(render, args.seconds, cold=True)
+        discard_templates()
+        render()
+        warm = rate(render, args.seconds, cold=False)
+        print(f"{name:<8} cold {cold:7.1f} renders/s ({1000 / cold:6.2f} ms)   "
+              f"warm {warm:7.1f} renders/s ({1000 / warm:6.2f} ms)   {warm / cold:5.1f}x")
+
+if __name__ == "__main__":
+    main()
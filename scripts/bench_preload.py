@@ -0,0 +1,131 @@
+"""
+Startup report for preload mode: per-worker memory and first-request latency
+with PRELOAD_HEAVY_MODULES off and on.
+
+    python scripts/bench_preload.py [--workers 4] [--path /report/patient/download-report]
+                                    [--header "Authorization: Bearer ..."] [--app app.main:app]
+
+For each mode, starts gunicorn with gunicorn.conf.py and waits until every
+worker has logged its startup report. It then reads each worker's RSS and PSS
+(PSS divides shared pages between the processes mapping them, so its sum is
+the real footprint). Next it sends one request per worker to --path and
+collects each worker's logged first-request latency. The app needs a reachable
+MONGO_URI, and heavy paths need a valid token in --header.
+
+Also measures what the first heavy request on a lazy worker pays for imports:
+preload.warm() timed in a fresh interpreter.
+"""
+import argparse
+import os
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from app.core.preload import memory_usage
+
+READY = re.compile(r"Worker (\d+) ready")
+FIRST = re.compile(r"Worker (\d+) first request \S+ \S+ took (\d+) ms")
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def worker_pids(master: int) -> list:
+    try:
+        return [int(pid) for pid in Path(f"/proc/{master}/task/{master}/children").read_text().split()]
+    except OSError:
+        return []
+
+def request(url: str, headers: dict) -> float:
+    start = time.perf_counter()
+    req = urllib.request.Request(url, headers={**headers, "Connection": "close"})
+    try:
+        with urllib.request.urlopen(req, timeout=120) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        e.read()
+    return (time.perf_counter() - start) * 1000
+
+def run_mode(args, preload: bool) -> dict:
+    port = free_port()
+    env = {**os.environ, "PRELOAD_HEAVY_MODULES": str(preload).lower(),
+           "WEB_CONCURRENCY": str(args.workers), "PORT": str(port)}
+    log = tempfile.NamedTemporaryFile("w+", suffix=".log")
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", args.app, "-c", str(ROOT / "gunicorn.conf.py"), "--bind", f"127.0.0.1:{port}"],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    try:
+        while len(set(READY.findall(Path(log.name).read_text()))) < args.workers:
+            if server.poll() is not None or time.perf_counter() - started > args.timeout:
+                sys.exit(f"gunicorn did not start:\n{Path(log.name).read_text()[-3000:]}")
+            time.sleep(0.1)
+        ready_s = time.perf_counter() - started
+        pids = worker_pids(server.pid)
+        at_start = {pid: memory_usage(pid) for pid in pids}
+
+        # New connections are spread over the workers; keep going until each has served one
+        headers = dict(h.split(": ", 1) for h in args.header)
+        client_ms = []
+        url = f"http://127.0.0.1:{port}{args.path}"
+        while len(set(FIRST.findall(Path(log.name).read_text()))) < args.workers and len(client_ms) < args.workers * 20:
+            client_ms.append(request(url, headers))
+        time.sleep(0.2)
+        first = {int(pid): float(ms) for pid, ms in FIRST.findall(Path(log.name).read_text())}
+        after = {pid: memory_usage(pid) for pid in pids}
+        master = memory_usage(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+        log.close()
+    return {"ready_s": ready_s, "pids": pids, "at_start": at_start, "after": after,
+            "first": first, "client_ms": client_ms, "master": master}
+
+def cold_import_ms() -> float:
+    code = "import time; s = time.perf_counter(); from app.core.preload import warm; warm(); print((time.perf_counter() - s) * 1000)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def report(name: str, result: dict):
+    print(f"\n{name}: {len(result['pids'])} workers ready in {result['ready_s']:.1f}s "
+          f"(master RSS {result['master']['rss_mb']:.0f} MB)")
+    print(f"  {'pid':>7}  {'RSS start':>9}  {'PSS start':>9}  {'RSS after':>9}  {'PSS after':>9}  {'first req':>9}")
+    for pid in result["pids"]:
+        start, after = result["at_start"][pid], result["after"][pid]
+        first = result["first"].get(pid)
+        print(f"  {pid:>7}  {start['rss_mb']:>6.0f} MB  {start.get('pss_mb', 0):>6.0f} MB  "
+              f"{after['rss_mb']:>6.0f} MB  {after.get('pss_mb', 0):>6.0f} MB  "
+              f"{f'{first:.0f} ms' if first is not None else '-':>9}")
+    pss = sum(result["after"][pid].get("pss_mb", 0) for pid in result["pids"])
+    firsts = list(result["first"].values())
+    print(f"  total worker PSS {pss:.0f} MB; first-request latency median "
+          f"{statistics.median(firsts) if firsts else float('nan'):.0f} ms, max {max(firsts, default=float('nan')):.0f} ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--header", action="append", default=[])
+    parser.add_argument("--app", default="app.main:app")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    print(f"Cold import + warm-up a lazy worker pays on first heavy use: {cold_import_ms():.0f} ms")
+    report("Lazy (PRELOAD_HEAVY_MODULES=false)", run_mode(args, preload=False))
+    report("Preloaded (PRELOAD_HEAVY_MODULES=true)", run_mode(args, preload=True))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Ingest benchmark: CSV text vs packed binary (.pxg) for the same recording.
+
+    python scripts/bench_upload_formats.py [minutes] [sample_rate_hz] [channels]
+
+Both payloads go through ingest_upload exactly as /patient/upload-gait runs it,
+including bucket packing. Bucket writes go to an in-memory sink so the numbers
+measure decoding and packing, not Mongo.
+"""
+import asyncio
+import io
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from bson import ObjectId
+from starlette.datastructures import UploadFile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.sensor_ingest import ingest_upload, encode_pxg
+
+class _SinkCollection:
+    async def find_one(self, *args, **kwargs):
+        return None # No earlier upload of the same file
+
+    async def insert_one(self, doc):
+        return type("Result", (), {"inserted_id": ObjectId()})()
+
+    async def update_one(self, *args, **kwargs):
+        return None
+
+    async def delete_many(self, *args, **kwargs):
+        return None
+
+    async def delete_one(self, *args, **kwargs):
+        return None
+
+class _SinkDB(dict):
+    def __missing__(self, name):
+        self[name] = _SinkCollection()
+        return self[name]
+
+def build_recording(minutes: float, fs: float, channel_count: int):
+    rng = np.random.default_rng(3)
+    n = int(minutes * 60 * fs)
+    t = np.arange(n) / fs
+    values = rng.normal(50, 15, size=(n, channel_count)).astype(np.float32)
+    return [f"ch_{i}" for i in range(channel_count)], t, values
+
+def to_csv(channels, t, values) -> bytes:
+    buf = io.StringIO()
+    buf.write(",".join(["timestamp"] + channels) + "\n")
+    np.savetxt(buf, np.column_stack([t, values]), delimiter=",", fmt="%.6g")
+    return buf.getvalue().encode()
+
+async def time_ingest(payload: bytes, filename: str, runs: int = 3) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        file = UploadFile(io.BytesIO(payload), size=len(payload), filename=filename)
+        start = time.perf_counter()
+        result = await ingest_upload(_SinkDB(), file, ObjectId())
+        best = min(best, time.perf_counter() - start)
+    return best, result["row_count"]
+
+async def main(minutes: float, fs: float, channel_count: int):
+    logging.disable(logging.INFO)
+    channels, t, values = build_recording(minutes, fs, channel_count)
+    csv_payload = to_csv(channels, t, values)
+    pxg_payload = encode_pxg(channels, values, timestamps=t)
+    print(f"{len(t):,} samples x {channel_count} channels ({minutes:g} min at {fs:g} Hz)\n")
+    print(f"{'format':<8}{'bytes on wire':>16}{'ingest (best of 3)':>22}{'samples/s':>14}")
+    for label, payload, name in (("csv", csv_payload, "rec.csv"), ("pxg", pxg_payload, "rec.pxg")):
+        elapsed, rows = await time_ingest(payload, name)
+        assert rows == len(t)
+        print(f"{label:<8}{len(payload):>16,}{elapsed:>20.3f} s{rows / elapsed:>14,.0f}")
+
+if __name__ == "__main__":
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    fs = float(sys.argv[2]) if len(sys.argv) > 2 else 200
+    channel_count = int(sys.argv[3]) if len(sys.argv) > 3 else 12
+    asyncio.run(main(minutes, fs, channel_count))
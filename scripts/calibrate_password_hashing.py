@@ -0,0 +1,25 @@
+"""
+Pick Argon2 parameters for this host and print them as .env lines.
+
+    python scripts/calibrate_password_hashing.py [target_ms]
+
+Run it once on the production instance type and copy the output into the
+environment. All workers must share the same values, otherwise every login
+looks "outdated" to some worker and gets rehashed again.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import settings
+from app.core.security import calibrate_argon2
+
+target_ms = float(sys.argv[1]) if len(sys.argv) > 1 else settings.PASSWORD_HASH_TARGET_MS
+
+print(f"Calibrating Argon2 for ~{target_ms:.0f} ms per hash...")
+params = calibrate_argon2(target_ms=target_ms)
+print(f"Measured {params['measured_ms']} ms per hash\n")
+print(f"ARGON2_TIME_COST={params['time_cost']}")
+print(f"ARGON2_MEMORY_COST={params['memory_cost']}")
+print(f"ARGON2_PARALLELISM={params['parallelism']}")
@@ -0,0 +1,30 @@
+"""
+Move existing sensor_uploads documents into the time-bucketed sensor_buckets layout.
+
+    python scripts/migrate_sensor_uploads.py
+
+Handles both the original inline `sensor_data` list-of-dicts documents and the
+intermediate `sensor_upload_chunks` layout. Each upload is rewritten from
+scratch, so the script can be re-run after an interruption. Uploads that
+cannot be converted are logged, counted and left as they are.
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database import connect_to_mongo, close_mongo_connection, get_db
+from app.services.sensor_store import migrate_legacy_uploads
+
+async def main():
+    await connect_to_mongo()
+    try:
+        result = await migrate_legacy_uploads(get_db())
+        print(f"Migrated {result['uploads']} uploads ({result['samples']} samples) into sensor_buckets"
+              + (f"; skipped {result['skipped']}, see the log" if result["skipped"] else ""))
+    finally:
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+"""
+Generate the report summaries due, in batched AI calls, and cache them: the
+nightly job (services/narrative_precompute.py) run by hand.
+
+    python scripts/precompute_narratives.py [--batch-size 8] [--lookback-hours 48] [--limit N]
+
+Prints how many patients had new records, how many summaries were stored, and
+how many AI calls that took (one per download otherwise). With
+AI_BACKEND=standin it runs without spending Gemini quota.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import settings
+from app.database import connect_to_mongo, close_mongo_connection, get_db
+from app.services.narrative_precompute import precompute_narratives
+
+async def main(args):
+    await connect_to_mongo()
+    try:
+        start = time.perf_counter()
+        stats = await precompute_narratives(
+            get_db(), batch_size=args.batch_size, lookback_hours=args.lookback_hours, limit=args.limit
+        )
+        elapsed = time.perf_counter() - start
+        print(f"{stats['candidates']} patient(s) with new records, {stats['already_cached']} already cached")
+        print(f"{stats['stored']} summaries stored in {stats['calls']} AI call(s) "
+              f"({stats['missing']} missing from responses, {stats['failed_batches']} failed batch(es)) "
+              f"in {elapsed:.1f} s")
+    finally:
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=settings.NARRATIVE_BATCH_SIZE)
+    parser.add_argument("--lookback-hours", type=float, default=settings.NARRATIVE_LOOKBACK_HOURS)
+    parser.add_argument("--limit", type=int, help="At most this many patients")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,48 @@
+"""
+Bring stored daily_metrics labels up to the current ai_engine.SCORING_VERSION.
+
+    python scripts/rescore_daily_metrics.py [--batch-size 5000] [--max-duty 0.5]
+                                            [--target-write-ms 500] [--limit N] [--status]
+
+Resumes from the saved checkpoint, so it can simply be started again after a
+crash or Ctrl-C. --max-duty 1.0 disables throttling (e.g. in a maintenance window).
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import settings
+from app.database import connect_to_mongo, close_mongo_connection, get_db
+from app.services.rescoring import RescoringBusy, get_rescoring_status, run_rescoring
+
+async def main(args):
+    await connect_to_mongo()
+    try:
+        if args.status:
+            print(await get_rescoring_status(get_db()) or "No re-scoring run for the current version")
+            return
+        try:
+            checkpoint = await run_rescoring(
+                get_db(),
+                batch_size=args.batch_size,
+                max_duty=args.max_duty,
+                target_write_ms=args.target_write_ms,
+                limit=args.limit
+            )
+        except RescoringBusy as e:
+            sys.exit(str(e))
+        print(f"{checkpoint['status']}: {checkpoint['processed']} records re-scored (last _id {checkpoint['last_id']})")
+    finally:
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=settings.RESCORE_BATCH_SIZE)
+    parser.add_argument("--max-duty", type=float, default=settings.RESCORE_MAX_DUTY)
+    parser.add_argument("--target-write-ms", type=float, default=settings.RESCORE_TARGET_WRITE_MS)
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--status", action="store_true", help="Show the checkpoint and exit")
+    asyncio.run(main(parser.parse_args()))
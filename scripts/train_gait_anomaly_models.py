@@ -0,0 +1,90 @@
+"""
+Train gait anomaly models on historical daily_metrics and publish them to the registry.
+
+    python scripts/train_gait_anomaly_models.py [--estimators 100] [--contamination auto]
+                                                [--min-cohort 200] [--no-activate]
+    python scripts/train_gait_anomaly_models.py --list
+    python scripts/train_gait_anomaly_models.py --activate <version>
+
+Fits one population IsolationForest on every valid record (walking speed > 0)
+and one per amputation-level cohort with enough records, writes them as a new
+version under GAIT_MODEL_DIR and, unless --no-activate is given, points
+CURRENT at it. Running workers pick the new version up on their next request.
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import settings
+from app.database import connect_to_mongo, close_mongo_connection, get_db
+from app.services.anomaly_models import FEATURES, ModelRegistry, cohort_of, feature_matrix, train_version
+
+async def load_training_data(db):
+    profiles = {
+        p["_id"]: cohort_of(p)
+        async for p in db["patient_profiles"].find({}, {"amputation_level": 1})
+    }
+    records, cohorts = [], []
+    cursor = db["daily_metrics"].find(
+        {"walking_speed_mps": {"$gt": 0}},
+        {**{f: 1 for f in FEATURES}, "patient_id": 1}
+    ).batch_size(10000)
+    async for r in cursor:
+        if any(r.get(f) is None for f in FEATURES):
+            continue
+        records.append(r)
+        cohorts.append(profiles.get(r["patient_id"]))
+    return feature_matrix(records), cohorts
+
+async def train(args, registry: ModelRegistry):
+    await connect_to_mongo()
+    try:
+        X, cohorts = await load_training_data(get_db())
+    finally:
+        await close_mongo_connection()
+    if len(X) < args.min_records:
+        sys.exit(f"Only {len(X)} usable daily_metrics records; need at least {args.min_records}")
+
+    contamination = args.contamination if args.contamination == "auto" else float(args.contamination)
+    manifest = train_version(
+        X, cohorts, settings.GAIT_MODEL_DIR,
+        n_estimators=args.estimators,
+        contamination=contamination,
+        min_cohort_samples=args.min_cohort
+    )
+    for name, info in manifest["cohorts"].items():
+        print(f"  {name}: {info['n_samples']} records, {info['nodes']} nodes")
+    if args.no_activate:
+        print(f"Trained version {manifest['version']} (not activated)")
+    else:
+        registry.activate(manifest["version"])
+        print(f"Trained and activated version {manifest['version']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--estimators", type=int, default=100)
+    parser.add_argument("--contamination", default="auto")
+    parser.add_argument("--min-cohort", type=int, default=settings.GAIT_MODEL_MIN_COHORT_SAMPLES)
+    parser.add_argument("--min-records", type=int, default=100)
+    parser.add_argument("--no-activate", action="store_true")
+    parser.add_argument("--list", action="store_true", help="List trained versions")
+    parser.add_argument("--activate", metavar="VERSION", help="Switch CURRENT to an existing version")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(settings.GAIT_MODEL_DIR)
+    if args.list:
+        active = registry.active_version()
+        for version in registry.versions():
+            print(f"{'*' if version == active else ' '} {version}")
+        return
+    if args.activate:
+        registry.activate(args.activate)
+        print(f"Activated version {args.activate}")
+        return
+    asyncio.run(train(args, registry))
+
+if __name__ == "__main__":
+    main()